@@ -0,0 +1,166 @@
+import csv
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+log = logging.getLogger("loggingnight-airports")
+
+AIRPORT_CSV = os.environ.get(
+    "LN_AIRPORT_CSV",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "airports.csv"),
+)
+
+# Identifier columns in the order they win when two airports claim the same code
+IDENTIFIER_COLUMNS = ("ident", "icao_code", "gps_code", "local_code", "iata_code")
+
+
+class Airport(NamedTuple):
+    ident: str
+    name: str
+    city: str
+    state_code: str
+    latitude: float
+    longitude: float
+
+
+def degrees_to_seconds(degrees: float, positive: str, negative: str) -> str:
+    """Takes signed decimal degrees and returns decimal seconds with hemisphere abbreviation
+    48.351840028 -> 174066.6241N"""
+    hemisphere = positive if degrees >= 0 else negative
+    return f"{abs(degrees) * 3600:.4f}{hemisphere}"
+
+
+class AirportDatabase:
+    """An in-memory index of an OurAirports-style airports.csv
+
+    Every airport is stored once in a list and found through a dict keyed by
+    each of its identifiers, so KDPA, DPA and an IATA code all resolve to the
+    same record.  The file is read the first time it's needed.
+    """
+
+    def __init__(self, path=AIRPORT_CSV):
+        self.path = path
+        self.airports: list[Airport] = []
+        self.index: dict[str, int] = {}
+        self._loaded = False
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._loaded:
+            return
+
+        with self._lock:
+            if self._loaded:
+                return
+
+            if not os.path.exists(self.path):
+                log.info("No airport database at %s, using the web API", self.path)
+                self._loaded = True
+                return
+
+            started = time.perf_counter()
+            airports: list[Airport] = []
+            identifiers: list[tuple[str, ...]] = []
+            with open(self.path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    if row.get("type") == "closed":
+                        continue
+                    try:
+                        latitude = float(row["latitude_deg"])
+                        longitude = float(row["longitude_deg"])
+                    except (KeyError, ValueError):
+                        continue
+
+                    region = row.get("iso_region", "")
+                    airports.append(
+                        Airport(
+                            ident=row["ident"].upper(),
+                            name=row.get("name", ""),
+                            city=row.get("municipality", ""),
+                            state_code=region.split("-", 1)[-1],
+                            latitude=latitude,
+                            longitude=longitude,
+                        )
+                    )
+                    identifiers.append(
+                        tuple(
+                            (row.get(column) or "").strip().upper()
+                            for column in IDENTIFIER_COLUMNS
+                        )
+                    )
+
+            index: dict[str, int] = {}
+            for column in range(len(IDENTIFIER_COLUMNS)):
+                for i, codes in enumerate(identifiers):
+                    if codes[column]:
+                        index.setdefault(codes[column], i)
+
+            self.airports = airports
+            self.index = index
+            self.load_seconds = time.perf_counter() - started
+            self._loaded = True
+            log.info(
+                "Loaded %d airports from %s in %.3f seconds",
+                len(airports),
+                self.path,
+                self.load_seconds,
+            )
+
+    def __len__(self):
+        self.load()
+        return len(self.airports)
+
+    def index_of(self, code: str) -> int | None:
+        self.load()
+        return self.index.get(code.strip().upper())
+
+    def get(self, code: str) -> Airport | None:
+        i = self.index_of(code)
+        if i is None:
+            return None
+        return self.airports[i]
+
+    def locate(self, code: str) -> dict | None:
+        """Just the identifier and coordinates, shaped like lookup()'s
+        response, for airports whose city may not be known"""
+        airport = self.get(code)
+        if airport is None:
+            return None
+
+        return {
+            "response": {
+                "ident": airport.ident,
+                "latitude_secs": degrees_to_seconds(airport.latitude, "N", "S"),
+                "longitude_secs": degrees_to_seconds(airport.longitude, "E", "W"),
+            },
+        }
+
+    def lookup(self, code: str) -> dict | None:
+        """Return the airport shaped like an api.aeronautical.info web_query() result"""
+        airport = self.get(code)
+        if airport is None or not airport.city:
+            return None
+
+        return {
+            "query_stats": {
+                "final_url": self.path,
+                "query_time": 0.0,
+                "status_code": 200,
+                "status_text": "OK",
+                "from_cache": True,
+            },
+            "response": {
+                "ident": airport.ident,
+                "name": airport.name,
+                "city": airport.city,
+                "state_code": airport.state_code,
+                "latitude_secs": degrees_to_seconds(airport.latitude, "N", "S"),
+                "longitude_secs": degrees_to_seconds(airport.longitude, "E", "W"),
+            },
+        }
+
+
+# vi: modeline tabstop=8 expandtab shiftwidth=4 softtabstop=4 syntax=python
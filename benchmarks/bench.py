@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+RESPONSES = os.path.join(HERE, "responses.json")
+
+log = logging.getLogger("loggingnight-benchmark")
+
+SCENARIOS = (
+    "construct",
+    "construct_cold_cache",
+    "construct_warm_cache",
+    "web_lookup_cold",
+    "web_lookup_warm",
+    "web_index",
+    "usno_provider",
+    "starfield_provider",
+)
+
+
+class StandIn:
+    """Replays recorded api.aeronautical.info and USNO responses on localhost
+
+    Every response waits latency seconds, give or take up to jitter, to look
+    like a real upstream.  Airports are matched by identifier and USNO
+    requests by the nearest recorded airport to the requested coordinates;
+    the recorded sun times are returned whatever date is asked for.
+    """
+
+    def __init__(self, recordings, latency=0.0, jitter=0.0, seed=0):
+        self.recordings = recordings
+        self.latency = latency
+        self.jitter = jitter
+        self.served = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.locations = {
+            ident: (
+                parse_secs(info["latitude_secs"]),
+                parse_secs(info["longitude_secs"]),
+            )
+            for ident, info in recordings["airportinfo"].items()
+        }
+
+    def delay(self):
+        with self._lock:
+            self.served += 1
+            jitter = self._random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, self.latency + jitter))
+
+    def respond(self, path, query):
+        if path.startswith("/airportinfo"):
+            airport = query.get("airport", [""])[0].upper()
+            return 200, self.recordings["airportinfo"].get(airport, {})
+
+        if path.startswith("/usno"):
+            try:
+                lat, lng = (float(c) for c in query["coords"][0].split(","))
+            except (KeyError, ValueError):
+                return 400, {"error": "Bad coords"}
+            nearest = min(
+                self.locations,
+                key=lambda ident: (self.locations[ident][0] - lat) ** 2
+                + (self.locations[ident][1] - lng) ** 2,
+            )
+            return 200, self.recordings["usno"][nearest]
+
+        return 404, {"error": "Not found"}
+
+    def start(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                parts = urlsplit(self.path)
+                standin.delay()
+                status, body = standin.respond(parts.path, parse_qs(parts.query))
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="standin", daemon=True
+        ).start()
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def parse_secs(seconds: str) -> float:
+    """150868.0800N -> 41.9078"""
+    degrees = float(seconds[:-1]) / 3600
+    return -degrees if seconds[-1] in "SW" else degrees
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(name, latencies, errors, seconds, upstream_requests):
+    ordered = sorted(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "name": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 2) if seconds else None,
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else None,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else None,
+        "upstream_requests": upstream_requests,
+    }
+
+
+def run_concurrently(func, jobs, concurrency):
+    """Call func(*job) for every job on concurrency threads, timing each call"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def timed(job):
+        started = time.perf_counter()
+        try:
+            func(*job)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, jobs))
+    seconds = time.perf_counter() - started
+
+    for error in sorted(set(errors))[:5]:
+        log.warning("%s", error)
+    return latencies, len(errors), seconds
+
+
+def make_jobs(idents, first_date, count):
+    """count distinct (airport, date) pairs, cycling through the airports"""
+    return [
+        (
+            idents[i % len(idents)],
+            first_date + datetime.timedelta(days=i // len(idents)),
+        )
+        for i in range(count)
+    ]
+
+
+def isolate(workdir):
+    """Point every file and cache the app uses into workdir so runs don't share state
+
+    Anything already set in the environment wins, so LN_CACHE_BACKEND=redis
+    (say) benchmarks that backend instead.
+    """
+    for name, value in {
+        "LN_CACHE_BACKEND": "sqlite",
+        "LN_CACHE_NAME": os.path.join(workdir, "loggingnight_cache"),
+        "LN_AIRPORT_CSV": os.path.join(workdir, "airports.csv"),
+        "LN_NIGHT_TABLE": os.path.join(workdir, "nighttable.bin"),
+        "LN_TZ_CACHE": os.path.join(workdir, "timezones.json"),
+        "LN_PREWARM_AT": "",
+        "LN_WARMUP": "off",
+        "LN_LOGLEVEL": "error",
+        "ENVIRONMENT": "production",
+    }.items():
+        os.environ.setdefault(name, value)
+    # Benchmark traffic isn't worth reporting
+    os.environ.pop("SENTRY_DSN", None)
+
+
+class Benchmark:
+    """The scenarios, run against the stand-in upstream"""
+
+    def __init__(self, standin, recordings, requests, concurrency):
+        # The web app finds its templates relative to the working directory
+        os.chdir(os.path.dirname(HERE))
+        # pylint: disable=import-outside-toplevel
+        import loggingnight
+        import webapp
+
+        self.ln = loggingnight
+        self.webapp = webapp
+        self.standin = standin
+        self.recordings = recordings
+        self.requests = requests
+        self.concurrency = concurrency
+        self.idents = sorted(recordings["airportinfo"])
+        self.first_date = datetime.date.fromisoformat(recordings["date"])
+
+        base_url = standin.start()
+        loggingnight.LoggingNight.AIRPORTINFO_URL = f"{base_url}/airportinfo/"
+        loggingnight.USNOProvider.USNO_URL = f"{base_url}/usno"
+
+        # Load the time zone finder and friends outside of any measurement
+        loggingnight.warm_up()
+        loggingnight.LoggingNight.disable_cache()
+
+        self._server = None
+        self._local = threading.local()
+
+    def measure(self, func, jobs):
+        """Run jobs concurrently, returning the summarize() arguments"""
+        served = self.standin.served
+        latencies, errors, seconds = run_concurrently(func, jobs, self.concurrency)
+        return latencies, errors, seconds, self.standin.served - served
+
+    def jobs(self, offset=0):
+        return make_jobs(
+            self.idents,
+            self.first_date + datetime.timedelta(days=offset),
+            self.requests,
+        )
+
+    def reset(self, requests_cache=False):
+        self.ln.result_cache.clear()
+        self.ln.astro_cache.clear()
+        self.webapp.rendered_responses.clear()
+        if requests_cache:
+            self.ln.LoggingNight.enable_cache()
+            self.ln.requests_cache_module().get_cache().clear()
+        else:
+            self.ln.LoggingNight.disable_cache()
+
+    def construct(self, try_cache=False):
+        return self.measure(
+            lambda icao, date: self.ln.LoggingNight(icao, date, try_cache=try_cache),
+            self.jobs(),
+        )
+
+    def scenario_construct(self):
+        self.reset()
+        return self.construct()
+
+    def scenario_construct_cold_cache(self):
+        self.reset(requests_cache=True)
+        return self.construct(try_cache=True)
+
+    def scenario_construct_warm_cache(self):
+        self.reset(requests_cache=True)
+        self.construct(try_cache=True)
+        return self.construct(try_cache=True)
+
+    def start_webapp(self):
+        if self._server is None:
+            # pylint: disable=import-outside-toplevel
+            from werkzeug.serving import make_server
+
+            # One access log line per request would swamp the results
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            self._server = make_server(
+                "127.0.0.1", 0, self.webapp.application, threaded=True
+            )
+            threading.Thread(
+                target=self._server.serve_forever, name="webapp", daemon=True
+            ).start()
+        return self._server.server_port
+
+    def http(self, method, path, body=None):
+        # http.client, not requests, which requests_cache may have patched
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(
+                "127.0.0.1", self.start_webapp(), timeout=60
+            )
+            self._local.connection = connection
+
+        headers = {}
+        if body is not None:
+            body = urlencode(body)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status}")
+
+    def web_lookup(self, icao, date):
+        self.http("POST", "/lookup", {"airport": icao, "date": date.isoformat()})
+
+    def scenario_web_lookup_cold(self):
+        self.reset(requests_cache=True)
+        return self.measure(self.web_lookup, self.jobs())
+
+    def scenario_web_lookup_warm(self):
+        self.reset(requests_cache=True)
+        jobs = self.jobs()
+        self.measure(self.web_lookup, jobs)
+        return self.measure(self.web_lookup, jobs)
+
+    def scenario_web_index(self):
+        self.reset(requests_cache=True)
+        return self.measure(
+            lambda icao, date: self.http(
+                "GET", "/?" + urlencode({"airport": icao, "date": date.isoformat()})
+            ),
+            self.jobs(),
+        )
+
+    def provider(self, provider_class):
+        self.reset()
+        airports = {
+            ident: {"query_stats": {"status_code": 200}, "response": info}
+            for ident, info in self.recordings["airportinfo"].items()
+        }
+        return self.measure(
+            lambda icao, date: provider_class(airports[icao], date).lookup(),
+            self.jobs(),
+        )
+
+    def scenario_usno_provider(self):
+        return self.provider(self.ln.USNOProvider)
+
+    def scenario_starfield_provider(self):
+        try:
+            self.ln.StarfieldProvider.preload()
+        except (ImportError, OSError) as e:
+            return f"Skyfield or its ephemeris is unavailable: {e}"
+        return self.provider(self.ln.StarfieldProvider)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Scenarios whose p95 grew, or throughput fell, by more than tolerance"""
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(result["name"])
+        if before is None or "skipped" in result or "skipped" in before:
+            continue
+        if before["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{result['name']}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms"
+            )
+        if before["throughput"] and result["throughput"] < before["throughput"] * (
+            1 - tolerance
+        ):
+            regressions.append(
+                f"{result['name']}: throughput {before['throughput']}/s -> {result['throughput']}/s"
+            )
+    return regressions
+
+
+def record(path, date):
+    """Refresh the recordings from the live APIs for the airports already in path"""
+    # pylint: disable=import-outside-toplevel
+    import requests
+
+    from loggingnight import LoggingNight, USNOProvider
+
+    with open(path, encoding="utf-8") as f:
+        recordings = json.load(f)
+
+    recordings["date"] = date.isoformat()
+    for ident in recordings["airportinfo"]:
+        airport = requests.get(
+            LoggingNight.AIRPORTINFO_URL,
+            params={
+                "appid": "loggingnight",
+                "airport": ident,
+                "include": ["demographic", "geographic"],
+            },
+            timeout=30,
+        ).json()
+        recordings["airportinfo"][ident] = airport
+        recordings["usno"][ident] = requests.get(
+            USNOProvider.USNO_URL,
+            params={
+                "ID": "lndo",
+                "coords": f"{parse_secs(airport['latitude_secs'])},{parse_secs(airport['longitude_secs'])}",
+                "date": date.isoformat(),
+                "tz": 0,
+            },
+            timeout=30,
+        ).json()
+        log.info("Recorded %s", ident)
+
+    recordings.pop("synthetic", None)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(recordings, f, indent=2)
+        f.write("\n")
+
+
+def synthesize(path, date):
+    """Replace the USNO responses in path with ones worked out locally
+
+    For when the live APIs can't be reached: the sun times come from the
+    solar equations, in UTC as record() asks for them, in a response shaped
+    like the USNO's (without the moon data, which nothing reads).  The file
+    is marked synthetic until record() next refreshes it.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    import solar
+    from loggingnight import USNOProvider
+
+    with open(path, encoding="utf-8") as f:
+        recordings = json.load(f)
+
+    idents = list(recordings["airportinfo"])
+    locations = [
+        (
+            parse_secs(recordings["airportinfo"][ident]["latitude_secs"]),
+            parse_secs(recordings["airportinfo"][ident]["longitude_secs"]),
+        )
+        for ident in idents
+    ]
+    events = solar.sun_events(locations, [date])
+
+    recordings["synthetic"] = (
+        "The usno responses are computed with solar.py, not recorded; "
+        "refresh them with bench.py --record"
+    )
+    recordings["date"] = date.isoformat()
+    recordings["usno"] = {}
+    for row, (ident, (lat, lng)) in enumerate(zip(idents, locations)):
+        sundata = []
+        for event, phen in USNOProvider.PHENOMENA.items():
+            value = events[event][row, 0]
+            if not np.isnat(value):
+                time_utc = value.astype(datetime.datetime).strftime("%H:%M")
+                sundata.append({"phen": phen, "time": time_utc})
+        recordings["usno"][ident] = {
+            "apiversion": "4.0.1",
+            "geometry": {"coordinates": [lng, lat], "type": "Point"},
+            "properties": {
+                "data": {
+                    "day": date.day,
+                    "day_of_week": date.strftime("%A"),
+                    "isdst": False,
+                    "label": None,
+                    "month": date.month,
+                    "sundata": sundata,
+                    "tz": 0.0,
+                    "year": date.year,
+                }
+            },
+            "type": "Feature",
+        }
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(recordings, f, indent=2)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure lookup throughput and latency against a local stand-in for the upstream APIs"
+    )
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="Scenario to run (may be repeated), default is all of them",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=200, help="Lookups per scenario"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=8, help="Lookups running at once"
+    )
+    parser.add_argument(
+        "-l",
+        "--latency",
+        type=float,
+        default=50,
+        help="Milliseconds the stand-in upstream takes to answer",
+    )
+    parser.add_argument(
+        "-j",
+        "--jitter",
+        type=float,
+        default=10,
+        help="Up to this many milliseconds more or less than --latency",
+    )
+    parser.add_argument(
+        "-r",
+        "--responses",
+        default=RESPONSES,
+        help="Recorded upstream responses to replay",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Where to write the JSON results, default stdout",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        type=argparse.FileType("r"),
+        help="Earlier results to compare against; exits 1 on a regression",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="How much worse than --baseline is allowed, 0.25 is 25%%",
+    )
+    parser.add_argument(
+        "--record",
+        type=datetime.date.fromisoformat,
+        metavar="DATE",
+        help="Refresh --responses from the live APIs for DATE instead of benchmarking",
+    )
+    parser.add_argument(
+        "--synthesize",
+        type=datetime.date.fromisoformat,
+        metavar="DATE",
+        help="Compute the USNO responses in --responses for DATE instead of benchmarking",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+    log.setLevel(logging.INFO)
+
+    if args.record:
+        record(args.responses, args.record)
+        return 0
+    if args.synthesize:
+        synthesize(args.responses, args.synthesize)
+        return 0
+
+    with open(args.responses, encoding="utf-8") as f:
+        recordings = json.load(f)
+
+    started = datetime.datetime.now(datetime.timezone.utc)
+    with tempfile.TemporaryDirectory(prefix="loggingnight-bench-") as workdir:
+        isolate(workdir)
+        standin = StandIn(recordings, args.latency / 1000, args.jitter / 1000)
+        benchmark = Benchmark(standin, recordings, args.requests, args.concurrency)
+
+        results = []
+        try:
+            for name in args.scenario or SCENARIOS:
+                log.info("Running %s", name)
+                outcome = getattr(benchmark, f"scenario_{name}")()
+                if isinstance(outcome, str):
+                    log.warning("Skipping %s: %s", name, outcome)
+                    results.append({"name": name, "skipped": outcome})
+                    continue
+                results.append(summarize(name, *outcome))
+        finally:
+            benchmark.stop()
+            standin.stop()
+
+    report = {
+        "revision": git_revision(),
+        "started": started.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latency_ms": args.latency,
+            "jitter_ms": args.jitter,
+            "cache_backend": os.environ["LN_CACHE_BACKEND"],
+        },
+        "results": results,
+    }
+    json.dump(report, args.output, indent=2)
+    args.output.write("\n")
+
+    if args.baseline:
+        baseline = json.load(args.baseline)
+        if baseline.get("config") != report["config"]:
+            log.warning("The baseline was run with different settings")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            log.error("Regression: %s", regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vi: modeline tabstop=8 expandtab shiftwidth=4 softtabstop=4 syntax=python
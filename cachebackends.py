@@ -0,0 +1,283 @@
+import bisect
+import datetime
+import logging
+import os
+import time
+from typing import NamedTuple
+
+log = logging.getLogger("loggingnight-cachebackends")
+
+CACHE_BACKEND = os.environ.get("LN_CACHE_BACKEND", "sqlite")
+CACHE_NAME = os.environ.get("LN_CACHE_NAME", "loggingnight_cache")
+CACHE_URL = os.environ.get("LN_CACHE_URL", "redis://localhost:6379/0")
+SHM_DIR = os.environ.get("LN_CACHE_SHM_DIR", "/dev/shm")
+
+BACKENDS = ("sqlite", "filesystem", "shm", "redis")
+
+# Garbage collection deletes at most GC_BATCH_SIZE responses at a time and
+# sleeps GC_PAUSE seconds in between so lookups can get at the cache
+GC_BATCH_SIZE = int(os.environ.get("LN_CACHE_GC_BATCH_SIZE", "500"))
+GC_PAUSE = float(os.environ.get("LN_CACHE_GC_PAUSE", "0.05"))
+# Most responses to keep once expired ones are gone, 0 for no limit
+CACHE_MAX_ENTRIES = int(os.environ.get("LN_CACHE_MAX_ENTRIES", "0"))
+# Seconds an expired upstream response may still be served while it's
+# refreshed, so it's kept that long past expiry too
+STALE_WHILE_REVALIDATE = int(os.environ.get("LN_STALE_WHILE_REVALIDATE", "86400"))
+
+
+def make_backend(
+    name=CACHE_BACKEND, cache_name=CACHE_NAME, url=CACHE_URL, connection=None
+):
+    """Build the requests_cache backend that LoggingNight.enable_cache() installs
+
+    sqlite      one database file (the default), in WAL mode so readers in
+                other workers aren't blocked by a writer
+    filesystem  one file per response in the cache_name directory
+    shm         the filesystem backend on tmpfs, shared by every worker on a host
+    redis       any Redis-protocol server at url, shared by every host; pass
+                connection to use an existing client instead.  A url of
+                fakeredis:// uses fakeredis, an in-process stand-in for
+                development and tests that isn't shared with anything
+
+    Every backend sits behind the same CachedSession, so requests are keyed
+    and expire the same way whichever one is used.
+    """
+    # pylint: disable=import-outside-toplevel
+    from requests_cache import backends
+
+    log.info("Using the %s cache backend", name)
+    match name:
+        case "sqlite":
+            return backends.SQLiteCache(cache_name, wal=True)
+        case "filesystem":
+            return backends.FileCache(cache_name)
+        case "shm":
+            return backends.FileCache(
+                os.path.join(SHM_DIR, os.path.basename(cache_name))
+            )
+        case "redis":
+            if connection is None and url.startswith("fakeredis://"):
+                from fakeredis import FakeRedis
+
+                connection = FakeRedis()
+            elif connection is None:
+                from redis import Redis
+
+                connection = Redis.from_url(url)
+            # Redis deletes each response ttl_offset seconds after it expires
+            return backends.RedisCache(
+                namespace=os.path.basename(cache_name),
+                connection=connection,
+                ttl_offset=STALE_WHILE_REVALIDATE,
+            )
+        case _:
+            raise ValueError(
+                f"Unknown cache backend '{name}', expected one of {', '.join(BACKENDS)}"
+            )
+
+
+class CacheEntry(NamedTuple):
+    key: str
+    url: str
+    expires: datetime.datetime | None
+    size: int
+
+
+def cache_entries(cache, after=None, expires_from=None, expires_to=None):
+    """Yield a CacheEntry for each cached response in key order, starting after
+    the key after
+
+    expires_from and expires_to (aware datetimes) limit the entries to those
+    expiring in [expires_from, expires_to); responses that never expire are
+    left out when either is given.  Entries are read GC_BATCH_SIZE at a time,
+    so listing a large cache never holds it all in memory.  size is the
+    stored size where the backend knows it cheaply (sqlite), otherwise the
+    length of the response body.
+    """
+    # pylint: disable=import-outside-toplevel
+    from requests_cache.backends import SQLiteCache
+
+    responses = cache.responses
+    if isinstance(cache, SQLiteCache):
+        where, args = ["key > ?"], [after or ""]
+        if expires_from is not None:
+            where.append("expires >= ?")
+            args.append(int(expires_from.timestamp()))
+        if expires_to is not None:
+            where.append("expires < ?")
+            args.append(int(expires_to.timestamp()))
+        query = (
+            f"SELECT key, value, length(value) FROM {responses.table_name}"
+            f" WHERE {' AND '.join(where)} ORDER BY key LIMIT {GC_BATCH_SIZE}"
+        )
+
+        while True:
+            with responses.connection() as con:
+                rows = con.execute(query, args).fetchall()
+            for key, value, size in rows:
+                response = responses.deserialize(key, value)
+                if response is not None:
+                    yield CacheEntry(key, response.url, response.expires, size)
+            if len(rows) < GC_BATCH_SIZE:
+                return
+            args[0] = rows[-1][0]
+
+    keys = sorted(responses.keys())
+    if after is not None:
+        keys = keys[bisect.bisect_right(keys, after) :]
+    for key in keys:
+        try:
+            response = responses[key]
+        except KeyError:
+            continue
+        if response is None:
+            continue
+
+        if expires_from is not None or expires_to is not None:
+            if response.expires is None:
+                continue
+            if expires_from is not None and response.expires < expires_from:
+                continue
+            if expires_to is not None and response.expires >= expires_to:
+                continue
+
+        yield CacheEntry(key, response.url, response.expires, len(response.content))
+
+
+class CacheCollector:
+    """Evict expired responses, then the soonest to expire past max_entries
+
+    A response only counts as expired keep_stale seconds after it expires,
+    so stale-while-revalidate still has it to serve.  Responses are deleted
+    batch_size at a time, pausing between batches, so no single transaction
+    holds the cache for long and the sqlite writer lock is free for lookups
+    most of the time.  SQLite caches are walked through their expires
+    index, other backends by reading each response.  Responses that never
+    expire don't count towards max_entries.
+    """
+
+    def __init__(
+        self,
+        batch_size=GC_BATCH_SIZE,
+        pause=GC_PAUSE,
+        max_entries=CACHE_MAX_ENTRIES,
+        keep_stale=STALE_WHILE_REVALIDATE,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.pause = pause
+        self.max_entries = max_entries
+        self.keep_stale = keep_stale
+
+    def collect(self, cache) -> dict:
+        """Run one collection and return what it did"""
+        started = time.perf_counter()
+        report = {
+            "scanned": 0,
+            "expired": 0,
+            "over_limit": 0,
+            "redirects": 0,
+            "batches": 0,
+        }
+
+        # pylint: disable=import-outside-toplevel
+        from requests_cache.backends import SQLiteCache
+
+        if isinstance(cache, SQLiteCache):
+            self._collect_sqlite(cache.responses, report)
+        else:
+            self._collect_any(cache.responses, report)
+
+        redirects = [k for k, v in cache.redirects.items() if v not in cache.responses]
+        for keys in self._chunks(redirects):
+            self._delete(cache.redirects, keys, report)
+        report["redirects"] = len(redirects)
+
+        report["evicted"] = report["expired"] + report["over_limit"]
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+    def _chunks(self, keys):
+        for start in range(0, len(keys), self.batch_size):
+            yield keys[start : start + self.batch_size]
+
+    def _delete(self, storage, keys, report):
+        if report["batches"] and self.pause:
+            time.sleep(self.pause)
+        storage.bulk_delete(keys)
+        report["batches"] += 1
+
+    def _select(self, responses, query, args):
+        with responses.connection() as con:
+            return [row[0] for row in con.execute(query, args)]
+
+    def _collect_sqlite(self, responses, report):
+        table = responses.table_name
+        cutoff = int(time.time()) - self.keep_stale
+        while keys := self._select(
+            responses,
+            f"SELECT key FROM {table} WHERE expires <= ? LIMIT ?",
+            (cutoff, self.batch_size),
+        ):
+            report["scanned"] += len(keys)
+            report["expired"] += len(keys)
+            self._delete(responses, keys, report)
+
+        if not self.max_entries:
+            return
+
+        (count,) = self._select(
+            responses, f"SELECT COUNT(*) FROM {table} WHERE expires IS NOT NULL", ()
+        )
+        excess = count - self.max_entries
+        while excess > 0 and (
+            keys := self._select(
+                responses,
+                f"SELECT key FROM {table} WHERE expires IS NOT NULL"
+                " ORDER BY expires LIMIT ?",
+                (min(excess, self.batch_size),),
+            )
+        ):
+            report["scanned"] += len(keys)
+            report["over_limit"] += len(keys)
+            excess -= len(keys)
+            self._delete(responses, keys, report)
+
+    def _collect_any(self, responses, report):
+        cutoff = time.time() - self.keep_stale
+        survivors = []
+        for keys in self._chunks(list(responses.keys())):
+            expired = []
+            for key in keys:
+                try:
+                    response = responses[key]
+                except KeyError:
+                    continue
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # Unreadable, written by another version perhaps
+                    expired.append(key)
+                    continue
+
+                expires = response.expires.timestamp() if response.expires else None
+                if expires is None:
+                    continue
+                if expires <= cutoff:
+                    expired.append(key)
+                else:
+                    survivors.append((expires, key))
+
+            report["scanned"] += len(keys)
+            if expired:
+                report["expired"] += len(expired)
+                self._delete(responses, expired, report)
+
+        if not self.max_entries or len(survivors) <= self.max_entries:
+            return
+
+        survivors.sort()
+        excess = [key for _, key in survivors[: len(survivors) - self.max_entries]]
+        for keys in self._chunks(excess):
+            report["over_limit"] += len(keys)
+            self._delete(responses, keys, report)
+
+
+# vi: modeline tabstop=8 expandtab shiftwidth=4 softtabstop=4 syntax=python
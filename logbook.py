@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+import csv
+import datetime
+import json
+import logging
+import os
+from typing import NamedTuple
+
+from loggingnight import LoggingNight, ResultCache, makedate
+
+log = logging.getLogger("loggingnight-logbook")
+
+MINUTES_PER_DAY = 1440
+
+# Column names accepted for each part of a leg, first match wins
+FIELDS = {
+    "date": ("date", "flight_date"),
+    "departure": ("departure", "from", "dep", "origin"),
+    "arrival": ("arrival", "to", "arr", "destination"),
+    "out": ("out", "time_out", "off", "departure_time"),
+    "in": ("in", "time_in", "on", "arrival_time"),
+}
+
+ANNOTATIONS = ("night_minutes", "night_landing", "error")
+
+# (airport, date) pairs whose sun events are kept while annotating
+MEMO_SIZE = int(os.environ.get("LN_LOGBOOK_MEMO_SIZE", "4096"))
+
+
+class LegException(ValueError):
+    """A logbook row is missing something needed to work out its night time"""
+
+
+def field(row, name):
+    for column in FIELDS[name]:
+        value = row.get(column)
+        if value not in (None, ""):
+            return str(value).strip()
+    raise LegException(f"No {name} column ({', '.join(FIELDS[name])})")
+
+
+def minute_of_day(timestring: str) -> int:
+    """Takes a Zulu time as HHMM or HH:MM and returns minutes after midnight
+    0130 -> 90"""
+    digits = timestring.upper().rstrip("Z").replace(":", "").strip()
+    if not digits.isdigit() or len(digits) not in (3, 4):
+        raise LegException(f"Unable to understand time {timestring}")
+    hours, minutes = int(digits[:-2]), int(digits[-2:])
+    if hours > 23 or minutes > 59:
+        raise LegException(f"Unable to understand time {timestring}")
+    return hours * 60 + minutes
+
+
+def circular_overlap(start: int, end: int, window_start: int, window_length: int):
+    """Minutes of [start, end) that fall in a window repeating every day"""
+    if window_length <= 0:
+        return 0
+    if window_length >= MINUTES_PER_DAY:
+        return end - start
+
+    total = 0
+    first = window_start + MINUTES_PER_DAY * ((start - window_start) // MINUTES_PER_DAY)
+    for window in range(first, end, MINUTES_PER_DAY):
+        total += max(0, min(end, window + window_length) - max(start, window))
+    return total
+
+
+def in_window(minute: int, window_start: int, window_length: int) -> bool:
+    """Whether minute falls in a window repeating every day"""
+    if window_length >= MINUTES_PER_DAY:
+        return True
+    return (minute - window_start) % MINUTES_PER_DAY < window_length
+
+
+class DayEvents(NamedTuple):
+    """One airport's sun events on one date, in Zulu minutes after midnight,
+    and the kind of day it is (see solar.KINDS)"""
+
+    start_civil: int
+    sun_rise: int
+    sun_set: int
+    end_civil: int
+    day: str
+
+    def night(self):
+        """(start, length) of the night, from the end to the start of civil twilight"""
+        if self.day == "polar_night" and self.start_civil == self.end_civil:
+            # The sun never gets up to civil twilight
+            return 0, MINUTES_PER_DAY
+        if self.day in ("midnight_sun", "no_civil_twilight"):
+            return 0, 0
+        return self.end_civil, (self.start_civil - self.end_civil) % MINUTES_PER_DAY
+
+    def currency(self):
+        """(start, length) of the time landings count for night currency, from
+        an hour after sunset to an hour before sunrise"""
+        if self.day == "polar_night":
+            return 0, MINUTES_PER_DAY
+        if self.day == "midnight_sun":
+            return 0, 0
+        night_length = (self.sun_rise - self.sun_set) % MINUTES_PER_DAY
+        return self.sun_set + 60, night_length - 120
+
+
+class SunEvents:
+    """DayEvents looked up once per (airport, date)
+
+    The most recently used memo_size of them are kept, so memory stays flat
+    however long the logbook is.
+    """
+
+    def __init__(self, try_cache=False, memo_size=MEMO_SIZE):
+        self.try_cache = try_cache
+        self.lookups = 0
+        self._events = ResultCache(maxsize=memo_size)
+
+    def __call__(self, airport: str, date: datetime.date) -> DayEvents:
+        key = (airport.strip().upper(), date)
+        events = self._events.get(key)
+        if events is None:
+            self.lookups += 1
+            try:
+                ln = LoggingNight.cached(
+                    airport, date, zulu=True, try_cache=self.try_cache
+                )
+                events = DayEvents(
+                    *(
+                        t.hour * 60 + t.minute
+                        for t in (
+                            ln.start_civil_twilight,
+                            ln.sun_rise,
+                            ln.sun_set,
+                            ln.end_civil_twilight,
+                        )
+                    ),
+                    day=ln.day,
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                events = LegException(f"{airport}: {e}")
+            self._events.set(key, events)
+
+        if isinstance(events, Exception):
+            raise events
+        return events
+
+
+def read_legs(f, fmt="csv"):
+    """Yield each row of a CSV or NDJSON logbook as a dict"""
+    if fmt == "ndjson":
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(f)
+
+
+def annotate(legs, sun_events: SunEvents):
+    """Add night_minutes, night_landing and error to every leg
+
+    Night time is the part of the flight between the end and the start of
+    civil twilight at the departure airport, and a landing counts for night
+    currency between one hour after sunset and one hour before sunrise at
+    the arrival airport.  Out and in times are in Zulu.  When the sun
+    doesn't set, no night is logged; when it doesn't rise, the whole day is
+    night for currency, and for logging too unless it reaches civil twilight.
+    """
+    for leg in legs:
+        leg = dict(leg)
+        try:
+            date = makedate(field(leg, "date"))
+            time_out = minute_of_day(field(leg, "out"))
+            time_in = minute_of_day(field(leg, "in"))
+            if time_in < time_out:
+                # Landed after midnight Zulu
+                time_in += MINUTES_PER_DAY
+
+            departure = sun_events(field(leg, "departure"), date)
+            leg["night_minutes"] = circular_overlap(
+                time_out, time_in, *departure.night()
+            )
+
+            landing_date = date + datetime.timedelta(days=time_in // MINUTES_PER_DAY)
+            arrival = sun_events(field(leg, "arrival"), landing_date)
+            window_start, window_length = arrival.currency()
+            leg["night_landing"] = window_length > 0 and in_window(
+                time_in, window_start, window_length
+            )
+            leg["error"] = ""
+        except (LegException, ValueError, OverflowError) as e:
+            leg["night_minutes"] = ""
+            leg["night_landing"] = ""
+            leg["error"] = str(e)
+
+        yield leg
+
+
+def write_legs(legs, f, fmt="csv", flush_every=1000):
+    """Write annotated legs as they arrive, returning how many were written"""
+    writer = None
+    count = 0
+    for count, leg in enumerate(legs, start=1):
+        if fmt == "ndjson":
+            f.write(json.dumps(leg) + "\n")
+        else:
+            if writer is None:
+                columns = [c for c in leg if c not in ANNOTATIONS] + list(ANNOTATIONS)
+                writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+                writer.writeheader()
+            writer.writerow(leg)
+
+        if count % flush_every == 0:
+            f.flush()
+
+    f.flush()
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Work out night time and night landings for every leg of a logbook"
+    )
+    parser.add_argument(
+        "logbook",
+        type=argparse.FileType("r"),
+        help="CSV or NDJSON logbook with date, departure, arrival, out and in (Zulu) columns",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Where to write the annotated logbook, default stdout",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("csv", "ndjson"),
+        help="Logbook format, default guessed from the file name",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        action="store_true",
+        help="Attempt to use cache to reduce remote API calls",
+    )
+    args = parser.parse_args()
+
+    fmt = args.format or (
+        "ndjson" if args.logbook.name.endswith((".ndjson", ".jsonl")) else "csv"
+    )
+    sun_events = SunEvents(try_cache=args.cache)
+    written = write_legs(
+        annotate(read_legs(args.logbook, fmt), sun_events), args.output, fmt
+    )
+    log.info("Annotated %d legs with %d lookups", written, sun_events.lookups)
+
+# vi: modeline tabstop=8 expandtab shiftwidth=4 softtabstop=4 syntax=python
@@ -1,14 +1,43 @@
 #!/usr/bin/env python3
 
+import contextvars
+import csv
 import datetime
+import functools
+import json
 import logging
+import math
 import os
-from sys import modules
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from decimal import Decimal
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlsplit
 from zoneinfo import ZoneInfo
 
 import requests
 from dateutil import parser as dateparser
-from timezonefinder import TimezoneFinder
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+import metrics
+from airports import AirportDatabase
+from cachebackends import (
+    CACHE_BACKEND,
+    STALE_WHILE_REVALIDATE,
+    CacheCollector,
+    cache_entries,
+    make_backend,
+)
+from nighttable import NightTable
 
 loglevel = os.environ.get("LN_LOGLEVEL", "warning")
 loglevel_map = {
@@ -21,21 +50,197 @@ loglevel_map = {
 
 log = logging.getLogger("loggingnight-core")
 
+# Keep the raw upstream responses with each result, for debugging; otherwise
+# only the fields a result needs are held on to
+KEEP_PAYLOADS = loglevel == "debug" or os.environ.get(
+    "LN_KEEP_PAYLOADS", "false"
+).lower() in ("1", "true", "yes")
+
 if loglevel in loglevel_map:
     logging.basicConfig(
         level=loglevel_map[loglevel], format="%(levelname)s: %(message)s"
     )
 
-try:
-    import requests_cache
+# Seconds each lazily loaded component took to start, see startup_report()
+startup_times = {}
+
+# What the last LoggingNight.garbage_collect_cache() did
+gc_report = {}
+
+cache_lookups = metrics.Counter(
+    "loggingnight_cache_lookups_total",
+    "Lookups in each cache layer by result",
+    ("layer", "result"),
+)
+upstream_requests = metrics.Counter(
+    "loggingnight_upstream_requests_total",
+    "Requests that went upstream, by host and HTTP status",
+    ("host", "status"),
+)
+upstream_seconds = metrics.Histogram(
+    "loggingnight_upstream_seconds",
+    "Latency of requests that went upstream, by host",
+    ("host",),
+)
+
+
+@functools.cache
+def requests_cache_module():
+    """Import requests_cache the first time it's needed, None if it isn't installed"""
+    started = time.perf_counter()
+    try:
+        # pylint: disable=import-outside-toplevel
+        import requests_cache
+    except ImportError:
+        log.info("requests_cache unavailable")
+        return None
 
+    startup_times["requests_cache"] = time.perf_counter() - started
     log.info("Loaded requests_cache")
-except ImportError:
-    log.info("requests_cache unavailable")
+    return requests_cache
+
+
+@functools.lru_cache(maxsize=65536)
+def utc_offset_hours(tzstring, date):
+    """Hours from UTC for a time zone at noon local time on date"""
+    noon = datetime.datetime.combine(
+        date, datetime.time(hour=12, minute=0, second=0), tzinfo=ZoneInfo(tzstring)
+    )
+    return noon.utcoffset() / datetime.timedelta(hours=1)
+
+
+class TimezoneCache:
+    """Remember which time zone each location is in
+
+    TimezoneFinder's polygon search is done once per location (rounded to
+    `precision` decimal places, about 11 m by default) and the answers can be
+    saved to and loaded from a JSON file.
+    """
+
+    def __init__(self, path=None, precision=4):
+        self.path = path
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._zones = {}
+        self._finder = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def finder(self):
+        """The TimezoneFinder, which is only built once a location misses the cache"""
+        if self._finder is not None:
+            return self._finder
+
+        with self._lock:
+            if self._finder is None:
+                started = time.perf_counter()
+                # pylint: disable=import-outside-toplevel
+                from timezonefinder import TimezoneFinder
+
+                self._finder = TimezoneFinder()
+                startup_times["timezonefinder"] = time.perf_counter() - started
+                log.info(
+                    "Using compiled TimezoneFinder: %s",
+                    str(TimezoneFinder.using_clang_pip()),
+                )
+                log.info(
+                    "Using numba with TimezoneFinder: %s",
+                    str(TimezoneFinder.using_numba()),
+                )
+
+        return self._finder
+
+    def key(self, lat_degs, long_degs):
+        return f"{round(lat_degs, self.precision)},{round(long_degs, self.precision)}"
+
+    def load(self):
+        if self._loaded:
+            return
+
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.path or not os.path.exists(self.path):
+                return
+
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    saved = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning("Unable to read time zone cache %s: %s", self.path, e)
+                return
+
+            if saved.get("precision") != self.precision:
+                log.info("Ignoring time zone cache %s, precision changed", self.path)
+                return
+            self._zones.update(saved.get("zones", {}))
+            log.info("Loaded %d time zones from %s", len(self._zones), self.path)
+
+    def save(self):
+        if not self.path:
+            return
+
+        with self._lock:
+            zones = dict(self._zones)
+        partial = self.path + ".tmp"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump({"precision": self.precision, "zones": zones}, f)
+        os.replace(partial, self.path)
+        log.info("Saved %d time zones to %s", len(zones), self.path)
+
+    def zone_at(self, lat_degs, long_degs):
+        """The time zone name for a location, or None if it isn't in one"""
+        self.load()
+        key = self.key(lat_degs, long_degs)
+        with metrics.timed("timezone"):
+            try:
+                tzstring = self._zones[key]
+                self.hits += 1
+                return tzstring
+            except KeyError:
+                self.misses += 1
+
+            tzstring = self.finder.timezone_at(lng=long_degs, lat=lat_degs)
+            self._zones[key] = tzstring
+            return tzstring
+
+    def precompute(self, airports):
+        """Look up the time zone of every airport and save the answers"""
+        for airport in airports:
+            self.zone_at(airport.latitude, airport.longitude)
+        self.save()
+
+    def stats(self):
+        return {
+            "locations": len(self._zones),
+            "hits": self.hits,
+            "misses": self.misses,
+            "offsets": utc_offset_hours.cache_info()._asdict(),
+        }
+
+
+timezones = TimezoneCache(
+    path=os.environ.get(
+        "LN_TZ_CACHE",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "timezones.json"),
+    )
+)
+airport_db = AirportDatabase()
+night_table = NightTable()
+
 
-tf = TimezoneFinder()
-log.info("Using compiled TimezoneFinder: %s", str(TimezoneFinder.using_clang_pip()))
-log.info("Using numba with TimezoneFinder: %s", str(TimezoneFinder.using_numba()))
+@cache_lookups.add_collector
+def timezone_cache_lookups():
+    offsets = utc_offset_hours.cache_info()
+    return [
+        ({"layer": "timezone", "result": "hit"}, timezones.hits),
+        ({"layer": "timezone", "result": "miss"}, timezones.misses),
+        ({"layer": "utc_offset", "result": "hit"}, offsets.hits),
+        ({"layer": "utc_offset", "result": "miss"}, offsets.misses),
+    ]
 
 
 def makedate(datestring):
@@ -47,6 +252,15 @@ def total_seconds(td):
     return td.total_seconds()
 
 
+def clock_time(value: str, date: datetime.date, tz) -> datetime.datetime:
+    """A fixed-format "HH:MM" time on date in tz; "24:00" is the next midnight"""
+    if len(value) != 5 or value[2] != ":":
+        raise ValueError(f"Expected a time as HH:MM, not '{value}'")
+    return datetime.datetime.combine(
+        date, datetime.time(hour=0, minute=0), tzinfo=tz
+    ) + datetime.timedelta(hours=int(value[0:2]), minutes=int(value[3:5]))
+
+
 def seconds_to_degrees(seconds: str) -> float:
     """Takes decimal seconds with hemisphere abbreviation and returns signed decimal degrees
     174066.6241N -> 48.351840028"""
@@ -61,92 +275,868 @@ def seconds_to_degrees(seconds: str) -> float:
     return (float(seconds[0:-1]) / 3600) * sign
 
 
+def local_timezone(airport, tz=None):
+    """The tzinfo to report times in and whether that's Zulu
+
+    tz is a provider's offset override in hours, as a string; without one
+    the airport's own time zone is used, or UTC if it isn't in one."""
+    if tz is not None:
+        return datetime.timezone(datetime.timedelta(hours=float(tz))), not float(tz)
+
+    lat_degs = seconds_to_degrees(airport["response"]["latitude_secs"])
+    long_degs = seconds_to_degrees(airport["response"]["longitude_secs"])
+    tzstring = timezones.zone_at(lat_degs, long_degs)
+    if not tzstring:
+        log.info("Unable to find timezone string, using UTC")
+        return ZoneInfo("UTC"), True
+    return ZoneInfo(tzstring), False
+
+
+class HTTPSessions:
+    """A shared keep-alive requests session with a connection pool per host
+
+    requests.Session is patched by requests_cache.install_cache(), so the
+    session is rebuilt with reset() whenever the cache is (re)installed.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=10,
+        retries=2,
+        backoff_factor=0.5,
+        connect_timeout=3.05,
+        read_timeout=10,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = (connect_timeout, read_timeout)
+        self.requests_by_host = Counter()
+        self._session = None
+        self._adapter = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        if self._session is not None:
+            return self._session
+
+        with self._lock:
+            if self._session is None:
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=("GET",),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._adapter = adapter
+                self._session = session
+
+        return self._session
+
+    def reset(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        self.requests_by_host[urlsplit(url).netloc] += 1
+        return self.session().get(url, **kwargs)
+
+    def stats(self):
+        pools = {}
+        adapter = self._adapter
+        if adapter is not None:
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                pools[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    # Unused slots in the pool queue are None placeholders
+                    "idle_connections": (
+                        sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                        if pool.pool
+                        else 0
+                    ),
+                    "maxsize": pool.pool.maxsize if pool.pool else 0,
+                }
+
+        return {
+            "cached": hasattr(self._session, "cache"),
+            "requests_by_host": dict(self.requests_by_host),
+            "pools": pools,
+        }
+
+
+http_sessions = HTTPSessions(
+    pool_connections=int(os.environ.get("LN_HTTP_POOL_CONNECTIONS", "10")),
+    pool_maxsize=int(os.environ.get("LN_HTTP_POOL_MAXSIZE", "10")),
+    retries=int(os.environ.get("LN_HTTP_RETRIES", "2")),
+    backoff_factor=float(os.environ.get("LN_HTTP_BACKOFF", "0.5")),
+    connect_timeout=float(os.environ.get("LN_HTTP_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.environ.get("LN_HTTP_READ_TIMEOUT", "10")),
+)
+
+
+class SingleFlight:
+    """Let concurrent callers asking for the same key share one call"""
+
+    def __init__(self, name, background_workers=2):
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._background = ThreadPoolExecutor(
+            max_workers=background_workers, thread_name_prefix=f"{name}-refresh"
+        )
+
+    def do(self, key, func, *args, **kwargs):
+        """Call func, or wait for and share the result of the call already in flight"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return flight.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def do_in_background(self, key, func, *args, **kwargs):
+        """Start func on a background thread unless a call for key is already in flight"""
+        with self._lock:
+            if key in self._flights:
+                return
+
+        def run():
+            try:
+                self.do(key, func, *args, **kwargs)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                log.warning("Background refresh of %s failed: %s", key, e)
+
+        self._background.submit(run)
+
+    def stats(self):
+        return {"calls": self.calls, "shared": self.shared}
+
+
+web_flights = SingleFlight("web-query")
+
+
 def web_query(url, params=None, headers=None, verify_ssl=False):
+    """GET url, sharing the response with any identical request already in flight"""
+    key = (
+        url,
+        tuple(
+            sorted(
+                (k, tuple(v) if isinstance(v, list) else v)
+                for k, v in (params or {}).items()
+            )
+        ),
+        tuple(sorted((headers or {}).items())),
+        verify_ssl,
+    )
+    return web_flights.do(key, fetch, url, params, headers, verify_ssl)
+
+
+def fetch(url, params=None, headers=None, verify_ssl=False):
     params = params or {}
     headers = headers or {}
     stats = {}
 
-    r = requests.get(url, headers=headers, params=params, timeout=10, verify=verify_ssl)
+    host = urlsplit(url).netloc
+    started = time.perf_counter()
+    try:
+        with metrics.timed("upstream"):
+            r = http_sessions.get(
+                url, headers=headers, params=params, verify=verify_ssl
+            )
+    except requests.RequestException:
+        upstream_requests.inc(host=host, status="error")
+        raise
+
+    if hasattr(r, "from_cache"):
+        cache_lookups.inc(layer="http", result="hit" if r.from_cache else "miss")
+    if not getattr(r, "from_cache", False):
+        upstream_requests.inc(host=host, status=r.status_code)
+        upstream_seconds.observe(time.perf_counter() - started, host=host)
+
     stats["final_url"] = r.url
     stats["query_time"] = total_seconds(r.elapsed)
     stats["status_code"] = r.status_code
     stats["status_text"] = r.reason
-    stats["headers"] = r.headers
+    if KEEP_PAYLOADS:
+        stats["headers"] = r.headers
     if hasattr(r, "from_cache"):
         stats["from_cache"] = r.from_cache
 
     try:
-        return {"query_stats": stats, "response": r.json()}
+        with metrics.timed("parse"):
+            return {"query_stats": stats, "response": r.json()}
     except:  # pylint: disable=bare-except # noqa
         return {"query_stats": stats}
 
 
+class Ephemeris:
+    """Load the Skyfield timescale and JPL ephemeris once and share them
+
+    A load that fails is remembered and its error raised again, rather than
+    every lookup trying (and maybe downloading) the ephemeris again.
+    """
+
+    EPHEMERIS_FILE = os.environ.get("LN_EPHEMERIS", "de421.bsp")
+
+    def __init__(self, filename=EPHEMERIS_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._timescale = None
+        self._ephemeris = None
+        self._error = None
+
+    def load(self):
+        """Load the timescale and ephemeris if this process hasn't already"""
+        if self._ephemeris is not None:
+            return self._timescale, self._ephemeris
+
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._ephemeris is None:
+                started = time.perf_counter()
+                try:
+                    # pylint: disable=import-outside-toplevel
+                    from skyfield import api
+
+                    self._timescale = api.load.timescale()
+                    # jplephem memory-maps the .bsp segments, so every thread (and
+                    # every forked worker) shares one copy of the file's pages.
+                    self._ephemeris = api.load(self.filename)
+                except (ImportError, OSError) as e:
+                    log.warning("Unable to load %s: %s", self.filename, e)
+                    self._error = e
+                    raise
+                startup_times["ephemeris"] = time.perf_counter() - started
+                log.info(
+                    "Loaded %s in %.3f seconds",
+                    self.filename,
+                    startup_times["ephemeris"],
+                )
+
+        return self._timescale, self._ephemeris
+
+    @property
+    def timescale(self):
+        return self.load()[0]
+
+    @property
+    def ephemeris(self):
+        return self.load()[1]
+
+
 class StarfieldProvider:
     """Use Starfield to calculate astronomical information"""
 
-    # pylint: disable=import-outside-toplevel
-    from skyfield import almanac, api
+    shared_ephemeris = Ephemeris()
 
-    @staticmethod
-    def nearest_minute(dt):
-        return (dt + datetime.timedelta(seconds=30)).replace(second=0, microsecond=0)
+    @classmethod
+    def preload(cls):
+        """Warm the shared ephemeris so the first lookup doesn't pay for it"""
+        cls.shared_ephemeris.load()
+
+    # The altitude, in degrees, the sun crosses for each event (as in
+    # Skyfield's dark_twilight_day()) and whether it's rising
+    EVENT_ALTITUDES = {
+        "start_civil_twilight": (-6.0, True),
+        "sun_rise": (-0.8333, True),
+        "sun_set": (-0.8333, False),
+        "end_civil_twilight": (-6.0, False),
+    }
+
+    # Days between altitude samples.  Away from the poles the sun spends
+    # hours above and below each altitude, so an hourly sample can't miss a
+    # crossing; beyond FINE_STEP_LATITUDE a day or a twilight can be much
+    # shorter, so it's sampled every SEARCH_STEP_DAYS instead.
+    COARSE_STEP_DAYS = 60 / 1440
+    SEARCH_STEP_DAYS = 5 / 1440
+    FINE_STEP_LATITUDE = 55.0
+
+    # Most altitudes worked out at once, to bound memory for many locations
+    BLOCK_SIZE = 2_000_000
+
+    # The sun's horizontal parallax at one AU, in degrees
+    SOLAR_PARALLAX = 8.794 / 3600
+
+    name = "starfield"
 
-    # pylint: disable=unused-argument
     def __init__(self, airport=None, date=None, tz=None):
         self.airport = airport
         self.date = date
+        self.tz = tz
         self.usno = {"message": "Using the Starfield provider"}
 
+    @classmethod
+    def sun_positions(cls, seconds):
+        """The sun's apparent right ascension and declination, Greenwich
+        apparent sidereal time (all in radians, the angles unwrapped),
+        distance in AU and UT1 - UTC in seconds at each POSIX time in seconds"""
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        ts, e = cls.shared_ephemeris.load()
+        # Whole days and the seconds into them, so each time gets the leap
+        # seconds of its own date rather than those of 1970
+        days, seconds = np.divmod(seconds, 86400)
+        t = ts.utc(1970, 1, 1 + days, 0, 0, seconds)
+        ra, dec, distance = (
+            e["earth"].at(t).observe(e["sun"]).apparent().radec(epoch="date")
+        )
+        return (
+            np.unwrap(ra.radians),
+            dec.radians,
+            np.unwrap(t.gast * np.pi / 12),
+            distance.au,
+            t.dut1,
+        )
+
+    # pylint: disable=too-many-arguments,unused-argument
+    @classmethod
+    def altitudes(cls, lats, longs, ra, dec, gast, distance, dut1):
+        """The sun's topocentric altitude in degrees, broadcasting locations
+        (in radians) against sun_positions()"""
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        sin_altitude = np.sin(lats) * np.sin(dec) + np.cos(lats) * np.cos(dec) * np.cos(
+            gast + longs - ra
+        )
+        altitude = np.degrees(np.arcsin(np.clip(sin_altitude, -1, 1)))
+        return altitude - cls.SOLAR_PARALLAX / distance * np.cos(np.radians(altitude))
+
     # pylint: disable=too-many-locals
+    @classmethod
+    def batch_lookup(cls, locations, dates, timezones=None):
+        """Find civil twilight, sunrise and sunset for many locations and dates
+
+        locations is a sequence of (latitude, longitude) pairs in decimal
+        degrees and dates a sequence of datetime.date.  timezones optionally
+        names (or gives the tzinfo of) the time zone for each location, which
+        decides where each of its days starts (UTC otherwise).
+
+        The sun's position comes from the ephemeris once an hour over the
+        whole span of dates, shared by every location, and is interpolated
+        in between; the altitudes of all the locations are then worked out
+        together with NumPy.  Each crossing between two samples is narrowed
+        down to a fraction of a second by bisection.
+
+        Returns a dict of event name to a (len(locations), len(dates)) array
+        of UTC datetime64[m], holding NaT where the event doesn't happen.
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        dates = list(dates)
+        timezones = timezones or [None] * len(locations)
+
+        results = {
+            name: np.full((len(locations), len(dates)), "NaT", dtype="datetime64[m]")
+            for name in cls.EVENT_ALTITUDES
+        }
+        if not dates or not len(locations):
+            return results
+
+        first_day = min(dates)
+        span = (max(dates) - first_day).days + 1
+        columns = np.array([(date - first_day).days for date in dates])
+
+        # Where each location's days start, as POSIX seconds
+        midnights = np.array(
+            [
+                [
+                    datetime.datetime.combine(
+                        first_day + datetime.timedelta(days=day),
+                        datetime.time(hour=0, minute=0),
+                        tzinfo=(
+                            tzstring
+                            if isinstance(tzstring, datetime.tzinfo)
+                            else ZoneInfo(tzstring or "UTC")
+                        ),
+                    ).timestamp()
+                    for day in range(span + 1)
+                ]
+                for tzstring in timezones
+            ]
+        )
+        lats, longs = np.radians(np.array(locations, dtype=float)).T
+
+        hours = cls.samples(midnights.min(), midnights.max(), cls.COARSE_STEP_DAYS)
+        sun = hours, cls.sun_positions(hours)
+
+        fine = np.abs(np.degrees(lats)) >= cls.FINE_STEP_LATITUDE
+        for step_days, rows in (
+            (cls.COARSE_STEP_DAYS, np.flatnonzero(~fine)),
+            (cls.SEARCH_STEP_DAYS, np.flatnonzero(fine)),
+        ):
+            if not len(rows):
+                continue
+
+            samples = cls.samples(
+                midnights[rows, 0].min(), midnights[rows, -1].max(), step_days
+            )
+            block = max(1, cls.BLOCK_SIZE // len(samples))
+            for first in range(0, len(rows), block):
+                cls.find_crossings(
+                    results,
+                    rows[first : first + block],
+                    lats,
+                    longs,
+                    samples,
+                    sun,
+                    midnights,
+                    columns,
+                )
+
+        return results
+
+    @staticmethod
+    def samples(start, end, step_days):
+        """POSIX times every step_days from start until past end"""
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        step = step_days * 86400
+        return start + step * np.arange(math.ceil((end - start) / step) + 1)
+
+    @staticmethod
+    def interpolate(sun, seconds):
+        """sun_positions() at seconds, from (times, sun_positions(times))"""
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        times, positions = sun
+        return tuple(np.interp(seconds, times, values) for values in positions)
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    @classmethod
+    def find_crossings(
+        cls, results, rows, lats, longs, samples, sun, midnights, columns
+    ):
+        """Fill in results for rows, the first crossing of each event's
+        altitude on each day, from the sun's altitude at samples"""
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        altitudes = cls.altitudes(
+            lats[rows, None], longs[rows, None], *cls.interpolate(sun, samples)
+        )
+        span = midnights.shape[1] - 1
+        width = max(samples[-1], midnights[rows].max()) - samples[0] + 1
+        offsets = np.arange(len(rows))[:, None] * width - samples[0]
+
+        for name, (altitude, rising) in cls.EVENT_ALTITUDES.items():
+            above = altitudes >= altitude
+            if rising:
+                row, i = np.nonzero(~above[:, :-1] & above[:, 1:])
+            else:
+                row, i = np.nonzero(above[:, :-1] & ~above[:, 1:])
+
+            # Bisect to when the sun gets past the altitude
+            low, high = samples[i], samples[i + 1]
+            while len(low) and (high - low).max() > 0.1:
+                middle = (low + high) / 2
+                past = (
+                    cls.altitudes(
+                        lats[rows[row]], longs[rows[row]], *cls.interpolate(sun, middle)
+                    )
+                    >= altitude
+                ) == rising
+                low, high = np.where(past, low, middle), np.where(past, middle, high)
+
+            # Which of its location's days each crossing falls in, searching
+            # every row's midnights at once by moving each row a span apart
+            days = (
+                np.searchsorted(
+                    (midnights[rows] + offsets).ravel(),
+                    high + offsets[row, 0],
+                    side="right",
+                )
+                - row * (span + 1)
+                - 1
+            )
+            # Rounded to the minute in UT1, which runs within a second of UTC
+            ut1 = high + cls.interpolate(sun, high)[-1]
+            minutes = np.floor(ut1 / 60 + 0.5).astype("int64").astype("datetime64[m]")
+
+            # Keep the first crossing of each day
+            keep = (days >= 0) & (days < span)
+            found, first = np.unique(row[keep] * span + days[keep], return_index=True)
+            by_day = np.full((len(rows), span), "NaT", dtype="datetime64[m]")
+            by_day[found // span, found % span] = minutes[keep][first]
+            results[name][rows] = by_day[:, columns]
+
     def lookup(self):
         log.info("Using the Starfield provider")
-        ts = self.api.load.timescale()
-        e = self.api.load("de421.bsp")
-
         lat_degs = seconds_to_degrees(self.airport["response"]["latitude_secs"])
         long_degs = seconds_to_degrees(self.airport["response"]["longitude_secs"])
 
-        location = self.api.Topos(lat_degs, long_degs)
+        tz, in_zulu = local_timezone(self.airport, self.tz)
 
-        tzstring = tf.timezone_at(
-            lng=location.longitude.degrees, lat=location.latitude.degrees
+        # Each event is the first crossing of its level that day, if there is
+        # one, so days without all four transitions are answered too
+        events = self.batch_lookup([(lat_degs, long_degs)], [self.date], [tz])
+        times = event_times(
+            events, 0, 0, self.date, tz, classify_day(lat_degs, long_degs, self.date)
         )
+        times["in_zulu"] = in_zulu
+        return times
+
+
+# Local times reported for events that don't happen that day when the sun
+# stays up: the day, or civil twilight, lasts from midnight to midnight
+MISSING_EVENTS = {
+    "start_civil_twilight": datetime.time(hour=0, minute=0),
+    "sun_rise": datetime.time(hour=0, minute=0),
+    "sun_set": datetime.time(hour=23, minute=59),
+    "end_civil_twilight": datetime.time(hour=23, minute=59),
+}
 
-        if not tzstring:
-            log.info("Unable to find timezone string, using UTC")
-            tz = ZoneInfo("UTC")
-            in_zulu = True
+# The sun's altitude, in degrees, as it crosses for each event
+SUNRISE_ALTITUDE, CIVIL_TWILIGHT_ALTITUDE = -0.833, -6.0
+MISSING_ALTITUDES = {
+    "start_civil_twilight": CIVIL_TWILIGHT_ALTITUDE,
+    "sun_rise": SUNRISE_ALTITUDE,
+    "sun_set": SUNRISE_ALTITUDE,
+    "end_civil_twilight": CIVIL_TWILIGHT_ALTITUDE,
+}
+
+
+class Day(NamedTuple):
+    """What kind of day a location has on a date, see solar.KINDS, with the
+    sun's altitude in degrees at solar noon (highest) and midnight (lowest)"""
+
+    kind: str
+    solar_noon: datetime.datetime
+    highest: float
+    lowest: float
+
+    def stays_below(self, altitude):
+        """Whether a sun that never crosses altitude stays below it all day
+
+        Near the edge of a polar day the sun only just reaches, or only
+        just misses, altitude at noon or at midnight, and a provider may
+        find no crossing where solar.day_kinds() expects one.  The side it
+        stays on is then the one it's nearer to all day.
+        """
+        return altitude - self.lowest > self.highest - altitude
+
+    def stand_in(self, event, date, tz):
+        """The time reported for event when it doesn't happen on date
+
+        When the sun stays below the event's altitude it's put at solar
+        noon, when the sun comes closest, so night lasts all day.
+        Otherwise the sun is staying up, so MISSING_EVENTS has day (or
+        civil twilight) last all day.
+        """
+        if self.stays_below(MISSING_ALTITUDES[event]):
+            return self.solar_noon.astimezone(tz)
+        return datetime.datetime.combine(date, MISSING_EVENTS[event], tzinfo=tz)
+
+    def fill_in(self, times, date, tz):
+        """Add stand-ins to times for the events missing from it, and the
+        kind of day the missing events make it as "day"; returns times"""
+        missing = MISSING_EVENTS.keys() - times.keys()
+        for event in missing:
+            times[event] = self.stand_in(event, date, tz)
+
+        civil = {"start_civil_twilight", "end_civil_twilight"}
+        if {"sun_rise", "sun_set"} <= missing:
+            up = not self.stays_below(SUNRISE_ALTITUDE)
+            times["day"] = "midnight_sun" if up else "polar_night"
+        elif civil <= missing and not self.stays_below(CIVIL_TWILIGHT_ALTITUDE):
+            times["day"] = "no_civil_twilight"
         else:
-            tz = ZoneInfo(tzstring)
-            in_zulu = False
+            times["day"] = "normal"
+        return times
+
 
-        t0 = ts.utc(
-            datetime.datetime.combine(
-                self.date, datetime.time(hour=0, minute=0), tzinfo=tz
+@functools.lru_cache(maxsize=4096)
+def days_of_year(lat_degs, long_degs, year):
+    """solar.day_kinds() for every day of year at one location"""
+    # pylint: disable=import-outside-toplevel
+    import solar
+
+    first_day = datetime.date(year, 1, 1)
+    dates = [
+        first_day + datetime.timedelta(days=day)
+        for day in range((datetime.date(year + 1, 1, 1) - first_day).days)
+    ]
+    kinds, noons, highest, lowest = solar.day_kinds([(lat_degs, long_degs)], dates)
+    return kinds[0], noons[0], highest[0], lowest[0]
+
+
+def classify_day(lat_degs, long_degs, date) -> Day:
+    """The kind of day at a location on date
+
+    Worked out a year at a time for each location (to 0.01 degrees) and
+    kept, so the seasons of an airport are only computed once.
+    """
+    # pylint: disable=import-outside-toplevel
+    import solar
+
+    kinds, noons, highest, lowest = days_of_year(
+        round(lat_degs, 2), round(long_degs, 2), date.year
+    )
+    day = date.timetuple().tm_yday - 1
+    return Day(
+        solar.KINDS[kinds[day]],
+        noons[day].astype(datetime.datetime).replace(tzinfo=datetime.timezone.utc),
+        float(highest[day]),
+        float(lowest[day]),
+    )
+
+
+@cache_lookups.add_collector
+def day_kind_lookups():
+    info = days_of_year.cache_info()
+    return [
+        ({"layer": "day_kind", "result": "hit"}, info.hits),
+        ({"layer": "day_kind", "result": "miss"}, info.misses),
+    ]
+
+
+def event_times(events, row, column, date, tz, day):
+    """One location and date out of batch_lookup()-style event arrays, as
+    aware datetimes in tz, filled in by day for events that don't happen"""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    times = {}
+    for event in MISSING_EVENTS:
+        value = events[event][row, column]
+        if not np.isnat(value):
+            times[event] = (
+                value.astype(datetime.datetime)
+                .replace(tzinfo=datetime.timezone.utc)
+                .astimezone(tz)
             )
+    return day.fill_in(times, date, tz)
+
+
+def same_place(airport, other):
+    """Whether two airport responses are within 0.001 degrees (about 100
+    metres) of each other, close enough to share sun times"""
+    return all(
+        abs(
+            seconds_to_degrees(airport["response"][key])
+            - seconds_to_degrees(other["response"][key])
         )
-        t1 = ts.utc(
-            datetime.datetime.combine(
-                self.date, datetime.time(hour=23, minute=59), tzinfo=tz
+        < 0.001
+        for key in ("latitude_secs", "longitude_secs")
+    )
+
+
+def currency_times(sun_rise, sun_set, day, date):
+    """(an hour before sunrise, an hour after sunset), when night currency
+    ends and starts on date, following day like logbook.DayEvents.currency()
+
+    In a polar night landings count all day, so currency starts at midnight
+    and ends just before the next; in midnight sun they never count, so it
+    ends at midnight and starts just before the next, with no night between.
+    """
+    tz = sun_rise.tzinfo
+    match day:
+        case "polar_night":
+            return (
+                datetime.datetime.combine(date, MISSING_EVENTS["sun_set"], tzinfo=tz),
+                datetime.datetime.combine(date, MISSING_EVENTS["sun_rise"], tzinfo=tz),
             )
-        )
+        case "midnight_sun":
+            return sun_rise, sun_set
+        case _:
+            return sun_rise - LoggingNight.ONE_HOUR, sun_set + LoggingNight.ONE_HOUR
+
+
+class SolarProvider:
+    """Compute astronomical information with NOAA's solar equations
+
+    Nothing to download or load, and many airports and days are worked out
+    at once with NumPy; see solar.py for how close it comes to Skyfield.
+    """
 
-        t, _ = self.almanac.find_discrete(
-            t0, t1, self.almanac.dark_twilight_day(e, location)
+    name = "solar"
+
+    def __init__(self, airport=None, date=None, tz=None):
+        self.airport = airport
+        self.date = date
+        self.tz = tz
+        self.usno = {"message": "Using the solar provider"}
+
+    @staticmethod
+    def batch_lookup(locations, dates, timezones=None):
+        """Like StarfieldProvider.batch_lookup(), but days are solar days, so
+        timezones is accepted and not needed"""
+        # pylint: disable=import-outside-toplevel
+        import solar
+
+        return solar.sun_events(locations, dates)
+
+    def lookup(self):
+        log.info("Using the solar provider")
+        lat_degs = seconds_to_degrees(self.airport["response"]["latitude_secs"])
+        long_degs = seconds_to_degrees(self.airport["response"]["longitude_secs"])
+
+        tz, in_zulu = local_timezone(self.airport, self.tz)
+
+        events = self.batch_lookup([(lat_degs, long_degs)], [self.date])
+        times = event_times(
+            events, 0, 0, self.date, tz, classify_day(lat_degs, long_degs, self.date)
         )
+        times["in_zulu"] = in_zulu
+        return times
 
-        start_civil_twilight = self.nearest_minute(t[2].utc_datetime()).astimezone(tz)
-        sunrise = self.nearest_minute(t[3].utc_datetime()).astimezone(tz)
-        sunset = self.nearest_minute(t[4].utc_datetime()).astimezone(tz)
-        end_civil_twilight = self.nearest_minute(t[5].utc_datetime()).astimezone(tz)
 
-        return {
-            "sun_rise": sunrise,
-            "sun_set": sunset,
-            "start_civil_twilight": start_civil_twilight,
-            "end_civil_twilight": end_civil_twilight,
-            "in_zulu": in_zulu,
+class NightTableProvider:
+    """Read precomputed astronomical information from the night table"""
+
+    class Miss(LookupError):
+        """The airport or date isn't in the night table"""
+
+    name = "night_table"
+
+    def __init__(self, airport=None, date=None, tz=None):
+        self.airport = airport
+        self.date = date
+        self.tz = tz
+        self.usno = {"message": "Using the night table provider"}
+
+    def lookup(self):
+        ident = self.airport["response"].get("ident")
+        minutes = night_table.lookup(ident, self.date) if ident else None
+        if minutes is None:
+            raise self.Miss(
+                f"{ident} on {self.date.isoformat()} is not in the night table"
+            )
+
+        log.info("Using the night table provider")
+
+        tz, in_zulu = local_timezone(self.airport, self.tz)
+
+        utc_midnight = datetime.datetime.combine(
+            self.date, datetime.time(hour=0, minute=0), tzinfo=datetime.timezone.utc
+        )
+        times = {
+            event: (utc_midnight + datetime.timedelta(minutes=value)).astimezone(tz)
+            for event, value in minutes.items()
+            if value is not None
         }
+        if len(times) < len(minutes):
+            classify_day(
+                seconds_to_degrees(self.airport["response"]["latitude_secs"]),
+                seconds_to_degrees(self.airport["response"]["longitude_secs"]),
+                self.date,
+            ).fill_in(times, self.date, tz)
+        times["in_zulu"] = in_zulu
+        return times
+
+
+# USNO lookups ask about the nearest point on an ASTRO_GRID degree grid, so
+# nearby airports (and one airport under different identifiers) share one
+# upstream response; 0 turns this off.  Locations where that could move an
+# event by more than ASTRO_MAX_ERROR seconds are looked up exactly instead.
+ASTRO_GRID = float(os.environ.get("LN_ASTRO_GRID", "0.01"))
+ASTRO_MAX_ERROR = float(os.environ.get("LN_ASTRO_MAX_ERROR", "30"))
+
+# Sun altitudes, in degrees, at sunrise/sunset and at civil twilight
+EVENT_ALTITUDES = (SUNRISE_ALTITUDE, CIVIL_TWILIGHT_ALTITUDE)
+
+
+@functools.lru_cache(maxsize=65536)
+def quantization_error(lat_degs, day_of_year, grid=ASTRO_GRID):
+    """Most seconds any event on day_of_year can move between a grid point
+    at lat_degs and anywhere within half a grid cell of it; infinite if the
+    event happens at one but not the other
+
+    A degree of longitude is 240 seconds of the sun's hour angle.  For
+    latitude, the sunrise equation gives the hour angle at each edge of the
+    cell, which only differs by much close to the polar circles.  The sun's
+    declination is approximated, so every declination within two degrees
+    of it is tried.
+    """
+    half = grid / 2
+    latitudes = [
+        math.radians(max(-89.99, min(89.99, lat)))
+        for lat in (lat_degs - half, lat_degs, lat_degs + half)
+    ]
+    approximate = -23.44 * math.cos(math.radians(360 / 365 * (day_of_year + 10)))
+    worst = 0.0
+    for step in range(-8, 9):
+        declination = math.radians(approximate + step / 4)
+        for altitude in EVENT_ALTITUDES:
+            hour_angles = []
+            for lat in latitudes:
+                cos_h = (
+                    math.sin(math.radians(altitude))
+                    - math.sin(lat) * math.sin(declination)
+                ) / (math.cos(lat) * math.cos(declination))
+                hour_angles.append(
+                    math.degrees(math.acos(cos_h)) if -1 < cos_h < 1 else None
+                )
+            if all(h is None for h in hour_angles):
+                continue
+            if any(h is None for h in hour_angles):
+                return math.inf
+            worst = max(
+                worst,
+                abs(hour_angles[0] - hour_angles[1]),
+                abs(hour_angles[2] - hour_angles[1]),
+            )
+    return (half + worst) * 240
+
+
+def astro_location(lat_degs, long_degs, date, grid=ASTRO_GRID):
+    """The coordinates to ask about on date, as a "lat,long" string, snapped
+    to the grid unless that could be off by more than ASTRO_MAX_ERROR seconds"""
+    if grid > 0:
+        # Decimal, so the grid point is an exact multiple of the grid and is
+        # written with all of the grid's decimal places, 41.275 for 0.025
+        step = Decimal(str(grid))
+        lat_q = round(Decimal(str(lat_degs)) / step) * step
+        long_q = round(Decimal(str(long_degs)) / step) * step
+        error = quantization_error(float(lat_q), date.timetuple().tm_yday, grid)
+        if error <= ASTRO_MAX_ERROR:
+            places = max(0, -step.as_tuple().exponent)
+            return f"{lat_q:.{places}f},{long_q:.{places}f}"
+    return str(lat_degs) + "," + str(long_degs)
 
 
 class USNOProvider:
@@ -154,6 +1144,16 @@ class USNOProvider:
 
     USNO_URL = "https://aa.usno.navy.mil/api/rstt/oneday"
 
+    name = "usno"
+
+    # The USNO's name for each event
+    PHENOMENA = {
+        "start_civil_twilight": "Begin Civil Twilight",
+        "sun_rise": "Rise",
+        "sun_set": "Set",
+        "end_civil_twilight": "End Civil Twilight",
+    }
+
     class AstronomicalException(IOError):
         """An error occured finding astronomical information"""
 
@@ -168,29 +1168,29 @@ class USNOProvider:
 
         lat_degs = seconds_to_degrees(self.airport["response"]["latitude_secs"])
         long_degs = seconds_to_degrees(self.airport["response"]["longitude_secs"])
-        location = str(lat_degs) + "," + str(long_degs)
+        location = astro_location(lat_degs, long_degs, self.date)
 
         if self.tz is None:
-            tzstring = tf.timezone_at(lng=long_degs, lat=lat_degs)
+            tzstring = timezones.zone_at(lat_degs, long_degs)
 
             if not tzstring:
                 log.info("Unable to find timezone string, using UTC")
                 offset = 0
                 in_zulu = True
             else:
-                noon = datetime.time(hour=12, minute=0, second=0)
-                utc_datetime = datetime.datetime.combine(
-                    date=self.date, time=noon, tzinfo=ZoneInfo("UTC")
-                )
-                local_datetime = datetime.datetime.combine(
-                    date=self.date, time=noon, tzinfo=ZoneInfo(tzstring)
-                )
-                offset = (utc_datetime - local_datetime) / datetime.timedelta(hours=1)
+                offset = utc_offset_hours(tzstring, self.date)
                 in_zulu = False
         else:
             offset = self.tz
             in_zulu = not bool(offset)
 
+        key = (location, self.date, float(offset))
+        cached = astro_cache.get(key)
+        if cached is not None:
+            payload, times = cached
+            self.usno = payload or {"message": "From the astro cache"}
+            return {**times, "in_zulu": in_zulu}
+
         self.usno = web_query(
             self.USNO_URL,
             params={
@@ -214,27 +1214,403 @@ class USNOProvider:
         ):
             raise self.AstronomicalException(f"Unable to find sun data for {location}")
 
-        phenTimes = dict(
-            (i["phen"], i["time"])
-            for i in self.usno["response"]["properties"]["data"]["sundata"]
+        tz = datetime.timezone(datetime.timedelta(hours=float(offset)))
+        with metrics.timed("parse"):
+            phen_times = {
+                i["phen"]: i["time"]
+                for i in self.usno["response"]["properties"]["data"]["sundata"]
+            }
+            try:
+                times = {
+                    event: clock_time(phen_times[phen], self.date, tz)
+                    for event, phen in self.PHENOMENA.items()
+                    if phen in phen_times
+                }
+            except ValueError as e:
+                raise self.AstronomicalException(
+                    f"Unable to understand sun data for {location}: {e}"
+                ) from e
+            if len(times) < len(self.PHENOMENA):
+                classify_day(lat_degs, long_degs, self.date).fill_in(
+                    times, self.date, tz
+                )
+
+        astro_cache.set(key, (self.usno if KEEP_PAYLOADS else None, times))
+        return {**times, "in_zulu": in_zulu}
+
+
+class CircuitBreaker:
+    """Stop calling a provider for reset_after seconds once it fails threshold times in a row
+
+    After reset_after seconds one trial call is let through (half open); if
+    it succeeds the breaker closes again, otherwise it stays open for
+    another reset_after seconds.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, threshold=5, reset_after=60):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_after
+            ):
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.threshold
+            ):
+                if self.state == self.CLOSED:
+                    log.warning("Circuit open for the %s provider", self.name)
+                self.state = self.OPEN
+                self.opened += 1
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "opened": self.opened}
+
+
+provider_results = metrics.Counter(
+    "loggingnight_provider_results_total",
+    "Astronomical lookups by provider and outcome",
+    ("provider", "outcome"),
+)
+
+
+class ProviderChain:
+    """Ask the primary provider, hedging with the fallback when it's slow
+
+    The primary gets budget seconds to answer.  If it fails, is still going
+    after budget seconds, or its circuit breaker is open, the fallback is
+    started too and whichever succeeds first answers; a primary that's
+    merely slow keeps running, so its response still lands in the cache.
+    A primary that's too slow counts as a failure for its breaker.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, primary, fallback, budget, breaker, max_workers=8):
+        self.primary = primary
+        self.fallback = fallback
+        self.budget = budget
+        self.breaker = breaker
+        # Separate pools, so a backlog of slow primaries can't hold up the fallback
+        self.executors = {
+            role: ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f"loggingnight-{role}"
+            )
+            for role in ("primary", "fallback")
+        }
+
+    def submit(self, role, provider):
+        # Carry the caller's context along so stage timings land on its request
+        return self.executors[role].submit(
+            contextvars.copy_context().run, provider.lookup
         )
-        sun_rise = dateparser.parse(phenTimes.get("Rise", "00:00"))
-        sun_set = dateparser.parse(phenTimes.get("Set", "23:59"))
-        start_civil_twilight = dateparser.parse(
-            phenTimes.get("Begin Civil Twilight", "00:00")
+
+    def record(self, started, future):
+        seconds = time.perf_counter() - started
+        if future.exception() is not None:
+            outcome = "error"
+            self.breaker.record_failure()
+        elif seconds > self.budget:
+            outcome = "slow"
+            self.breaker.record_failure()
+        else:
+            outcome = "ok"
+            self.breaker.record_success()
+        provider_results.inc(provider=self.primary.name, outcome=outcome)
+
+    def start(self, airport, date, tz=None):
+        """Start the primary's lookup, if its breaker allows, for lookup() to
+        finish; its budget runs from now"""
+        primary = self.primary(airport, date, tz)
+        if not self.breaker.allow():
+            provider_results.inc(provider=self.primary.name, outcome="circuit_open")
+            return primary, None, None
+
+        started = time.perf_counter()
+        future = self.submit("primary", primary)
+        future.add_done_callback(functools.partial(self.record, started))
+        return primary, future, started
+
+    def lookup(self, airport, date, tz=None, pending=None):
+        """Return (provider, times) from whichever provider answered
+
+        pending is what start() returned for the same airport, date and tz,
+        if the primary was started early."""
+        primary, future, started = pending or self.start(airport, date, tz)
+        running = {}
+        if future is not None:
+            running[future] = primary
+            budget = self.budget - (time.perf_counter() - started)
+            done, _ = wait(running, timeout=max(budget, 0))
+            if future in done and future.exception() is None:
+                return primary, future.result()
+
+        fallback = self.fallback(airport, date, tz)
+        running[self.submit("fallback", fallback)] = fallback
+        errors = []
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = running.pop(future)
+                if future.exception() is None:
+                    if provider is fallback:
+                        provider_results.inc(provider=fallback.name, outcome="ok")
+                    return provider, future.result()
+                if provider is fallback:
+                    provider_results.inc(provider=fallback.name, outcome="error")
+                    log.warning(
+                        "The %s provider failed: %s", fallback.name, future.exception()
+                    )
+                errors.append((provider, future.exception()))
+
+        # Report the primary's error, the one a caller would expect
+        raise next((e for provider, e in errors if provider is primary), errors[0][1])
+
+
+PROVIDERS = {
+    provider.name: provider
+    for provider in (USNOProvider, StarfieldProvider, SolarProvider)
+}
+
+
+def find_provider(name):
+    try:
+        return PROVIDERS[name.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unknown provider '{name}', expected one of {', '.join(PROVIDERS)}"
+        ) from None
+
+
+# Where sun times come from when they aren't in the night table
+PRIMARY_PROVIDER = find_provider(os.environ.get("LN_PROVIDER", "usno"))
+
+
+def make_provider_chain():
+    """USNO first, then the fallback, per LN_PROVIDER_* and LN_BREAKER_*
+
+    None when there's no fallback, or the primary provider is local and so
+    has nothing to hedge against."""
+    fallback = os.environ.get("LN_PROVIDER_FALLBACK", "solar").lower()
+    if fallback in ("", "none", "off") or PRIMARY_PROVIDER is not USNOProvider:
+        return None
+
+    return ProviderChain(
+        USNOProvider,
+        find_provider(fallback),
+        budget=float(os.environ.get("LN_PROVIDER_BUDGET_MS", "1500")) / 1000,
+        breaker=CircuitBreaker(
+            USNOProvider.name,
+            threshold=int(os.environ.get("LN_BREAKER_THRESHOLD", "5")),
+            reset_after=float(os.environ.get("LN_BREAKER_RESET", "60")),
+        ),
+        max_workers=int(os.environ.get("LN_PROVIDER_WORKERS", "8")),
+    )
+
+
+provider_chain = make_provider_chain()
+
+
+def needs_ephemeris():
+    """Whether lookups may use Skyfield, so its ephemeris should be loaded up front
+
+    Loading it lazily would put the load, or even the download, of the
+    ephemeris inside the first lookup's latency budget."""
+    fallback = provider_chain.fallback if provider_chain is not None else None
+    return StarfieldProvider in (PRIMARY_PROVIDER, fallback)
+
+
+circuit_open = metrics.Gauge(
+    "loggingnight_circuit_open",
+    "1 while a provider's circuit breaker is open or half open",
+    ("provider",),
+)
+
+
+@circuit_open.add_collector
+def circuit_states():
+    if provider_chain is None:
+        return []
+    breaker = provider_chain.breaker
+    return [({"provider": breaker.name}, int(breaker.state != breaker.CLOSED))]
+
+
+class ResultCache:
+    """A thread-safe LRU cache whose entries also expire after ttl seconds
+
+    An expired entry is kept for another stale_ttl seconds so get_entry()
+    can still hand it out while a fresh one is fetched.
+    """
+
+    def __init__(self, maxsize=4096, ttl=86400, stale_ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_entry(self, key, default=None):
+        """Return (value, stale), where stale means the entry has expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and entry[0] + self.stale_ttl <= now:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default, False
+
+            self._entries.move_to_end(key)
+            if entry[0] <= now:
+                self.stale_hits += 1
+                return entry[1], True
+
+            self.hits += 1
+            return entry[1], False
+
+    def get(self, key, default=None):
+        value, stale = self.get_entry(key, default)
+        return default if stale else value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+lookup_flights = SingleFlight("lookup")
+result_cache = ResultCache(
+    maxsize=int(os.environ.get("LN_RESULT_CACHE_SIZE", "4096")),
+    ttl=int(os.environ.get("LN_RESULT_CACHE_TTL", "86400")),
+    stale_ttl=int(os.environ.get("LN_RESULT_CACHE_STALE_TTL", "86400")),
+)
+
+# USNO sun times by astro_location(), date and UTC offset, see USNOProvider
+astro_cache = ResultCache(
+    maxsize=int(os.environ.get("LN_ASTRO_CACHE_SIZE", "16384")),
+    ttl=int(os.environ.get("LN_ASTRO_CACHE_TTL", "604800")),
+)
+
+
+@cache_lookups.add_collector
+def result_cache_lookups():
+    samples = []
+    for layer, cache in (("result", result_cache), ("astro", astro_cache)):
+        stats = cache.stats()
+        samples.extend(
+            ({"layer": layer, "result": result}, stats[field])
+            for result, field in (
+                ("hit", "hits"),
+                ("stale", "stale_hits"),
+                ("miss", "misses"),
+            )
         )
-        end_civil_twilight = dateparser.parse(
-            phenTimes.get("End Civil Twilight", "23:59")
+    return samples
+
+
+class NightTimes(NamedTuple):
+    """One airport's night times for one date, as kept in the result cache
+
+    airport and usno hold the raw upstream responses, only when KEEP_PAYLOADS
+    is on.
+    """
+
+    icao: str
+    date: datetime.date
+    provider: str
+    name: str
+    city_st: str
+    in_zulu: bool
+    sun_rise: datetime.datetime
+    sun_set: datetime.datetime
+    start_civil_twilight: datetime.datetime
+    end_civil_twilight: datetime.datetime
+    day: str = "normal"
+    airport: dict | None = None
+    usno: dict | None = None
+
+    @property
+    def hour_before_sunrise(self):
+        return currency_times(self.sun_rise, self.sun_set, self.day, self.date)[0]
+
+    @property
+    def hour_after_sunset(self):
+        return currency_times(self.sun_rise, self.sun_set, self.day, self.date)[1]
+
+    def as_dict(self):
+        """The night times as strings, ready to be sent as JSON"""
+        time_format = LoggingNight.time_format(self.in_zulu)
+
+        # pylint: disable=use-dict-literal
+        return dict(
+            airport=self.icao,
+            provider=self.provider,
+            name=self.name,
+            city=self.city_st,
+            date=self.date.isoformat(),
+            sunrise=self.sun_rise.strftime(time_format),
+            sunset=self.sun_set.strftime(time_format),
+            start_civil=self.start_civil_twilight.strftime(time_format),
+            end_civil=self.end_civil_twilight.strftime(time_format),
+            hour_before=self.hour_before_sunrise.strftime(time_format),
+            hour_after=self.hour_after_sunset.strftime(time_format),
+            day=self.day,
         )
 
-        return {
-            "sun_rise": sun_rise,
-            "sun_set": sun_set,
-            "start_civil_twilight": start_civil_twilight,
-            "end_civil_twilight": end_civil_twilight,
-            "in_zulu": in_zulu,
-        }
-
 
 class LoggingNight:
     """Provide an ICAO code and a date and get what the FAA considers night"""
@@ -242,37 +1618,173 @@ class LoggingNight:
     AIRPORTINFO_URL = "https://api.aeronautical.info/dev/"
     ONE_HOUR = datetime.timedelta(hours=1)
 
+    cache_expire_after = None
+    cache_backend = None
+    cache_lock = threading.Lock()
+    cache_collector = CacheCollector()
+    gc_lock = threading.Lock()
+
     @staticmethod
     def enable_cache(expire_after=691200):
-        if "requests_cache" not in modules:
+        requests_cache = requests_cache_module()
+        if requests_cache is None:
             return False
 
-        requests_cache.install_cache(
-            "loggingnight_cache", backend="sqlite", expire_after=expire_after
-        )
+        with LoggingNight.cache_lock:
+            if LoggingNight.cache_expire_after != expire_after:
+                if LoggingNight.cache_backend is None:
+                    try:
+                        LoggingNight.cache_backend = make_backend()
+                    except ImportError as e:
+                        log.warning("Unable to use the %s cache: %s", CACHE_BACKEND, e)
+                        return False
+
+                requests_cache.install_cache(
+                    backend=LoggingNight.cache_backend,
+                    expire_after=expire_after,
+                    stale_while_revalidate=STALE_WHILE_REVALIDATE,
+                )
+                LoggingNight.cache_expire_after = expire_after
+                # Pick up the newly patched, caching requests.Session
+                http_sessions.reset()
         return True
 
+    @staticmethod
+    def disable_cache():
+        """Stop caching upstream responses, undoing enable_cache()"""
+        requests_cache = requests_cache_module()
+        if requests_cache is None:
+            return
+
+        with LoggingNight.cache_lock:
+            if LoggingNight.cache_expire_after is not None:
+                requests_cache.uninstall_cache()
+                LoggingNight.cache_expire_after = None
+                http_sessions.reset()
+
     @staticmethod
     def garbage_collect_cache():
-        if LoggingNight.enable_cache():
-            # BaseCache.delete(expired=True)
-            requests_cache.remove_expired_responses()
-            log.info("running cache garbage collection")
-        else:
+        if not LoggingNight.enable_cache():
             log.info("unable to collect garbage, unable to enable_cache")
+            return None
+
+        if not LoggingNight.gc_lock.acquire(blocking=False):
+            log.info("cache garbage collection already running")
+            return None
+
+        try:
+            log.info("running cache garbage collection")
+            report = LoggingNight.cache_collector.collect(
+                requests_cache_module().get_cache()
+            )
+        finally:
+            LoggingNight.gc_lock.release()
+
+        report["finished"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        gc_report.clear()
+        gc_report.update(report)
+        log.info(
+            "Cache garbage collection scanned %d, evicted %d (%d expired, %d over"
+            " the limit) in %d batches, %.3f seconds",
+            report["scanned"],
+            report["evicted"],
+            report["expired"],
+            report["over_limit"],
+            report["batches"],
+            report["seconds"],
+        )
+        return report
 
     @staticmethod
-    def get_cache_entries():
-        if LoggingNight.enable_cache():
-            cache = requests_cache.get_cache()
-            for entry in cache.values():
-                yield (entry.expires.isoformat(), entry.url)
+    def get_cache_entries(
+        after=None, host=None, airport=None, expires_from=None, expires_to=None
+    ):
+        """Yield a CacheEntry for each cached upstream response, see cache_entries()
+
+        host keeps only responses from that host and airport only the
+        airport information for that identifier."""
+        if not LoggingNight.enable_cache():
+            return
+
+        cache = requests_cache_module().get_cache()
+        for entry in cache_entries(cache, after, expires_from, expires_to):
+            parts = urlsplit(entry.url)
+            if host and parts.hostname != host.lower():
+                continue
+            if airport and (
+                parse_qs(parts.query).get("airport", [""])[0].upper() != airport.upper()
+            ):
+                continue
+            yield entry
 
     class LocationException(IOError):
         """An error occured finding airport location information"""
 
+    @classmethod
+    def find_airport(cls, icao):
+        """Look in the local airport database first and only ask the web API on a miss"""
+        with metrics.timed("airport"):
+            airport = airport_db.lookup(icao)
+            if airport is not None:
+                cache_lookups.inc(layer="airport_db", result="hit")
+                return airport
+
+            cache_lookups.inc(layer="airport_db", result="miss")
+            return web_query(
+                cls.AIRPORTINFO_URL,
+                params={
+                    "appid": "loggingnight",
+                    "airport": icao,
+                    "include": ["demographic", "geographic"],
+                },
+                verify_ssl=True,
+            )
+
+    @staticmethod
+    def timezone_override(zulu=None, offset=None):
+        """Turn the zulu and offset options into the tz string handed to providers"""
+        if offset is not None and zulu is True:
+            raise ValueError("Specify either a timezone offset or Zulu time, not both")
+        if zulu is True:
+            return "0"
+        if offset is not None:
+            return str(offset)
+        return None
+
+    @classmethod
+    def cache_key(cls, icao, date, zulu=None, offset=None):
+        return (icao.strip().upper(), date, cls.timezone_override(zulu, offset))
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def build_and_cache(cls, key, icao, date, zulu=None, offset=None, try_cache=False):
+        result = cls(icao, date, zulu=zulu, offset=offset, try_cache=try_cache).result()
+        result_cache.set(key, result)
+        return result
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def cached(cls, icao, date, zulu=None, offset=None, try_cache=False):
+        """Like LoggingNight().result(), but reuse a recent result for the same airport, date and time zone
+
+        Concurrent misses for the same key share one lookup, and an expired
+        result is returned straight away while a single background lookup
+        replaces it.
+        """
+        key = cls.cache_key(icao, date, zulu, offset)
+        result, stale = result_cache.get_entry(key)
+        args = (key, icao, date, zulu, offset, try_cache)
+        if result is None:
+            result = lookup_flights.do(key, cls.build_and_cache, *args)
+        elif stale:
+            lookup_flights.do_in_background(key, cls.build_and_cache, *args)
+        return result
+
     # pylint: disable=too-many-arguments
-    def __init__(self, icao, date, zulu=None, offset=None, try_cache=False):
+    def __init__(
+        self, icao, date, zulu=None, offset=None, try_cache=False, with_times=True
+    ):
+        """Look up the airport and, unless with_times is False, its night times"""
         self.icao = icao.strip().upper()
         self.date = date
         self.zulu = zulu
@@ -284,43 +1796,117 @@ class LoggingNight:
         else:
             self.cache_enabled = False
 
-        self.tz = None
-        if self.offset is not None and self.zulu is True:
-            raise ValueError("Specify either a timezone offset or Zulu time, not both")
-        if self.zulu is True:
-            self.tz = "0"
-        elif self.offset is not None:
-            self.tz = str(self.offset)
-
-        self.airport = web_query(
-            self.AIRPORTINFO_URL,
-            params={
-                "appid": "loggingnight",
-                "airport": self.icao,
-                "include": ["demographic", "geographic"],
-            },
-            verify_ssl=True,
-        )
-
-        if self.airport["query_stats"]["status_code"] not in {200, 304}:
+        self.tz = self.timezone_override(self.zulu, self.offset)
+        # Ask the USNO about the coordinates in the local airport database
+        # while the rest of the airport is looked up
+        located = airport_db.locate(self.icao) if with_times else None
+        pending = self.start_times(located) if located else None
+
+        self.airport = self.check_airport(self.find_airport(self.icao))
+        if with_times:
+            if pending and not same_place(located, self.airport):
+                pending = None
+            self.astro_provider, times = self.find_times(self.airport, pending)
+            self.use_times(times)
+
+    def check_airport(self, airport):
+        if airport["query_stats"]["status_code"] not in {200, 304}:
             raise self.LocationException(
-                f"Received the following error looking up the airport: {self.airport['query_stats']['status_code']} {self.airport['query_stats']['status_text']}"  # noqa
+                f"Received the following error looking up the airport: {airport['query_stats']['status_code']} {airport['query_stats']['status_text']}"  # noqa
             )
 
         if (
-            "response" not in self.airport
-            or "city" not in self.airport["response"]
-            or not self.airport["response"]["city"]
+            "response" not in airport
+            or "city" not in airport["response"]
+            or not airport["response"]["city"]
         ):
             raise self.LocationException(
                 f"Unable to find location information for {self.icao}.  Make sure you're using an ICAO identifier (for example, KDPA not DPA)"
             )
 
-        # Look up astronomical data here
-        self.astro_provider = USNOProvider(self.airport, self.date, self.tz)
-        # self.astro_provider = StarfieldProvider(self.airport, self.date, self.tz)
-        times = self.astro_provider.lookup()
+        return airport
 
+    def asks_chain(self, airport):
+        """Whether find_times() would go to the provider chain for airport"""
+        if provider_chain is None:
+            return False
+        day = classify_day(
+            seconds_to_degrees(airport["response"]["latitude_secs"]),
+            seconds_to_degrees(airport["response"]["longitude_secs"]),
+            self.date,
+        )
+        ident = airport["response"].get("ident")
+        return day.kind == "normal" and not (
+            ident and night_table.lookup(ident, self.date) is not None
+        )
+
+    def start_times(self, airport):
+        """Start the provider chain's lookup for airport's coordinates, for
+        find_times() to finish, if it will be needed"""
+        if not self.asks_chain(airport):
+            return None
+        return provider_chain.start(airport, self.date, self.tz)
+
+    def find_times(self, airport, pending=None):
+        """Look up astronomical data, computing it only if it wasn't precomputed
+
+        Days the sun doesn't rise, set or leave civil twilight are worked out
+        locally, since every provider agrees on them and there's no point
+        asking the USNO.  pending is start_times() for the same coordinates.
+        """
+        with metrics.timed("astro"):
+            day = classify_day(
+                seconds_to_degrees(airport["response"]["latitude_secs"]),
+                seconds_to_degrees(airport["response"]["longitude_secs"]),
+                self.date,
+            )
+            astro_provider = NightTableProvider(airport, self.date, self.tz)
+            try:
+                times = astro_provider.lookup()
+                cache_lookups.inc(layer="night_table", result="hit")
+                return astro_provider, {"day": "normal", **times}
+            except NightTableProvider.Miss:
+                cache_lookups.inc(layer="night_table", result="miss")
+
+            if day.kind != "normal":
+                astro_provider = SolarProvider(airport, self.date, self.tz)
+            elif provider_chain is not None:
+                astro_provider, times = provider_chain.lookup(
+                    airport, self.date, self.tz, pending
+                )
+                return astro_provider, {"day": "normal", **times}
+            else:
+                astro_provider = PRIMARY_PROVIDER(airport, self.date, self.tz)
+            return astro_provider, {"day": "normal", **astro_provider.lookup()}
+
+    @staticmethod
+    def time_format(in_zulu):
+        if in_zulu:
+            return "%H%M Zulu"
+        return "%I:%M %p"
+
+    def result(self) -> NightTimes:
+        return NightTimes(
+            icao=self.icao,
+            date=self.date,
+            provider=self.astro_provider.name,
+            name=self.name,
+            city_st=self.city_st,
+            in_zulu=self.in_zulu,
+            sun_rise=self.sun_rise,
+            sun_set=self.sun_set,
+            start_civil_twilight=self.start_civil_twilight,
+            end_civil_twilight=self.end_civil_twilight,
+            day=self.day,
+            airport=self.airport if KEEP_PAYLOADS else None,
+            usno=getattr(self.astro_provider, "usno", None) if KEEP_PAYLOADS else None,
+        )
+
+    def as_dict(self):
+        """The night times as strings, ready to be sent as JSON"""
+        return self.result().as_dict()
+
+    def use_times(self, times):
         self.name = self.airport["response"]["name"]
         self.city_st = (
             self.airport["response"]["city"]
@@ -331,14 +1917,143 @@ class LoggingNight:
         self.sun_set = times["sun_set"]
         self.start_civil_twilight = times["start_civil_twilight"]
         self.end_civil_twilight = times["end_civil_twilight"]
-        self.hour_before_sunrise = self.sun_rise - self.ONE_HOUR
-        self.hour_after_sunset = self.sun_set + self.ONE_HOUR
         self.in_zulu = times["in_zulu"]
+        self.day = times.get("day", "normal")
+        self.hour_before_sunrise, self.hour_after_sunset = currency_times(
+            self.sun_rise, self.sun_set, self.day, self.date
+        )
+
+
+def lookup_many(items, max_workers=8, try_cache=False):
+    """Look up many (icao, date, zulu, offset) items on a bounded thread pool
+
+    An item may instead be an exception (say, from read_batch()), which is
+    passed straight through.  Items asking for the same airport, date and time zone are only looked up
+    once.  Yields (position in items, NightTimes or the exception raised)
+    as each lookup finishes, so results can be streamed back out of order.
+    Closing the generator cancels the lookups still waiting for a worker.
+    """
+    jobs = {}
+    positions = {}
+    for position, item in enumerate(items):
+        if isinstance(item, Exception):
+            yield position, item
+            continue
+
+        icao, date, zulu, offset = item
+        try:
+            key = LoggingNight.cache_key(icao, date, zulu, offset)
+        except ValueError as e:
+            yield position, e
+            continue
+        jobs.setdefault(key, (icao, date, zulu, offset))
+        positions.setdefault(key, []).append(position)
+
+    if not jobs:
+        return
+
+    executor = ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="loggingnight-batch"
+    )
+    try:
+        futures = {
+            executor.submit(
+                LoggingNight.cached,
+                icao,
+                date,
+                zulu=zulu,
+                offset=offset,
+                try_cache=try_cache,
+            ): key
+            for key, (icao, date, zulu, offset) in jobs.items()
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                result = e
+            for position in positions[futures[future]]:
+                yield position, result
+    finally:
+        # When the caller stops early (closing the generator), the lookups
+        # that haven't started are dropped instead of waited for
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def read_batch(lines):
+    """Parse "airport[,date[,offset or Z]]" lines into lookup_many() items
+
+    Yields (airport, date, zulu, offset), or a ValueError for a line that
+    can't be understood so the caller can report it in place.
+    """
+    for row in csv.reader(lines):
+        if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+            continue
+
+        fields = [field.strip() for field in row] + ["", ""]
+        try:
+            date = makedate(fields[1]) if fields[1] else datetime.date.today()
+        except (ValueError, OverflowError):
+            yield ValueError(f"Unable to understand date {fields[1]}")
+            continue
+
+        zulu = None
+        offset = None
+        if fields[2].upper() in ("Z", "ZULU"):
+            zulu = True
+        elif fields[2]:
+            try:
+                offset = float(fields[2])
+            except ValueError:
+                yield ValueError(f"Unable to understand offset {fields[2]}")
+                continue
+
+        yield (fields[0], date, zulu, offset)
+
+
+def startup_report():
+    """Seconds each lazily loaded component took to start, None if it hasn't yet"""
+    report = dict.fromkeys(("requests_cache", "timezonefinder", "ephemeris"))
+    report.update(startup_times)
+    report["airport_db"] = airport_db.load_seconds
+    report["night_table"] = night_table.open_seconds
+    return report
+
+
+def warm_up(ephemeris=False, background=False):
+    """Load the lazily initialized components now instead of on the first lookup"""
+
+    def run():
+        started = time.perf_counter()
+        timezones.load()
+        _ = timezones.finder
+        airport_db.load()
+        night_table.open()
+        LoggingNight.enable_cache()
+        if ephemeris:
+            StarfieldProvider.preload()
+        log.info(
+            "Warmed up in %.3f seconds: %s",
+            time.perf_counter() - started,
+            ", ".join(
+                f"{component} {'-' if seconds is None else f'{seconds:.3f}s'}"
+                for component, seconds in startup_report().items()
+            ),
+        )
+
+    if background:
+        thread = threading.Thread(target=run, name="loggingnight-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    run()
+    return None
 
 
 if __name__ == "__main__":
     import argparse
     import pprint
+    import sys
 
     def format_time(t, in_zulu):
         if in_zulu:
@@ -346,8 +2061,18 @@ if __name__ == "__main__":
         return t.strftime("%I:%M %p")
 
     parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "-a", "--airport", help="ICAO code for the airport", required=True
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-a", "--airport", help="ICAO code for the airport")
+    source.add_argument(
+        "--precompute-timezones",
+        action="store_true",
+        help="Look up and save the time zone of every airport in the local database",
+    )
+    source.add_argument(
+        "-b",
+        "--batch",
+        type=argparse.FileType("r"),
+        help='File of "airport[,date[,offset or Z]]" lines ("-" for stdin); prints NDJSON',
     )
     parser.add_argument(
         "-d",
@@ -369,8 +2094,31 @@ if __name__ == "__main__":
         action="store_true",
         help="Attempt to use cache to reduce remote API calls",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=8,
+        help="How many lookups to run at once with --batch",
+    )
     args = parser.parse_args()
 
+    if args.precompute_timezones:
+        airport_db.load()
+        timezones.precompute(airport_db.airports)
+        sys.exit(0)
+
+    if args.batch:
+        for index, result in lookup_many(
+            read_batch(args.batch), max_workers=args.workers, try_cache=args.cache
+        ):
+            if isinstance(result, Exception):
+                line = {"index": index, "error": str(result)}
+            else:
+                line = {"index": index, **result.as_dict()}
+            print(json.dumps(line), flush=True)
+        sys.exit(0)
+
     ln = LoggingNight(
         args.airport,
         args.date,
@@ -0,0 +1,193 @@
+import contextlib
+import contextvars
+import math
+import threading
+import time
+
+# Every metric created, in the order they're rendered by render()
+registry = []
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Stage timings for the request being handled, see start_request()
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+# Seconds spent in stages nested inside the innermost stage being timed
+inner_seconds = contextvars.ContextVar("inner_seconds", default=None)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def format_sample(name, labels, value) -> str:
+    if labels:
+        # Histogram bucket bounds are written like values, 0.5 or +Inf
+        pairs = ",".join(
+            f'{key}="{format_value(v) if key == "le" else escape(v)}"'
+            for key, v in labels.items()
+        )
+        return f"{name}{{{pairs}}} {format_value(value)}"
+    return f"{name} {format_value(value)}"
+
+
+class Metric:
+    """A named family of samples, one per combination of label values
+
+    Besides the values recorded with inc(), set() or observe(), a metric can
+    have collectors: functions called at render time that return
+    (labels dict, value) pairs from counters kept elsewhere.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key)), value
+        for collector in self._collectors:
+            for labels, value in collector():
+                if value is not None:
+                    yield self.name, labels, value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(c), t)) for key, (c, t) in self._values.items()]
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": bound}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format"""
+    families = []
+    for metric in registry:
+        lines = [
+            f"# HELP {metric.name} {escape(metric.documentation)}",
+            f"# TYPE {metric.name} {metric.kind}",
+        ]
+        lines.extend(
+            format_sample(name, labels, value)
+            for name, labels, value in metric.samples()
+        )
+        families.append("\n".join(lines))
+    return "\n".join(families) + "\n"
+
+
+stage_seconds = Histogram(
+    "loggingnight_stage_seconds",
+    "Time spent in each stage of a lookup, not counting the stages inside it",
+    ("stage",),
+)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Time the block as stage, in stage_seconds and the current request's timings
+
+    Stages timed inside the block count towards their own stage only, so
+    the stages of a request add up to no more than the request.
+    """
+    outer = inner_seconds.get()
+    inner = [0.0]
+    token = inner_seconds.set(inner)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        inner_seconds.reset(token)
+        if outer is not None:
+            outer[0] += seconds
+        # Inner stages running on other threads can overlap each other
+        seconds = max(0.0, seconds - inner[0])
+        stage_seconds.observe(seconds, stage=stage)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def start_request():
+    """Start collecting stage timings for this request, returns a token for finish_request()"""
+    return request_timings.set({})
+
+
+def finish_request(token):
+    request_timings.reset(token)
+
+
+def server_timing(total=None) -> str:
+    """The current request's stage timings as a Server-Timing header value"""
+    timings = dict(request_timings.get() or {})
+    if total is not None:
+        timings["total"] = total
+    return ", ".join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+    )
+
+
+# vi: modeline tabstop=8 expandtab shiftwidth=4 softtabstop=4 syntax=python
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+
+import calendar
+import csv
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+
+from loggingnight import (
+    LoggingNight,
+    NightTableProvider,
+    ResultCache,
+    SingleFlight,
+    SolarProvider,
+    classify_day,
+    currency_times,
+    event_times,
+    local_timezone,
+    seconds_to_degrees,
+)
+
+log = logging.getLogger("loggingnight-calendar")
+
+FORMATS = {
+    "json": "application/json",
+    "csv": "text/csv",
+    "ics": "text/calendar",
+}
+
+COLUMNS = (
+    "date",
+    "sunrise",
+    "sunset",
+    "start_civil",
+    "end_civil",
+    "hour_before",
+    "hour_after",
+)
+
+# Rendered calendars, gzip-compressed, keyed by airport, days, time zone and format
+artifacts = ResultCache(
+    maxsize=int(os.environ.get("LN_CALENDAR_CACHE_SIZE", "256")),
+    ttl=int(os.environ.get("LN_CALENDAR_CACHE_TTL", "86400")),
+)
+calendar_flights = SingleFlight("calendar")
+
+ONE_DAY = datetime.timedelta(days=1)
+
+# Days without a sunrise or a sunset
+POLAR_DAYS = ("polar_night", "midnight_sun")
+
+
+def month_days(year: int, month: int) -> tuple[datetime.date, datetime.date]:
+    return (
+        datetime.date(year, month, 1),
+        datetime.date(year, month, calendar.monthrange(year, month)[1]),
+    )
+
+
+def year_days(year: int) -> tuple[datetime.date, datetime.date]:
+    return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+
+
+def fold(line: str, octets: int = 75) -> str:
+    """Fold a long iCalendar content line, RFC 5545 section 3.1
+
+    Lines are limited in UTF-8 octets, not characters, and each folded
+    line starts with a space that counts towards its limit.  Characters
+    are never split across lines.
+    """
+    parts, part, size = [], "", 0
+    for char in line:
+        length = len(char.encode("utf-8"))
+        if size + length > octets:
+            parts.append(part)
+            part, size = " ", 1
+        part += char
+        size += length
+    parts.append(part)
+    return "\r\n".join(parts)
+
+
+class NightCalendar:
+    """Night times for one airport over a run of days, worked out in one pass
+
+    The night table answers if it covers every day; otherwise the solar
+    equations compute them all at once with SolarProvider.batch_lookup(),
+    a year in milliseconds.  Neither asks the USNO or loads the ephemeris.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self, icao, first_day, last_day, zulu=None, offset=None, try_cache=False
+    ):
+        if last_day < first_day:
+            raise ValueError("The calendar ends before it starts")
+
+        ln = LoggingNight(
+            icao, first_day, zulu, offset, try_cache=try_cache, with_times=False
+        )
+        self.icao = ln.icao
+        self.first_day = first_day
+        self.last_day = last_day
+        self.airport = ln.airport
+        self.name = self.airport["response"]["name"]
+        self.city_st = (
+            self.airport["response"]["city"]
+            + ", "
+            + self.airport["response"]["state_code"]
+        )
+        self.tz, self.in_zulu = local_timezone(self.airport, ln.tz)
+
+        # One more day than asked for, so the last night has a morning
+        dates = [
+            first_day + datetime.timedelta(days=day)
+            for day in range((last_day - first_day).days + 2)
+        ]
+        try:
+            self.provider = NightTableProvider.name
+            self.days = [
+                NightTableProvider(self.airport, date, ln.tz).lookup() for date in dates
+            ]
+        except NightTableProvider.Miss:
+            self.provider, self.days = self.compute(dates)
+
+        for date, times in zip(dates, self.days):
+            times["hour_before_sunrise"], times["hour_after_sunset"] = currency_times(
+                times["sun_rise"], times["sun_set"], times["day"], date
+            )
+
+    def compute(self, dates):
+        lat_degs = seconds_to_degrees(self.airport["response"]["latitude_secs"])
+        long_degs = seconds_to_degrees(self.airport["response"]["longitude_secs"])
+        events = SolarProvider.batch_lookup([(lat_degs, long_degs)], dates)
+
+        return SolarProvider.name, [
+            event_times(
+                events,
+                0,
+                column,
+                date,
+                self.tz,
+                classify_day(lat_degs, long_degs, date),
+            )
+            for column, date in enumerate(dates)
+        ]
+
+    def rows(self):
+        """One dict per day, formatted like LoggingNight.as_dict()"""
+        time_format = LoggingNight.time_format(self.in_zulu)
+        for date, times in zip(self.dates(), self.days):
+            yield {
+                "date": date.isoformat(),
+                "sunrise": times["sun_rise"].strftime(time_format),
+                "sunset": times["sun_set"].strftime(time_format),
+                "start_civil": times["start_civil_twilight"].strftime(time_format),
+                "end_civil": times["end_civil_twilight"].strftime(time_format),
+                "hour_before": times["hour_before_sunrise"].strftime(time_format),
+                "hour_after": times["hour_after_sunset"].strftime(time_format),
+            }
+
+    def dates(self):
+        for day in range((self.last_day - self.first_day).days + 1):
+            yield self.first_day + datetime.timedelta(days=day)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "airport": self.icao,
+                "name": self.name,
+                "city": self.city_st,
+                "provider": self.provider,
+                "first": self.first_day.isoformat(),
+                "last": self.last_day.isoformat(),
+                "days": list(self.rows()),
+            }
+        )
+
+    def to_csv(self) -> str:
+        f = io.StringIO()
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(self.rows())
+        return f.getvalue()
+
+    def dark(self, kind, date, times):
+        """The (start, end) parts of date that are night (kind "night") or
+        that count for night currency ("currency"), following times["day"]
+        like logbook.DayEvents: all of a polar night, none of midnight sun"""
+        midnight = datetime.datetime.combine(date, datetime.time(), tzinfo=self.tz)
+        next_midnight = datetime.datetime.combine(
+            date + ONE_DAY, datetime.time(), tzinfo=self.tz
+        )
+        whole_day = [(midnight, next_midnight)]
+        if kind == "night":
+            if times["day"] == "polar_night" and (
+                times["start_civil_twilight"] == times["end_civil_twilight"]
+            ):
+                return whole_day
+            if times["day"] in ("midnight_sun", "no_civil_twilight"):
+                return []
+            parts = [
+                (midnight, times["start_civil_twilight"]),
+                (times["end_civil_twilight"], next_midnight),
+            ]
+        else:
+            if times["day"] == "polar_night":
+                return whole_day
+            if times["day"] == "midnight_sun":
+                return []
+            parts = [
+                (midnight, times["hour_before_sunrise"]),
+                (times["hour_after_sunset"], next_midnight),
+            ]
+        return [(start, end) for start, end in parts if start < end]
+
+    def spans(self, kind):
+        """(date, start, end) for each stretch of kind (see dark()) that
+        starts on the evening of a date in the calendar
+
+        Stretches that meet at midnight are joined, so a polar night that
+        runs for weeks is one event.  A night that ends in the morning but
+        didn't start the evening before belongs to the date before, so the
+        morning of the first day (the tail of the night before) is left out.
+        """
+        spans = []
+        for date, times in zip(self.dates(), self.days):
+            for start, end in self.dark(kind, date, times):
+                if spans and spans[-1][2] == start:
+                    spans[-1][2] = end
+                elif start.time() == datetime.time() != end.time():
+                    spans.append([date - ONE_DAY, start, end])
+                else:
+                    spans.append([date, start, end])
+
+        # self.dates() stops at last_day, so add the morning after it
+        date = self.last_day + ONE_DAY
+        for start, end in self.dark(kind, date, self.days[-1])[:1]:
+            if spans and spans[-1][2] == start:
+                spans[-1][2] = end
+
+        return [
+            tuple(span) for span in spans if self.first_day <= span[0] <= self.last_day
+        ]
+
+    def to_ics(self) -> str:
+        """An event for each night for logging (civil twilight to civil
+        twilight) and each night for currency (an hour after sunset to an
+        hour before sunrise); see spans()"""
+
+        def text(value):
+            return (
+                value.replace("\\", "\\\\")
+                .replace(";", "\\;")
+                .replace(",", "\\,")
+                .replace("\n", "\\n")
+            )
+
+        def utc(dt):
+            return dt.astimezone(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+        stamp = utc(datetime.datetime.now(datetime.timezone.utc))
+        time_format = LoggingNight.time_format(self.in_zulu)
+        lines = [
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            "PRODID:-//loggingnight.org//Night calendar//EN",
+            "CALSCALE:GREGORIAN",
+            f"X-WR-CALNAME:{text(f'Night at {self.icao}')}",
+        ]
+        for kind, summary in (
+            ("night", f"Night at {self.icao}"),
+            ("currency", f"Night landings count at {self.icao}"),
+        ):
+            for date, start, end in self.spans(kind):
+                evening = self.days[(date - self.first_day).days]
+                morning = self.days[(date - self.first_day).days + 1]
+                sunset = (
+                    "No sunset"
+                    if evening["day"] in POLAR_DAYS
+                    else f"Sunset {evening['sun_set'].strftime(time_format)}"
+                )
+                sunrise = (
+                    "no sunrise"
+                    if morning["day"] in POLAR_DAYS
+                    else f"sunrise {morning['sun_rise'].strftime(time_format)}"
+                )
+                description = text(f"{self.name}, {self.city_st}. {sunset}, {sunrise}.")
+                lines.extend(
+                    [
+                        "BEGIN:VEVENT",
+                        f"UID:{date.isoformat()}-{kind}-{self.icao}@loggingnight.org",
+                        f"DTSTAMP:{stamp}",
+                        f"DTSTART:{utc(start)}",
+                        f"DTEND:{utc(end)}",
+                        f"SUMMARY:{text(summary)}",
+                        f"DESCRIPTION:{description}",
+                        "TRANSP:TRANSPARENT",
+                        "END:VEVENT",
+                    ]
+                )
+        lines.append("END:VCALENDAR")
+
+        return "".join(fold(line) + "\r\n" for line in lines)
+
+    def render(self, fmt: str) -> str:
+        match fmt:
+            case "json":
+                return self.to_json()
+            case "csv":
+                return self.to_csv()
+            case "ics":
+                return self.to_ics()
+            case _:
+                raise ValueError(
+                    f"Unknown calendar format '{fmt}', expected one of {', '.join(FORMATS)}"
+                )
+
+
+# pylint: disable=too-many-arguments
+def calendar_artifact(
+    icao, first_day, last_day, fmt="json", zulu=None, offset=None, try_cache=False
+) -> bytes:
+    """The rendered calendar, gzip-compressed, built once and then served from artifacts"""
+    if fmt not in FORMATS:
+        raise ValueError(
+            f"Unknown calendar format '{fmt}', expected one of {', '.join(FORMATS)}"
+        )
+
+    key = LoggingNight.cache_key(icao, first_day, zulu, offset) + (last_day, fmt)
+    artifact = artifacts.get(key)
+    if artifact is not None:
+        return artifact
+
+    def build():
+        started = datetime.datetime.now()
+        night_calendar = NightCalendar(
+            icao, first_day, last_day, zulu=zulu, offset=offset, try_cache=try_cache
+        )
+        artifact = gzip.compress(
+            night_calendar.render(fmt).encode("utf-8"), compresslevel=6, mtime=0
+        )
+        artifacts.set(key, artifact)
+        log.info(
+            "Built the %s calendar for %s, %s to %s, from the %s in %s",
+            fmt,
+            night_calendar.icao,
+            first_day.isoformat(),
+            last_day.isoformat(),
+            night_calendar.provider,
+            datetime.datetime.now() - started,
+        )
+        return artifact
+
+    return calendar_flights.do(key, build)
+
+
+def filename(icao, first_day, last_day, fmt):
+    if (
+        first_day.day == 1
+        and last_day == month_days(first_day.year, first_day.month)[1]
+    ):
+        span = first_day.strftime("%Y-%m")
+    elif (first_day, last_day) == year_days(first_day.year):
+        span = str(first_day.year)
+    else:
+        span = f"{first_day.isoformat()}_{last_day.isoformat()}"
+    ident = "".join(c for c in icao.upper() if c.isalnum())
+    return f"{ident}-{span}.{fmt}"
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    today = datetime.date.today()
+
+    parser = argparse.ArgumentParser(
+        description="Night times for every day of a month or year at one airport"
+    )
+    parser.add_argument("airport", help="ICAO code for the airport")
+    span = parser.add_mutually_exclusive_group()
+    span.add_argument(
+        "-m",
+        "--month",
+        type=lambda value: datetime.datetime.strptime(value, "%Y-%m").date(),
+        help="Month as YYYY-MM, default this month",
+    )
+    span.add_argument("-y", "--year", type=int, help="Whole year")
+    parser.add_argument(
+        "-f", "--format", choices=FORMATS, default="csv", help="Output format"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Where to write the calendar, default stdout",
+    )
+    parser.add_argument(
+        "--offset",
+        type=float,
+        help="Time zone offset in hours from Zulu, -12.0 to +14.0",
+    )
+    parser.add_argument("-z", "--zulu", action="store_true", help="Show times in Zulu")
+    parser.add_argument(
+        "-c",
+        "--cache",
+        action="store_true",
+        help="Attempt to use cache to reduce remote API calls",
+    )
+    args = parser.parse_args()
+
+    if args.year:
+        first, last = year_days(args.year)
+    else:
+        month = args.month or today
+        first, last = month_days(month.year, month.month)
+
+    try:
+        args.output.write(
+            NightCalendar(
+                args.airport,
+                first,
+                last,
+                zulu=args.zulu or None,
+                offset=args.offset,
+                try_cache=args.cache,
+            ).render(args.format)
+        )
+    except (IOError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+
+# vi: modeline tabstop=8 expandtab shiftwidth=4 softtabstop=4 syntax=python
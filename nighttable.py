@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+log = logging.getLogger("loggingnight-nighttable")
+
+NIGHT_TABLE = os.environ.get(
+    "LN_NIGHT_TABLE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "nighttable.bin"),
+)
+
+
+class NightTable:
+    """Precomputed sun events for every airport and day, read through mmap
+
+    The file is a header, a table of fixed-width airport identifiers and then
+    an int16 array indexed by (airport, day) holding, for each of EVENTS, the
+    minutes from 00:00 UTC on that (local) date.  A lookup is one slice of
+    the mapped file.
+    """
+
+    MAGIC = b"LNNT"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHiii")
+    IDENT_SIZE = 8
+    EVENTS = ("start_civil_twilight", "sun_rise", "sun_set", "end_civil_twilight")
+    RECORD = struct.Struct("<" + "h" * len(EVENTS))
+    MISSING = -32768
+
+    def __init__(self, path=NIGHT_TABLE):
+        self.path = path
+        self.first_day = 0
+        self.days = 0
+        self.index: dict[str, int] = {}
+        self._map = None
+        self._data_start = 0
+        self._opened = False
+        self.open_seconds = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        if self._opened:
+            return
+
+        with self._lock:
+            if self._opened:
+                return
+
+            if not os.path.exists(self.path):
+                log.info("No night table at %s", self.path)
+                self._opened = True
+                return
+
+            started = time.perf_counter()
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version, events, first_day, days, airports = self.HEADER.unpack_from(
+                mapped
+            )
+            if (magic, version, events) != (self.MAGIC, self.VERSION, len(self.EVENTS)):
+                log.warning(
+                    "Ignoring %s, it isn't a version %d night table",
+                    self.path,
+                    self.VERSION,
+                )
+                mapped.close()
+                self._opened = True
+                return
+
+            idents_start = self.HEADER.size
+            self.index = {
+                mapped[start : start + self.IDENT_SIZE].rstrip(b"\0").decode("ascii"): i
+                for i, start in enumerate(
+                    range(
+                        idents_start,
+                        idents_start + airports * self.IDENT_SIZE,
+                        self.IDENT_SIZE,
+                    )
+                )
+            }
+            self.first_day = first_day
+            self.days = days
+            self._data_start = idents_start + airports * self.IDENT_SIZE
+            self._map = mapped
+            self.open_seconds = time.perf_counter() - started
+            self._opened = True
+            log.info(
+                "Opened night table %s: %d airports from %s for %d days",
+                self.path,
+                airports,
+                datetime.date.fromordinal(first_day).isoformat(),
+                days,
+            )
+
+    def lookup(self, ident: str, date: datetime.date) -> dict[str, int | None] | None:
+        """Minutes from 00:00 UTC on date for each event, or None if it isn't in the table"""
+        self.open()
+        if self._map is None:
+            return None
+
+        airport = self.index.get(ident)
+        day = date.toordinal() - self.first_day
+        if airport is None or not 0 <= day < self.days:
+            return None
+
+        offset = self._data_start + (airport * self.days + day) * self.RECORD.size
+        minutes = self.RECORD.unpack(self._map[offset : offset + self.RECORD.size])
+        return {
+            event: None if value == self.MISSING else value
+            for event, value in zip(self.EVENTS, minutes)
+        }
+
+    # pylint: disable=too-many-locals
+    @classmethod
+    def build(cls, path, idents, locations, timezones, first_day, last_day, chunk=256):
+        """Compute and write a table for the given airports from first_day to last_day
+
+        idents, locations ((latitude, longitude) pairs) and timezones (names,
+        or None for UTC) describe the airports in table order.  Airports are
+        computed a chunk at a time with StarfieldProvider.batch_lookup() and
+        written straight out, so the whole table never has to fit in memory.
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        from loggingnight import StarfieldProvider
+
+        dates = [
+            first_day + datetime.timedelta(days=day)
+            for day in range((last_day - first_day).days + 1)
+        ]
+        utc_midnights = np.array(dates, dtype="datetime64[D]").astype("datetime64[m]")
+
+        with open(path, "wb") as f:
+            f.write(
+                cls.HEADER.pack(
+                    cls.MAGIC,
+                    cls.VERSION,
+                    len(cls.EVENTS),
+                    first_day.toordinal(),
+                    len(dates),
+                    len(idents),
+                )
+            )
+            for ident in idents:
+                if len(ident) > cls.IDENT_SIZE:
+                    raise ValueError(f"Airport identifier {ident} is too long")
+                f.write(
+                    ident.encode("ascii", "replace")[: cls.IDENT_SIZE].ljust(
+                        cls.IDENT_SIZE, b"\0"
+                    )
+                )
+
+            for start in range(0, len(idents), chunk):
+                events = StarfieldProvider.batch_lookup(
+                    locations[start : start + chunk],
+                    dates,
+                    timezones[start : start + chunk],
+                )
+                table = np.stack([events[event] for event in cls.EVENTS], axis=-1)
+                minutes = (table - utc_midnights[None, :, None]).astype("int64")
+                minutes[np.isnat(table)] = cls.MISSING
+                f.write(minutes.astype("<i2").tobytes())
+                log.info(
+                    "Wrote %d of %d airports",
+                    min(start + chunk, len(idents)),
+                    len(idents),
+                )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # pylint: disable=import-outside-toplevel
+    from loggingnight import airport_db, timezones
+
+    this_year = datetime.date.today().year
+
+    parser = argparse.ArgumentParser(
+        description="Precompute night times for the local airport database"
+    )
+    parser.add_argument(
+        "-o", "--output", default=NIGHT_TABLE, help="Table file to write"
+    )
+    parser.add_argument(
+        "-f",
+        "--first-year",
+        type=int,
+        default=this_year,
+        help="First year in the table",
+    )
+    parser.add_argument(
+        "-l",
+        "--last-year",
+        type=int,
+        default=this_year + 1,
+        help="Last year in the table",
+    )
+    parser.add_argument(
+        "-a",
+        "--airport",
+        action="append",
+        help="Only include this airport (may be repeated), default is every airport",
+    )
+    args = parser.parse_args()
+
+    if args.airport:
+        airports = [airport_db.get(code) for code in args.airport]
+        missing = [
+            code for code, airport in zip(args.airport, airports) if airport is None
+        ]
+        if missing:
+            parser.error(f"Not in the airport database: {', '.join(missing)}")
+    else:
+        airport_db.load()
+        airports = airport_db.airports
+
+    airports = [a for a in airports if len(a.ident) <= NightTable.IDENT_SIZE]
+    if not airports:
+        parser.error("The airport database is empty, see LN_AIRPORT_CSV")
+
+    NightTable.build(
+        args.output,
+        [airport.ident for airport in airports],
+        [(airport.latitude, airport.longitude) for airport in airports],
+        [
+            timezones.zone_at(airport.latitude, airport.longitude)
+            for airport in airports
+        ],
+        datetime.date(args.first_year, 1, 1),
+        datetime.date(args.last_year, 12, 31),
+    )
+    timezones.save()
+
+# vi: modeline tabstop=8 expandtab shiftwidth=4 softtabstop=4 syntax=python
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+import logging
+import time
+
+import numpy as np
+
+log = logging.getLogger("loggingnight-solar")
+
+# Sun altitudes, in degrees, at sunrise/sunset and at civil twilight
+SUNRISE = -0.833
+CIVIL_TWILIGHT = -6.0
+
+# Sun altitude and whether it's rising for each event
+EVENTS = {
+    "start_civil_twilight": (CIVIL_TWILIGHT, True),
+    "sun_rise": (SUNRISE, True),
+    "sun_set": (SUNRISE, False),
+    "end_civil_twilight": (CIVIL_TWILIGHT, False),
+}
+
+# What day_kinds() calls each kind of day, by index
+#   normal             the sun rises, sets and goes below civil twilight
+#   midnight_sun       the sun never sets
+#   polar_night        the sun never rises (it may still reach civil twilight)
+#   no_civil_twilight  the sun sets but civil twilight never ends
+KINDS = ("normal", "midnight_sun", "polar_night", "no_civil_twilight")
+
+# Julian day of 1970-01-01 00:00 UTC
+UNIX_EPOCH_JD = 2440587.5
+
+# Passes refining each event at the sun's position at its own time
+ITERATIONS = 1
+
+
+def sun_position(jd):
+    """Declination (radians) and equation of time (minutes) at Julian day jd
+
+    These are the NOAA solar calculator's equations, after Meeus'
+    Astronomical Algorithms, good to well under a minute of time between
+    1800 and 2100.
+    """
+    t = (jd - 2451545.0) / 36525.0
+
+    mean_long = np.radians((280.46646 + t * (36000.76983 + t * 0.0003032)) % 360)
+    mean_anom = np.radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+    eccent = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    center = (
+        np.sin(mean_anom) * (1.914602 - t * (0.004817 + 0.000014 * t))
+        + np.sin(2 * mean_anom) * (0.019993 - 0.000101 * t)
+        + np.sin(3 * mean_anom) * 0.000289
+    )
+    omega = np.radians(125.04 - 1934.136 * t)
+    apparent_long = np.radians(
+        np.degrees(mean_long) + center - 0.00569 - 0.00478 * np.sin(omega)
+    )
+    obliquity = np.radians(
+        23
+        + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+        + 0.00256 * np.cos(omega)
+    )
+
+    declination = np.arcsin(np.sin(obliquity) * np.sin(apparent_long))
+
+    y = np.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * np.degrees(
+        y * np.sin(2 * mean_long)
+        - 2 * eccent * np.sin(mean_anom)
+        + 4 * eccent * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+        - 0.5 * y * y * np.sin(4 * mean_long)
+        - 1.25 * eccent * eccent * np.sin(2 * mean_anom)
+    )
+    return declination, equation_of_time
+
+
+def parabola(samples):
+    """Coefficients of the parabola through samples taken at 12:00 UTC the
+    day before, on and the day after each date"""
+    return (
+        samples[1][None, :],
+        ((samples[2] - samples[0]) / 2)[None, :],
+        ((samples[2] - 2 * samples[1] + samples[0]) / 2)[None, :],
+    )
+
+
+def evaluate(coefficients, minutes):
+    """A parabola() at minutes after 00:00 UTC on each date"""
+    middle, slope, curve = coefficients
+    days = minutes / 1440 - 0.5
+    return middle + days * (slope + days * curve)
+
+
+def sun_events(locations, dates):
+    """Find civil twilight, sunrise and sunset for many locations and dates
+
+    locations is a sequence of (latitude, longitude) pairs in decimal degrees
+    and dates a sequence of datetime.date.  Each day is the solar day around
+    local solar noon, so it only differs from the local calendar day for
+    events within an hour or so of midnight.
+
+    Returns a dict of event name to a (len(locations), len(dates)) array of
+    UTC datetime64[m], holding NaT where the event doesn't happen, in the
+    same form as StarfieldProvider.batch_lookup().
+    """
+    locations = np.asarray(locations, dtype="float64").reshape(-1, 2)
+    sin_lat = np.sin(np.radians(locations[:, 0:1]))
+    cos_lat = np.cos(np.radians(locations[:, 0:1]))
+    longitudes = locations[:, 1:2]
+    days = np.array(list(dates), dtype="datetime64[D]")
+    midnights = days.astype("int64") + UNIX_EPOCH_JD
+
+    # The sun's declination and the equation of time change slowly and
+    # smoothly enough that a parabola through their values at noon UTC on
+    # the days around each date matches them to well under a second of time,
+    # so they're only worked out three times a date rather than for every event
+    declinations, equations_of_time = (
+        parabola(samples)
+        for samples in sun_position(
+            midnights[None, :] + np.array([[-0.5], [0.5], [1.5]])
+        )
+    )
+
+    # Solar noon, in minutes after 00:00 UTC, as the first guess for each event
+    noon = 720 - 4 * longitudes + np.zeros((1, len(days)))
+
+    results = {}
+    with np.errstate(invalid="ignore"):
+        for name, (altitude, rising) in EVENTS.items():
+            sign = -1 if rising else 1
+            minutes = noon
+            for _ in range(ITERATIONS + 1):
+                declination = evaluate(declinations, minutes)
+                cos_hour_angle = (
+                    np.sin(np.radians(altitude)) - sin_lat * np.sin(declination)
+                ) / (cos_lat * np.cos(declination))
+                hour_angle = np.degrees(np.arccos(cos_hour_angle))
+                minutes = (
+                    720
+                    - 4 * longitudes
+                    - evaluate(equations_of_time, minutes)
+                    + sign * 4 * hour_angle
+                )
+                # Keep refining the events that happen from solar noon
+                minutes = np.where(np.isnan(minutes), noon, minutes)
+
+            happens = ~np.isnan(hour_angle)
+            rows, columns = np.nonzero(happens)
+            result = np.full(happens.shape, "NaT", dtype="datetime64[m]")
+            result[rows, columns] = days[columns].astype("datetime64[m]") + np.floor(
+                minutes[rows, columns] + 0.5
+            ).astype("int64").astype("timedelta64[m]")
+            results[name] = result
+    return results
+
+
+def day_kinds(locations, dates):
+    """Classify each location's dates, and find their solar noons
+
+    The sun is highest at solar noon, 90 - |latitude - declination| degrees
+    up, and lowest at solar midnight, |latitude + declination| - 90; which
+    thresholds those clear says what kind of day it is.
+
+    Returns (len(locations), len(dates)) arrays of indexes into KINDS, of
+    solar noon as UTC datetime64[m], and of the sun's altitude in degrees at
+    solar noon and at solar midnight.
+    """
+    locations = np.asarray(locations, dtype="float64").reshape(-1, 2)
+    latitudes = locations[:, 0:1]
+    longitudes = locations[:, 1:2]
+    days = np.array(list(dates), dtype="datetime64[D]")
+    midnights = days.astype("int64")[None, :] + UNIX_EPOCH_JD
+
+    declination, equation_of_time = sun_position(midnights + 0.5 - longitudes / 360)
+    declination = np.degrees(declination)
+    highest = 90 - np.abs(latitudes - declination)
+    lowest = np.abs(latitudes + declination) - 90
+
+    kinds = np.select(
+        [lowest > SUNRISE, highest < SUNRISE, lowest > CIVIL_TWILIGHT],
+        [
+            KINDS.index("midnight_sun"),
+            KINDS.index("polar_night"),
+            KINDS.index("no_civil_twilight"),
+        ],
+        default=KINDS.index("normal"),
+    )
+    noons = days.astype("datetime64[m]")[None, :] + np.floor(
+        720 - 4 * longitudes - equation_of_time + 0.5
+    ).astype("int64").astype("timedelta64[m]")
+    return kinds, noons, highest, lowest
+
+
+def validate(first_day, last_day, latitudes, longitudes, step=14):
+    """Compare sun_events() with StarfieldProvider.batch_lookup()
+
+    Days are step days apart.  Each location's days are taken in a fixed
+    offset time zone near its solar time, so both see the same days.
+    Returns, for each latitude and event, how many days both found the event,
+    how many only one of them did, and the largest and mean difference in
+    minutes.
+    """
+    # pylint: disable=import-outside-toplevel
+    from loggingnight import StarfieldProvider
+
+    dates = [
+        first_day + datetime.timedelta(days=day)
+        for day in range(0, (last_day - first_day).days + 1, step)
+    ]
+    locations = [(lat, lng) for lat in latitudes for lng in longitudes]
+    zones = [
+        datetime.timezone(datetime.timedelta(hours=round(lng / 15)))
+        for _, lng in locations
+    ]
+
+    started = time.perf_counter()
+    solar = sun_events(locations, dates)
+    solar_seconds = time.perf_counter() - started
+
+    # A day at a time, since batch_lookup() samples every day in its span
+    started = time.perf_counter()
+    days = [StarfieldProvider.batch_lookup(locations, [date], zones) for date in dates]
+    skyfield = {name: np.hstack([day[name] for day in days]) for name in EVENTS}
+    skyfield_seconds = time.perf_counter() - started
+
+    lat_index = np.array([lat for lat, _ in locations])
+    report = {
+        "first_day": first_day.isoformat(),
+        "last_day": last_day.isoformat(),
+        "step_days": step,
+        "locations": len(locations),
+        "days": len(dates),
+        "solar_seconds": round(solar_seconds, 4),
+        "skyfield_seconds": round(skyfield_seconds, 4),
+        "max_minutes": 0,
+        "latitudes": {},
+    }
+    for lat in latitudes:
+        rows = lat_index == lat
+        events = {}
+        for name in EVENTS:
+            ours, theirs = solar[name][rows], skyfield[name][rows]
+            both = ~np.isnat(ours) & ~np.isnat(theirs)
+            errors = np.abs((ours[both] - theirs[both]).astype("int64"))
+            events[name] = {
+                "compared": int(both.sum()),
+                "mismatched": int((np.isnat(ours) != np.isnat(theirs)).sum()),
+                "max_minutes": int(errors.max()) if errors.size else None,
+                "mean_minutes": round(float(errors.mean()), 3) if errors.size else None,
+            }
+            if errors.size:
+                report["max_minutes"] = max(report["max_minutes"], int(errors.max()))
+        report["latitudes"][str(lat)] = events
+    return report
+
+
+def benchmark(locations=1000, days=30, repeat=5, seed=0):
+    """Time sun_events() for locations random airports over days days
+
+    Returns the median of repeat runs, after one to warm up, in seconds and
+    in airport-days a millisecond.
+    """
+    rng = np.random.default_rng(seed)
+    points = list(
+        zip(rng.uniform(-60, 60, locations), rng.uniform(-180, 180, locations))
+    )
+    first_day = datetime.date.today()
+    dates = [first_day + datetime.timedelta(days=day) for day in range(days)]
+
+    sun_events(points, dates)
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        sun_events(points, dates)
+        runs.append(time.perf_counter() - started)
+
+    seconds = float(np.median(runs))
+    return {
+        "locations": locations,
+        "days": days,
+        "repeat": repeat,
+        "median_seconds": round(seconds, 4),
+        "airport_days_per_ms": round(locations * days / seconds / 1000),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    this_year = datetime.date.today().year
+
+    parser = argparse.ArgumentParser(
+        description="Check the solar equations against Skyfield across latitudes and seasons"
+    )
+    parser.add_argument(
+        "-y", "--year", type=int, default=this_year, help="Year to compare"
+    )
+    parser.add_argument(
+        "-s", "--step", type=int, default=14, help="Days between compared days"
+    )
+    parser.add_argument(
+        "-l",
+        "--max-latitude",
+        type=int,
+        default=70,
+        help="Compare latitudes up to this far north and south, every 5 degrees",
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        action="store_true",
+        help="Time 1000 airports over 30 days instead of comparing with Skyfield",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Where to write the report, default stdout",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        result = benchmark()
+    else:
+        result = validate(
+            datetime.date(args.year, 1, 1),
+            datetime.date(args.year, 12, 31),
+            list(range(-args.max_latitude, args.max_latitude + 1, 5)),
+            [-87.5, 0.0, 139.75],
+            step=args.step,
+        )
+    json.dump(result, args.output, indent=2)
+    args.output.write("\n")
+
+# vi: modeline tabstop=8 expandtab shiftwidth=4 softtabstop=4 syntax=python
@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+import pytest
+
+# Keep the caches and data files the modules find at import time out of the
+# working tree, so the modules are only imported once these are set
+scratch = tempfile.mkdtemp(prefix="loggingnight-tests-")
+os.environ.setdefault("LN_CACHE_NAME", os.path.join(scratch, "cache"))
+os.environ.setdefault("LN_TZ_CACHE", os.path.join(scratch, "timezones.json"))
+os.environ.setdefault("LN_AIRPORT_CSV", os.path.join(scratch, "airports.csv"))
+os.environ.setdefault("LN_NIGHT_TABLE", os.path.join(scratch, "nighttable.bin"))
+
+# pylint: disable=import-outside-toplevel
+
+
+def airport_info(lat_degs, long_degs, ident="XTST", name="Test Airport"):
+    """An api.aeronautical.info style response for a made-up airport"""
+    from airports import degrees_to_seconds
+
+    return {
+        "query_stats": {"status_code": 200, "status_text": "OK"},
+        "response": {
+            "ident": ident,
+            "name": name,
+            "city": "Testville",
+            "state_code": "TS",
+            "latitude_secs": degrees_to_seconds(lat_degs, "N", "S"),
+            "longitude_secs": degrees_to_seconds(long_degs, "E", "W"),
+        },
+    }
+
+
+requires_ephemeris = pytest.mark.skipif(
+    not os.path.exists(os.environ.get("LN_EPHEMERIS", "de421.bsp")),
+    reason="needs the JPL ephemeris, see LN_EPHEMERIS",
+)
+
+
+@pytest.fixture
+def airports(monkeypatch):
+    """Made-up airports by identifier, answered instead of the airport web API"""
+    known = {}
+
+    def find_airport(icao):
+        if icao in known:
+            return known[icao]
+        return {
+            "query_stats": {"status_code": 200, "status_text": "OK"},
+            "response": {},
+        }
+
+    monkeypatch.setattr(
+        "loggingnight.LoggingNight.find_airport", staticmethod(find_airport)
+    )
+    return known
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    import loggingnight
+
+    for cache in (loggingnight.result_cache, loggingnight.astro_cache):
+        cache.clear()
+    yield
+
+
+@pytest.fixture
+def local_sun(monkeypatch):
+    """Work sun times out with the solar equations instead of asking the USNO"""
+    import loggingnight
+
+    monkeypatch.setattr(loggingnight, "provider_chain", None)
+    monkeypatch.setattr(loggingnight, "PRIMARY_PROVIDER", loggingnight.SolarProvider)
+
+
+@pytest.fixture
+def client():
+    import webapp
+
+    webapp.rendered_responses.clear()
+    return webapp.application.test_client()
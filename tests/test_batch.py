@@ -0,0 +1,76 @@
+import datetime
+import json
+import threading
+
+from conftest import airport_info
+
+import loggingnight
+from loggingnight import lookup_many, read_batch
+
+
+def lines(response):
+    return sorted(
+        (json.loads(line) for line in response.get_data(as_text=True).splitlines()),
+        key=lambda line: line["index"],
+    )
+
+
+def test_batch_rows(client, airports, local_sun):
+    airports["KDPA"] = airport_info(41.9078, -88.2486, ident="KDPA")
+    response = client.post(
+        "/lookup/batch",
+        json=[
+            {"airport": "KDPA", "date": "2025-03-21", "zulu": True},
+            {"airport": "KDPA", "date": "2025-03-21", "zulu": "false"},
+            {"airport": "KDPA", "date": "2025-03-21", "zulu": False, "offset": -5},
+            {"date": "2025-03-21"},
+            {"airport": "KDPA", "date": "not a date"},
+            {"airport": "KDPA", "date": "2025-03-21", "zulu": True, "offset": 1},
+            {"airport": "KNOPE", "date": "2025-03-21"},
+        ],
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+
+    rows = lines(response)
+    assert [row["index"] for row in rows] == list(range(7))
+    assert rows[0]["sunrise"].endswith("Zulu")
+    assert rows[1]["error"] == "zulu must be true or false"
+    assert not rows[2]["sunrise"].endswith("Zulu")
+    assert rows[3]["error"] == "Each lookup needs an airport"
+    assert rows[4]["error"].startswith("Unable to understand lookup")
+    assert "either a timezone offset or Zulu" in rows[5]["error"]
+    assert "Unable to find location information" in rows[6]["error"]
+
+
+def test_batch_rejects_other_bodies(client):
+    assert client.post("/lookup/batch", json={"airport": "KDPA"}).status_code == 400
+    assert client.post("/lookup/batch", data="KDPA").status_code == 400
+
+
+def test_closing_early_cancels_waiting_lookups(monkeypatch):
+    started = []
+    release = threading.Event()
+
+    def cached(icao, date, **_):
+        started.append(icao)
+        if icao != "K000":
+            release.wait(5)
+        return icao
+
+    monkeypatch.setattr(loggingnight.LoggingNight, "cached", staticmethod(cached))
+    date = datetime.date(2025, 3, 21)
+    results = lookup_many(
+        [(f"K{i:03d}", date, None, None) for i in range(20)], max_workers=2
+    )
+    assert next(results) == (0, "K000")
+    results.close()
+    release.set()
+    assert len(started) <= 3
+
+
+def test_read_batch():
+    items = list(read_batch(["KDPA,2025-03-21,Z", "# comment", "KDPA,,-5", "KDPA,x"]))
+    assert items[0] == ("KDPA", datetime.date(2025, 3, 21), True, None)
+    assert items[1][2:] == (None, -5.0)
+    assert isinstance(items[2], ValueError)
@@ -0,0 +1,124 @@
+import datetime
+
+import pytest
+
+import cachebackends
+from cachebackends import CacheCollector, cache_entries, make_backend
+
+pytest.importorskip("requests_cache")
+
+# pylint: disable=wrong-import-position,wrong-import-order
+from requests_cache import backends
+from requests_cache.models import CachedResponse
+
+NOW = datetime.datetime.now(datetime.timezone.utc)
+HOUR = datetime.timedelta(hours=1)
+
+# Key, host and when each stored response expires
+RESPONSES = [
+    ("k0", "aa.usno.navy.mil", NOW - HOUR),
+    ("k1", "api.aeronautical.info", NOW + HOUR),
+    ("k2", "aa.usno.navy.mil", None),
+    ("k3", "aa.usno.navy.mil", NOW + 30 * HOUR),
+    ("k4", "api.aeronautical.info", NOW + 2 * HOUR),
+]
+
+
+def store(cache, responses=RESPONSES):
+    for key, host, expires in responses:
+        cache.responses[key] = CachedResponse(
+            url=f"https://{host}/{key}", status_code=200, content=b"{}", expires=expires
+        )
+
+
+@pytest.fixture(params=cachebackends.BACKENDS)
+def cache(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(cachebackends, "SHM_DIR", str(tmp_path / "shm"))
+    if request.param == "redis":
+        pytest.importorskip("fakeredis")
+        return make_backend("redis", str(tmp_path / "cache"), url="fakeredis://")
+    return make_backend(request.param, str(tmp_path / "cache"))
+
+
+def test_backends(cache, tmp_path):
+    kinds = {
+        backends.SQLiteCache: "sqlite",
+        backends.FileCache: "file",
+        backends.RedisCache: "redis",
+    }
+    assert type(cache) in kinds
+    if isinstance(cache, backends.FileCache) and "shm" in str(cache.cache_dir):
+        assert str(cache.cache_dir).startswith(str(tmp_path / "shm"))
+
+    store(cache)
+    assert cache.responses["k1"].url == "https://api.aeronautical.info/k1"
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        make_backend("memcached")
+
+
+@pytest.mark.parametrize("batch_size", [2, 500])
+def test_entries_in_key_order(cache, monkeypatch, batch_size):
+    monkeypatch.setattr(cachebackends, "GC_BATCH_SIZE", batch_size)
+    store(cache)
+
+    entries = list(cache_entries(cache))
+    assert [entry.key for entry in entries] == ["k0", "k1", "k2", "k3", "k4"]
+    assert entries[2].expires is None
+    assert all(entry.size > 0 for entry in entries)
+
+
+@pytest.mark.parametrize("batch_size", [2, 500])
+def test_entries_page_after_a_key(cache, monkeypatch, batch_size):
+    monkeypatch.setattr(cachebackends, "GC_BATCH_SIZE", batch_size)
+    store(cache)
+
+    assert [entry.key for entry in cache_entries(cache, after="k1")] == [
+        "k2",
+        "k3",
+        "k4",
+    ]
+    assert not list(cache_entries(cache, after="k4"))
+
+    # Reading a page at a time visits every entry once
+    pages, after = [], None
+    while page := [e.key for e, _ in zip(cache_entries(cache, after=after), "ab")]:
+        pages.append(page)
+        after = page[-1]
+    assert pages == [["k0", "k1"], ["k2", "k3"], ["k4"]]
+
+
+def test_entries_by_expiry(cache):
+    store(cache)
+    keys = [
+        entry.key
+        for entry in cache_entries(cache, expires_from=NOW, expires_to=NOW + 3 * HOUR)
+    ]
+    assert keys == ["k1", "k4"]
+    assert [entry.key for entry in cache_entries(cache, expires_to=NOW)] == ["k0"]
+
+
+def test_collect_keeps_stale_responses(cache):
+    store(cache, RESPONSES + [("k5", "aa.usno.navy.mil", NOW - 48 * HOUR)])
+    report = CacheCollector(pause=0).collect(cache)
+
+    # k0 expired an hour ago, but may still be served while it's refreshed
+    assert sorted(cache.responses.keys()) == ["k0", "k1", "k2", "k3", "k4"]
+    assert report["over_limit"] == 0
+
+
+def test_collect_over_max_entries(cache):
+    store(cache)
+    CacheCollector(pause=0, max_entries=2).collect(cache)
+    assert sorted(cache.responses.keys()) == ["k2", "k3", "k4"]
+
+
+def test_redis_keeps_stale_responses(tmp_path):
+    pytest.importorskip("fakeredis")
+    cache = make_backend("redis", str(tmp_path / "cache"), url="fakeredis://")
+    store(cache)
+    # pylint: disable=protected-access
+    ttl = cache.responses.connection.ttl(cache.responses._bkey("k0"))
+    assert ttl > cachebackends.STALE_WHILE_REVALIDATE - 2 * 3600
@@ -0,0 +1,108 @@
+import datetime
+
+import numpy as np
+import pytest
+from conftest import airport_info
+
+from loggingnight import LoggingNight, SolarProvider, classify_day, event_times
+
+ALASKA = datetime.timezone(datetime.timedelta(hours=-10))
+UTC = datetime.timezone.utc
+
+
+@pytest.mark.parametrize(
+    "lat, long, date, kind",
+    [
+        (41.9078, -88.2486, datetime.date(2026, 6, 21), "normal"),
+        (61.1743, -149.9963, datetime.date(2026, 6, 21), "no_civil_twilight"),
+        (78.2461, 15.4656, datetime.date(2026, 6, 21), "midnight_sun"),
+        (78.2461, 15.4656, datetime.date(2026, 12, 21), "polar_night"),
+        (69.6833, 18.9189, datetime.date(2026, 12, 21), "polar_night"),
+    ],
+)
+def test_classify_day(lat, long, date, kind):
+    day = classify_day(lat, long, date)
+    assert day.kind == kind
+    assert day.highest > day.lowest
+
+
+def times_without(lat, long, date, tz, missing):
+    """A day's times from a provider that found none of the missing events"""
+    events = SolarProvider.batch_lookup([(lat, long)], [date], [tz])
+    for event in missing:
+        events[event][0, 0] = np.datetime64("NaT")
+    return event_times(events, 0, 0, date, tz, classify_day(lat, long, date))
+
+
+@pytest.mark.parametrize(
+    "lat, long, date, tz",
+    [
+        # The sun only just misses rising: solar.day_kinds() calls these
+        # normal, but the USNO (for one) finds no sunrise or sunset
+        (68.5, -150.0, datetime.date(2026, 1, 7), ALASKA),
+        (68.5, -150.0, datetime.date(2026, 12, 4), ALASKA),
+        (-71.0, 15.0, datetime.date(2026, 5, 19), UTC),
+    ],
+)
+def test_sun_that_only_just_misses_rising_stays_down(lat, long, date, tz):
+    day = classify_day(lat, long, date)
+    assert day.kind == "normal"
+
+    times = times_without(lat, long, date, tz, ("sun_rise", "sun_set"))
+    noon = day.solar_noon.astimezone(tz)
+    assert times["sun_rise"] == times["sun_set"] == noon
+    assert times["day"] == "polar_night"
+    assert times["start_civil_twilight"] < noon < times["end_civil_twilight"]
+
+
+def test_civil_twilight_only_at_the_polar_circle():
+    times = times_without(
+        68.5, -150.0, datetime.date(2026, 1, 7), ALASKA, ("sun_rise", "sun_set")
+    )
+    assert times["start_civil_twilight"].strftime("%H:%M") == "09:15"
+    assert times["end_civil_twilight"].strftime("%H:%M") == "14:59"
+    assert times["sun_rise"].strftime("%H:%M") != "00:00"
+
+
+def test_sun_that_only_just_misses_setting_stays_up():
+    date = datetime.date(2026, 5, 22)
+    assert classify_day(68.5, -150.0, date).kind == "no_civil_twilight"
+
+    times = times_without(68.5, -150.0, date, ALASKA, ("sun_rise", "sun_set"))
+    assert times["sun_rise"].strftime("%H:%M") == "00:00"
+    assert times["sun_set"].strftime("%H:%M") == "23:59"
+    assert times["day"] == "midnight_sun"
+
+
+@pytest.mark.parametrize(
+    "lat, long, date, kind",
+    [
+        (41.9078, -88.2486, datetime.date(2026, 6, 21), "normal"),
+        (61.1743, -149.9963, datetime.date(2026, 6, 21), "no_civil_twilight"),
+        (78.2461, 15.4656, datetime.date(2026, 6, 21), "midnight_sun"),
+        (78.2461, 15.4656, datetime.date(2026, 12, 21), "polar_night"),
+    ],
+)
+def test_kind_comes_from_the_missing_events(lat, long, date, kind):
+    times = times_without(lat, long, date, UTC, ())
+    assert times["day"] == kind
+    if kind == "polar_night":
+        assert len({times[event] for event in times if event != "day"}) == 1
+
+
+@pytest.mark.parametrize(
+    "date, hour_before, hour_after",
+    [
+        # Landings never count for currency in midnight sun...
+        (datetime.date(2026, 6, 21), "0000 Zulu", "2359 Zulu"),
+        # ...and count all day in a polar night
+        (datetime.date(2026, 12, 21), "2359 Zulu", "0000 Zulu"),
+    ],
+)
+def test_currency_follows_the_kind_of_day(
+    airports, local_sun, date, hour_before, hour_after
+):
+    airports["ENSB"] = airport_info(78.2461, 15.4656, ident="ENSB")
+    times = LoggingNight("ENSB", date, zulu=True).as_dict()
+    assert times["hour_before"] == hour_before
+    assert times["hour_after"] == hour_after
@@ -0,0 +1,130 @@
+import datetime
+import io
+
+import pytest
+
+import loggingnight
+from logbook import SunEvents, annotate, circular_overlap, read_legs, write_legs
+from loggingnight import NightTimes
+
+DATE = datetime.date(2025, 12, 21)
+UTC = datetime.timezone.utc
+
+# Zulu start of civil twilight, sunrise, sunset and end of civil twilight
+DAYS = {
+    "KDPA": ("12:45", "13:17", "22:25", "22:57", "normal"),
+    "ENSB": ("10:56", "10:56", "10:56", "10:56", "polar_night"),
+    "ENTC": ("08:32", "10:42", "10:42", "12:53", "polar_night"),
+    "SCRM": ("00:00", "00:00", "23:59", "23:59", "midnight_sun"),
+    "PANC": ("00:00", "12:21", "07:42", "23:59", "no_civil_twilight"),
+}
+
+
+def night_times(icao, date):
+    start_civil, sun_rise, sun_set, end_civil, day = DAYS[icao]
+
+    def at(value):
+        return datetime.datetime.combine(
+            date, datetime.time.fromisoformat(value), tzinfo=UTC
+        )
+
+    return NightTimes(
+        icao=icao,
+        date=date,
+        provider="test",
+        name=icao,
+        city_st="",
+        in_zulu=True,
+        sun_rise=at(sun_rise),
+        sun_set=at(sun_set),
+        start_civil_twilight=at(start_civil),
+        end_civil_twilight=at(end_civil),
+        day=day,
+    )
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    made = []
+
+    def cached(icao, date, **_):
+        made.append((icao, date))
+        if icao not in DAYS:
+            raise loggingnight.LoggingNight.LocationException(f"No {icao}")
+        return night_times(icao, date)
+
+    monkeypatch.setattr(loggingnight.LoggingNight, "cached", staticmethod(cached))
+    return made
+
+
+def annotated(departure, arrival, time_out, time_in):
+    legs = [
+        {
+            "date": DATE.isoformat(),
+            "departure": departure,
+            "arrival": arrival,
+            "out": time_out,
+            "in": time_in,
+        }
+    ]
+    return next(annotate(legs, SunEvents()))
+
+
+def test_circular_overlap():
+    assert circular_overlap(0, 120, 60, 30) == 30
+    assert circular_overlap(1400, 1500, 1380, 120) == 100
+    assert circular_overlap(0, 3000, 0, 1440) == 3000
+    assert circular_overlap(0, 3000, 0, 0) == 0
+
+
+@pytest.mark.parametrize(
+    "departure, time_out, time_in, night_minutes, night_landing",
+    [
+        ("KDPA", "2200", "2330", 33, True),
+        ("KDPA", "1500", "1600", 0, False),
+        # The sun never gets up to civil twilight: night all day
+        ("ENSB", "1000", "1130", 90, True),
+        # The sun gets up to civil twilight around noon
+        ("ENTC", "0900", "1000", 0, True),
+        ("ENTC", "1230", "1400", 67, True),
+        # The sun never sets
+        ("SCRM", "2300", "0100", 0, False),
+        # It sets, but it never gets darker than civil twilight
+        ("PANC", "0800", "1000", 0, True),
+    ],
+)
+# pylint: disable=too-many-arguments
+def test_night(lookups, departure, time_out, time_in, night_minutes, night_landing):
+    leg = annotated(departure, departure, time_out, time_in)
+    assert leg["error"] == ""
+    assert leg["night_minutes"] == night_minutes
+    assert leg["night_landing"] is night_landing
+
+
+def test_unknown_airport(lookups):
+    leg = annotated("KNOPE", "KDPA", "2200", "2330")
+    assert leg["night_minutes"] == ""
+    assert "KNOPE" in leg["error"]
+
+
+def test_memo_is_bounded(lookups):
+    sun_events = SunEvents(memo_size=2)
+    for icao in ("KDPA", "ENSB", "KDPA", "ENTC", "ENSB", "KNOPE", "KNOPE"):
+        try:
+            sun_events(icao, DATE)
+        except ValueError:
+            pass
+    assert len(sun_events._events) == 2  # pylint: disable=protected-access
+    assert sun_events.lookups == len(lookups) == 5
+
+
+def test_csv_round_trip(lookups):
+    logbook = io.StringIO(
+        "date,from,to,out,in,remarks\n2025-12-21,KDPA,KDPA,2200,2330,hi\n"
+    )
+    output = io.StringIO()
+    assert write_legs(annotate(read_legs(logbook), SunEvents()), output) == 1
+    assert output.getvalue().splitlines() == [
+        "date,from,to,out,in,remarks,night_minutes,night_landing,error",
+        "2025-12-21,KDPA,KDPA,2200,2330,hi,33,True,",
+    ]
@@ -0,0 +1,37 @@
+import time
+
+import metrics
+
+
+def test_nested_stages_are_not_counted_twice():
+    token = metrics.start_request()
+    try:
+        started = time.perf_counter()
+        with metrics.timed("astro"):
+            time.sleep(0.02)
+            with metrics.timed("upstream"):
+                time.sleep(0.05)
+            with metrics.timed("parse"):
+                time.sleep(0.01)
+        total = time.perf_counter() - started
+        timings = metrics.request_timings.get()
+    finally:
+        metrics.finish_request(token)
+
+    assert set(timings) == {"astro", "upstream", "parse"}
+    assert timings["upstream"] >= 0.05
+    assert 0.02 <= timings["astro"] < 0.05
+    assert sum(timings.values()) <= total
+    assert metrics.inner_seconds.get() is None
+
+
+def test_server_timing():
+    token = metrics.start_request()
+    try:
+        with metrics.timed("render"):
+            pass
+        header = metrics.server_timing(total=0.5)
+    finally:
+        metrics.finish_request(token)
+    assert header.startswith("render;dur=")
+    assert header.endswith(", total;dur=500.0")
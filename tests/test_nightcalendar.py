@@ -0,0 +1,107 @@
+import datetime
+
+import pytest
+from conftest import airport_info
+
+import loggingnight
+from nightcalendar import NightCalendar, fold
+
+NAME = "Aéroport de Sainte-Élisabeth-de-Québec–Côte-Nord Régional"
+
+
+@pytest.fixture
+def calendar(airports):
+    airports["CYQB"] = airport_info(46.7911, -71.3933, ident="CYQB", name=NAME)
+    return NightCalendar(
+        "cyqb ", datetime.date(2025, 11, 1), datetime.date(2025, 11, 3), zulu=True
+    )
+
+
+def test_fold_counts_octets():
+    assert fold("a" * 75) == "a" * 75
+    assert fold("a" * 80) == "a" * 75 + "\r\n " + "a" * 5
+    # A two octet character that would straddle the limit moves down whole
+    assert fold("a" * 74 + "éé") == "a" * 74 + "\r\n éé"
+
+
+def test_calendar_looks_up_the_airport(calendar):
+    assert calendar.icao == "CYQB"
+    assert calendar.provider == "solar"
+    assert calendar.name == NAME
+    assert len(calendar.days) == 4
+
+
+def test_unknown_airport(airports):
+    with pytest.raises(loggingnight.LoggingNight.LocationException):
+        NightCalendar("KNOPE", datetime.date(2025, 11, 1), datetime.date(2025, 11, 1))
+
+
+def test_ics_lines_fit_in_75_octets(calendar):
+    ics = calendar.to_ics()
+    lines = ics.split("\r\n")
+    assert all(len(line.encode("utf-8")) <= 75 for line in lines)
+    assert sum(line.startswith("BEGIN:VEVENT") for line in lines) == 6
+
+    unfolded = ics.replace("\r\n ", "")
+    assert f"DESCRIPTION:{NAME}\\, Testville\\, TS." in unfolded
+
+
+@pytest.fixture
+def svalbard(airports):
+    airports["ENSB"] = airport_info(78.2461, 15.4656, ident="ENSB")
+
+    def events(first_day, last_day, zulu=True):
+        ics = NightCalendar("ENSB", first_day, last_day, zulu=zulu).to_ics()
+        return [
+            dict(line.split(":", 1) for line in event.split("\r\n") if ":" in line)
+            for event in ics.replace("\r\n ", "").split("BEGIN:VEVENT")[1:]
+        ]
+
+    return events
+
+
+def test_ics_has_no_night_in_midnight_sun(svalbard):
+    assert not svalbard(datetime.date(2026, 6, 19), datetime.date(2026, 6, 23))
+
+
+def test_ics_polar_night_lasts_all_day(svalbard):
+    events = svalbard(datetime.date(2026, 12, 19), datetime.date(2026, 12, 23))
+    assert [(event["UID"], event["DTSTART"], event["DTEND"]) for event in events] == [
+        (
+            "2026-12-19-night-ENSB@loggingnight.org",
+            "20261219T000000Z",
+            "20261225T000000Z",
+        ),
+        (
+            "2026-12-19-currency-ENSB@loggingnight.org",
+            "20261219T000000Z",
+            "20261225T000000Z",
+        ),
+    ]
+    assert (
+        events[0]["DESCRIPTION"]
+        == "Test Airport\\, Testville\\, TS. No sunset\\, no sunrise."
+    )
+
+
+def test_ics_events_across_a_polar_year(svalbard):
+    events = svalbard(
+        datetime.date(2026, 1, 1), datetime.date(2026, 12, 31), zulu=False
+    )
+    uids = [event["UID"] for event in events]
+    assert len(uids) == len(set(uids))
+    assert all(event["DTSTART"] < event["DTEND"] for event in events)
+    # Nothing between the last night before midnight sun and the first after
+    starts = sorted(event["DTSTART"] for event in events if "-night-" in event["UID"])
+    assert not [start for start in starts if "20260501" < start < "20260801"]
+
+
+def test_calendar_never_loads_the_ephemeris(airports, monkeypatch):
+    def load():
+        raise AssertionError("the calendar loaded the ephemeris")
+
+    monkeypatch.setattr(loggingnight.StarfieldProvider.shared_ephemeris, "load", load)
+    airports["KDPA"] = airport_info(41.9078, -88.2486, ident="KDPA")
+    days = NightCalendar("KDPA", datetime.date(2025, 1, 1), datetime.date(2025, 12, 31))
+    assert days.provider == "solar"
+    assert len(days.days) == 366
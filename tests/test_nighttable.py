@@ -0,0 +1,55 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import loggingnight
+from nighttable import NightTable
+
+IDENTS = ["KDPA", "ENSB"]
+LOCATIONS = [(41.9078, -88.2486), (78.2461, 15.4656)]
+FIRST_DAY = datetime.date(2025, 12, 20)
+DATES = [FIRST_DAY + datetime.timedelta(days=day) for day in range(5)]
+
+
+@pytest.fixture
+def table(tmp_path, monkeypatch):
+    # The solar equations stand in for Skyfield, so no ephemeris is needed
+    monkeypatch.setattr(
+        loggingnight.StarfieldProvider,
+        "batch_lookup",
+        loggingnight.SolarProvider.batch_lookup,
+    )
+    path = str(tmp_path / "nighttable.bin")
+    NightTable.build(path, IDENTS, LOCATIONS, [None, None], DATES[0], DATES[-1])
+    return NightTable(path)
+
+
+def test_round_trip(table):
+    events = loggingnight.SolarProvider.batch_lookup(LOCATIONS, DATES)
+    for row, ident in enumerate(IDENTS):
+        for column, date in enumerate(DATES):
+            minutes = table.lookup(ident, date)
+            midnight = np.datetime64(date.isoformat(), "m")
+            for event in NightTable.EVENTS:
+                value = events[event][row, column]
+                if np.isnat(value):
+                    assert minutes[event] is None
+                else:
+                    assert minutes[event] == (value - midnight).astype(int)
+
+
+def test_polar_night_is_missing(table):
+    assert set(table.lookup("ENSB", FIRST_DAY).values()) == {None}
+
+
+def test_outside_the_table(table):
+    assert table.lookup("KXYZ", FIRST_DAY) is None
+    assert table.lookup("KDPA", FIRST_DAY - datetime.timedelta(days=1)) is None
+    assert table.lookup("KDPA", DATES[-1] + datetime.timedelta(days=1)) is None
+
+
+def test_other_files_are_ignored(tmp_path):
+    path = tmp_path / "nighttable.bin"
+    path.write_bytes(b"not a night table" * 4)
+    assert NightTable(str(path)).lookup("KDPA", FIRST_DAY) is None
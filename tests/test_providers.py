@@ -0,0 +1,157 @@
+import datetime
+import threading
+
+import pytest
+from conftest import airport_info
+
+import loggingnight
+from loggingnight import CircuitBreaker, ProviderChain
+
+
+def test_breaker_opens_after_threshold_failures():
+    breaker = CircuitBreaker("test", threshold=3, reset_after=60)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow()
+    breaker.record_success()
+    assert breaker.failures == 0
+
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats() == {"state": "open", "failures": 3, "opened": 1}
+
+
+@pytest.mark.parametrize(
+    "trial_succeeds, state",
+    [(True, CircuitBreaker.CLOSED), (False, CircuitBreaker.OPEN)],
+)
+def test_breaker_half_open_trial(trial_succeeds, state):
+    breaker = CircuitBreaker("test", threshold=1, reset_after=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # One trial call once reset_after has passed
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    if trial_succeeds:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    assert breaker.state == state
+    assert breaker.opened == (1 if trial_succeeds else 2)
+
+
+def provider(name, answer=None, error=None, wait=None):
+    class Provider:  # pylint: disable=too-few-public-methods
+        def __init__(self, *args):
+            self.args = args
+
+        def lookup(self):
+            if wait is not None:
+                wait.wait(5)
+            if error is not None:
+                raise error
+            return answer
+
+    Provider.name = name
+    return Provider
+
+
+def chain(primary, fallback, threshold=5):
+    return ProviderChain(
+        primary,
+        fallback,
+        budget=0.05,
+        breaker=CircuitBreaker(primary.name, threshold=threshold, reset_after=60),
+        max_workers=2,
+    )
+
+
+def test_chain_uses_the_primary():
+    providers = chain(provider("usno", "primary"), provider("solar", "fallback"))
+    used, times = providers.lookup({}, None)
+    assert (used.name, times) == ("usno", "primary")
+
+
+def test_chain_falls_back_on_errors_and_opens_the_breaker():
+    providers = chain(
+        provider("usno", error=IOError("down")),
+        provider("solar", "fallback"),
+        threshold=2,
+    )
+    for _ in range(3):
+        used, times = providers.lookup({}, None)
+        assert (used.name, times) == ("solar", "fallback")
+    assert providers.breaker.state == CircuitBreaker.OPEN
+
+
+def test_chain_falls_back_when_the_primary_is_slow():
+    release = threading.Event()
+    providers = chain(
+        provider("usno", "primary", wait=release), provider("solar", "fallback")
+    )
+    try:
+        used, times = providers.lookup({}, None)
+    finally:
+        release.set()
+    assert (used.name, times) == ("solar", "fallback")
+
+
+def test_chain_reports_the_primary_error():
+    providers = chain(
+        provider("usno", error=IOError("usno down")),
+        provider("solar", error=ValueError("solar broken")),
+    )
+    with pytest.raises(IOError, match="usno down"):
+        providers.lookup({}, None)
+
+
+def test_default_fallback_needs_no_ephemeris(monkeypatch):
+    monkeypatch.delenv("LN_PROVIDER_FALLBACK", raising=False)
+    monkeypatch.setattr(loggingnight, "PRIMARY_PROVIDER", loggingnight.USNOProvider)
+    providers = loggingnight.make_provider_chain()
+    assert providers.fallback is loggingnight.SolarProvider
+
+    monkeypatch.setattr(loggingnight, "provider_chain", providers)
+    assert not loggingnight.needs_ephemeris()
+
+    monkeypatch.setenv("LN_PROVIDER_FALLBACK", "starfield")
+    monkeypatch.setattr(
+        loggingnight, "provider_chain", loggingnight.make_provider_chain()
+    )
+    assert loggingnight.needs_ephemeris()
+
+
+def test_usno_starts_while_the_airport_is_looked_up(monkeypatch):
+    date = datetime.date(2026, 3, 1)
+    airport = airport_info(41.9078, -88.2486, ident="KDPA")
+    started = threading.Event()
+
+    class Primary(provider("usno")):
+        def lookup(self):
+            started.set()
+            return loggingnight.SolarProvider(*self.args).lookup()
+
+    def find_airport(icao):
+        # The local database knew the coordinates, so the USNO is already asked
+        assert started.wait(5)
+        return airport
+
+    monkeypatch.setattr(
+        loggingnight,
+        "provider_chain",
+        chain(Primary, provider("solar", error=IOError("unused"))),
+    )
+    monkeypatch.setattr(
+        loggingnight.airport_db,
+        "locate",
+        lambda icao: {"response": airport["response"]},
+    )
+    monkeypatch.setattr(
+        loggingnight.LoggingNight, "find_airport", staticmethod(find_airport)
+    )
+    ln = loggingnight.LoggingNight("KDPA", date, zulu=True)
+    assert ln.astro_provider.name == "usno"
+    assert ln.sun_rise.date() == date
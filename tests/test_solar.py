@@ -0,0 +1,48 @@
+import datetime
+
+import numpy as np
+from conftest import requires_ephemeris
+
+import solar
+
+EQUINOX = datetime.date(2025, 3, 20)
+SOLSTICES = [datetime.date(2025, 6, 21), datetime.date(2025, 12, 21)]
+
+
+def test_equinox_day_is_about_twelve_hours():
+    events = solar.sun_events([(0.0, 0.0), (41.9078, -88.2486)], [EQUINOX])
+    minutes = (events["sun_set"] - events["sun_rise"]).astype("int64")[:, 0]
+    # Refraction and the sun's size add a few minutes either side
+    assert np.all((minutes > 720) & (minutes < 735))
+    twilight = (events["sun_rise"] - events["start_civil_twilight"]).astype("int64")
+    assert np.all((twilight > 20) & (twilight < 35))
+
+
+def test_polar_days_have_no_events():
+    events = solar.sun_events([(78.2461, 15.4656)], SOLSTICES)
+    for name in ("sun_rise", "sun_set"):
+        assert np.all(np.isnat(events[name]))
+    # Civil twilight neither ends in June nor starts in December
+    assert np.isnat(events["end_civil_twilight"][0, 0])
+    assert np.isnat(events["start_civil_twilight"][0, 1])
+
+
+def test_benchmark():
+    result = solar.benchmark(locations=10, days=3, repeat=2)
+    assert result["locations"] == 10 and result["days"] == 3
+    assert result["airport_days_per_ms"] > 0
+
+
+@requires_ephemeris
+def test_agrees_with_skyfield():
+    report = solar.validate(
+        datetime.date(2025, 1, 1),
+        datetime.date(2025, 12, 31),
+        [-60, -35, 0, 42, 65],
+        [-87.5, 139.75],
+        step=30,
+    )
+    assert report["max_minutes"] <= 1
+    for events in report["latitudes"].values():
+        for event in events.values():
+            assert event["mismatched"] == 0
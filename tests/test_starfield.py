@@ -0,0 +1,77 @@
+import datetime
+import sys
+
+import numpy as np
+import pytest
+from conftest import airport_info, requires_ephemeris
+
+import loggingnight
+from loggingnight import StarfieldProvider
+
+UTC = datetime.timezone.utc
+
+
+@requires_ephemeris
+def test_year_search_finds_short_days_near_the_polar_circle():
+    """A search over a whole year finds the same events as one day at a time,
+    including days and twilights shorter than Skyfield's default step"""
+    locations = [(68.5, -150.0), (69.0, -150.0)]
+    dates = [
+        datetime.date(2026, 1, 1) + datetime.timedelta(days=day) for day in range(365)
+    ]
+    year = StarfieldProvider.batch_lookup(locations, dates, [UTC, UTC])
+
+    for date in (
+        datetime.date(2026, 5, 2),
+        datetime.date(2026, 8, 10),
+        datetime.date(2026, 11, 30),
+    ):
+        column = dates.index(date)
+        day = StarfieldProvider.batch_lookup(locations, [date], [UTC, UTC])
+        for event, values in year.items():
+            np.testing.assert_array_equal(values[:, column], day[event][:, 0])
+
+    assert not np.isnat(
+        year["start_civil_twilight"][0, dates.index(datetime.date(2026, 5, 2))]
+    )
+    assert not np.isnat(year["sun_rise"][1, dates.index(datetime.date(2026, 11, 30))])
+
+
+@requires_ephemeris
+def test_batch_lookup_matches_lookup():
+    date = datetime.date(2025, 3, 21)
+    airport = airport_info(41.9078, -88.2486)
+    times = StarfieldProvider(airport, date, "0").lookup()
+    events = StarfieldProvider.batch_lookup([(41.9078, -88.2486)], [date], [UTC])
+    for event, values in events.items():
+        expected = values[0, 0].astype(datetime.datetime).replace(tzinfo=UTC)
+        assert times[event] == expected
+
+
+@requires_ephemeris
+def test_batch_of_many_locations_matches_each_alone():
+    """Low and high latitudes are sampled at different steps, and each
+    location's days start at its own midnight"""
+    locations = [(41.9078, -88.2486), (68.5, -150.0), (-33.9, 151.2), (78.2, 15.5)]
+    zones = ["America/Chicago", "America/Anchorage", "Australia/Sydney", None]
+    dates = [
+        datetime.date(2026, 3, 1) + datetime.timedelta(days=day) for day in range(60)
+    ]
+    batch = StarfieldProvider.batch_lookup(locations, dates, zones)
+    for row, (location, zone) in enumerate(zip(locations, zones)):
+        alone = StarfieldProvider.batch_lookup([location], dates, [zone])
+        for event, values in batch.items():
+            np.testing.assert_array_equal(values[row], alone[event][0])
+
+
+def test_failed_ephemeris_load_is_remembered(monkeypatch):
+    ephemeris = loggingnight.Ephemeris("missing.bsp")
+    monkeypatch.setitem(sys.modules, "skyfield", None)
+    with pytest.raises(ImportError) as first:
+        ephemeris.load()
+
+    # Skyfield is back, but the load isn't tried again
+    monkeypatch.undo()
+    with pytest.raises(ImportError) as again:
+        ephemeris.load()
+    assert again.value is first.value
@@ -0,0 +1,23 @@
+import datetime
+
+import pytest
+
+from loggingnight import astro_location
+
+DATE = datetime.date(2025, 3, 21)
+
+
+@pytest.mark.parametrize(
+    "grid, location",
+    [
+        (0.01, "41.26,-88.25"),
+        (0.025, "41.275,-88.250"),
+        (0.1, "41.3,-88.2"),
+        (0.001, "41.263,-88.249"),
+        # Snapping this far would move the events too much
+        (1, "41.2626,-88.2486"),
+        (0, "41.2626,-88.2486"),
+    ],
+)
+def test_astro_location_snaps_to_the_grid(grid, location):
+    assert astro_location(41.2626, -88.2486, DATE, grid=grid) == location
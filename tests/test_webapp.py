@@ -0,0 +1,72 @@
+import pytest
+from conftest import airport_info
+
+LOOKUP = "/lookup?airport=KDPA&date=2025-03-21"
+
+
+@pytest.fixture
+def kdpa(airports, local_sun):
+    airports["KDPA"] = airport_info(41.9078, -88.2486, ident="KDPA")
+
+
+@pytest.fixture
+def production(monkeypatch):
+    # pylint: disable=import-outside-toplevel
+    import webapp
+
+    monkeypatch.setattr(webapp, "dev_mode", False)
+
+
+def test_etag_and_304(client, kdpa, production):
+    response = client.get(LOOKUP)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    etag = response.headers["ETag"]
+
+    again = client.get(LOOKUP, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+    assert not again.get_data()
+
+    assert client.get(LOOKUP, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_compressed_variant_has_its_own_etag(client, kdpa, production):
+    plain = client.get(LOOKUP)
+    gzipped = client.get(LOOKUP, headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.headers["Vary"] == "Accept-Encoding"
+    assert gzipped.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+
+
+def test_errors_are_not_stored(client, airports, production):
+    response = client.get("/lookup?airport=KNOPE&date=2025-03-21")
+    assert response.status_code == 400
+    assert response.headers["Cache-Control"] == "no-store"
+
+
+def test_dev_mode_pages_are_private(client, kdpa, monkeypatch):
+    # pylint: disable=import-outside-toplevel
+    import webapp
+
+    monkeypatch.setattr(webapp, "dev_mode", True)
+    response = client.get(LOOKUP)
+    assert response.status_code == 200
+    assert "usno_debug" in response.get_json(force=True)
+    assert response.headers["Cache-Control"] == "private, no-store"
+    assert "ETag" not in response.headers
+    assert client.get(LOOKUP, headers={"If-None-Match": "*"}).status_code == 200
+    assert not len(webapp.rendered_responses)
+
+
+def test_prewarm_without_a_rate_limit(client, kdpa, monkeypatch):
+    # pylint: disable=import-outside-toplevel
+    import webapp
+
+    monkeypatch.setattr(webapp, "prewarm_rate", 0)
+    monkeypatch.setattr(webapp, "sitemap_icao_airports", [])
+    monkeypatch.setattr(webapp, "sitemap_faa_airports", ["KDPA"])
+    monkeypatch.setattr(webapp, "airport_requests", webapp.Counter())
+    report = webapp.prewarm_cache(days=2)
+    assert report["computed"] == 2
+    assert report["failed"] == 0
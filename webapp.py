@@ -1,27 +1,77 @@
 #!/usr/bin/env python3
 
 import datetime
+import functools
+import gzip
+import hashlib
 import json
 import os
 import pprint
 import threading
 import time
-from typing import Any
+from collections import Counter
+from typing import Any, NamedTuple
+from urllib.parse import urlsplit
 
 import flask
 import markupsafe
 import schedule
 import sentry_sdk
 from dateutil import parser as dateparser
-from flask import Flask, Response, render_template, request
-
-from loggingnight import LoggingNight
+from flask import Flask, Response, g, render_template, request
+
+import loggingnight
+import metrics
+import nightcalendar
+from loggingnight import (
+    LoggingNight,
+    NightTimes,
+    ResultCache,
+    StarfieldProvider,
+    cache_lookups,
+    gc_report,
+    http_sessions,
+    lookup_flights,
+    lookup_many,
+    result_cache,
+    startup_report,
+    warm_up,
+    web_flights,
+)
 
 sentry_debug: bool = False
 sentry_traces_sample_rate: float = 0.01
 sentry_profiles_sample_rate: float = 0.01
 gc_hours: int = 6
+batch_workers: int = int(os.environ.get("LN_BATCH_WORKERS", "8"))
+batch_max_lookups: int = int(os.environ.get("LN_BATCH_MAX_LOOKUPS", "10000"))
 dev_mode: bool = False
+preload_ephemeris: bool = os.environ.get("LN_PRELOAD_EPHEMERIS", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Daily HH:MM (server time) to pre-warm tomorrow's results, empty to disable
+prewarm_at: str = os.environ.get("LN_PREWARM_AT", "22:00")
+prewarm_days: int = int(os.environ.get("LN_PREWARM_DAYS", "1"))
+prewarm_top_airports: int = int(os.environ.get("LN_PREWARM_TOP_AIRPORTS", "50"))
+# Most pre-warm lookups a second, 0 for no limit
+prewarm_rate: float = float(os.environ.get("LN_PREWARM_RATE", "2"))
+cache_page_size: int = int(os.environ.get("LN_CACHE_PAGE_SIZE", "500"))
+cache_page_max: int = int(os.environ.get("LN_CACHE_PAGE_MAX", "5000"))
+# Rendered / and /lookup responses kept, and for how long at most
+rendered_cache_size: int = int(os.environ.get("LN_RENDERED_CACHE_SIZE", "4096"))
+rendered_cache_ttl: int = int(os.environ.get("LN_RENDERED_CACHE_TTL", "86400"))
+# Seconds browsers and proxies may keep a response for an explicitly given date
+response_max_age: int = int(os.environ.get("LN_RESPONSE_MAX_AGE", "86400"))
+# Send a Server-Timing header with each response's stage timings
+server_timing: bool = os.environ.get("LN_SERVER_TIMING", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# "background", "foreground" or "off": when to load the lazily initialized parts
+warmup: str = os.environ.get("LN_WARMUP", "off").lower()
 
 app_env: str = os.environ.get("ENVIRONMENT", "local")
 match app_env:
@@ -67,6 +117,95 @@ if sentry_dsn is not None:
     )
 
 
+# fmt: off
+sitemap_icao_airports: list[str] = ["VNY", "DVT", "APA", "PRC", "HIO", "FFZ", "IWA", "GFK", "LGB", "SEE", "MYF", "SFB", "SNA", "CHD", "FPR", "FRG", "TMB", \
+                                   "PAO", "RVS", "VRB", "DAB", "PMP", "PVU", "SDL", "RHV", "CNO", "DTO", "BJC", "PDK", "FIN", "SGJ", "ORF", "CRQ", "DCU", \
+                                   "SMO", "ISM", "LVK", "VGT", "EUL", "BFI", "BDN", "HPN", "FXE", "CRG", "CMA", "LAL", "AWO", "ORD", "ATL", "LAX", "DFW", \
+                                   "DEN", "CLT", "LAS", "IAH", "JFK", "SFO", "SEA", "PHX", "EWR", "MIA", "DTW", "MSP", "LGA", "BOS", "PHL", "FLL", "MCO", \
+                                   "DCA", "SLC", "BWI", "IAD", "MDW", "PDX", "MEM", "SAN", "STL", "BNA", "TPA", "HOU", "SJC", "OAK", "SDF", "CVG", "AUS", \
+                                   "DAL", "RDU", "IND", "PIT", "DAB", "OGG", "SMF", "MSY", "SJU", "MCI", "DPA", "ARR", "OKK", "OSH"]
+
+sitemap_faa_airports: list[str] = ["S50", "1R8", "52F", "LL10", "8I3", "ANC", "PANC", "HNL", "PHNL"]
+# fmt: on
+
+
+# How often each airport has been looked up lately, halved at every pre-warm
+airport_requests: Counter[str] = Counter()
+airport_requests_lock = threading.Lock()
+prewarm_report: dict[str, Any] = {}
+
+
+def record_request(icao_identifier: str) -> None:
+    with airport_requests_lock:
+        airport_requests[icao_identifier.strip().upper()] += 1
+        if len(airport_requests) > 10 * prewarm_top_airports:
+            for airport, _ in airport_requests.most_common()[
+                5 * prewarm_top_airports :
+            ]:
+                del airport_requests[airport]
+
+
+def prewarm_cache(days: int | None = None) -> dict[str, Any]:
+    """Look up tomorrow (and the following days) for the sitemap and popular airports"""
+    days = prewarm_days if days is None else days
+
+    with airport_requests_lock:
+        popular = [
+            airport for airport, _ in airport_requests.most_common(prewarm_top_airports)
+        ]
+        for airport, count in list(airport_requests.items()):
+            if count > 1:
+                airport_requests[airport] = count // 2
+            else:
+                del airport_requests[airport]
+
+    airports = list(
+        dict.fromkeys(
+            sitemap_icao_airports
+            + ["K" + airport for airport in sitemap_icao_airports]
+            + sitemap_faa_airports
+            + popular
+        )
+    )
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    dates = [tomorrow + datetime.timedelta(days=day) for day in range(days)]
+
+    started = time.perf_counter()
+    already_warm = computed = failed = 0
+    for date in dates:
+        for airport in airports:
+            if result_cache.get(LoggingNight.cache_key(airport, date)) is not None:
+                already_warm += 1
+                continue
+
+            try:
+                LoggingNight.cached(airport, date, try_cache=True)
+                computed += 1
+            except Exception:  # pylint: disable=broad-exception-caught
+                failed += 1
+            # Only lookups that may have gone upstream count against the rate
+            if prewarm_rate > 0:
+                time.sleep(1 / prewarm_rate)
+
+    total = len(airports) * len(dates)
+    prewarm_report.clear()
+    prewarm_report.update(
+        {
+            "finished": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "seconds": round(time.perf_counter() - started, 3),
+            "dates": [date.isoformat() for date in dates],
+            "airports": len(airports),
+            "popular_airports": len(popular),
+            "already_warm": already_warm,
+            "computed": computed,
+            "failed": failed,
+            "coverage": round((already_warm + computed) / total, 4) if total else 1.0,
+        }
+    )
+    application.logger.info("Cache pre-warm: %s", prewarm_report)
+    return prewarm_report
+
+
 def enable_housekeeping(run_interval: int = 3600):
     cease_continuous_run = threading.Event()
 
@@ -76,97 +215,350 @@ def enable_housekeeping(run_interval: int = 3600):
                 schedule.run_pending()
                 time.sleep(run_interval)
 
-    continuous_thread = ScheduleThread()
+    continuous_thread = ScheduleThread(name="loggingnight-housekeeping", daemon=True)
     continuous_thread.start()
 
     schedule.every(gc_hours).hours.do(LoggingNight.garbage_collect_cache)
+    if prewarm_at:
+        schedule.every().day.at(prewarm_at).do(prewarm_cache)
+
 
+housekeeping_started = threading.Event()
+housekeeping_lock = threading.Lock()
 
-enable_housekeeping()
+# Skyfield answering lookups, even only as the fallback, always preloads
+preload_ephemeris = preload_ephemeris or loggingnight.needs_ephemeris()
+
+match warmup:
+    case "background" | "foreground":
+        warm_up(ephemeris=preload_ephemeris, background=warmup == "background")
+    case _:
+        if preload_ephemeris:
+            StarfieldProvider.preload()
 
 application = Flask(
     "__name__", static_url_path="/assets", static_folder="templates/assets"
 )
 
+
+@application.before_request
+def start_housekeeping() -> None:
+    # Started by the first request rather than at import, so a new or
+    # recycled worker comes up without spinning up the scheduler first
+    if housekeeping_started.is_set():
+        return
+
+    with housekeeping_lock:
+        if not housekeeping_started.is_set():
+            enable_housekeeping()
+            housekeeping_started.set()
+
+
+http_requests = metrics.Counter(
+    "loggingnight_http_requests_total",
+    "Requests handled, by endpoint and status",
+    ("endpoint", "status"),
+)
+request_seconds = metrics.Histogram(
+    "loggingnight_request_seconds",
+    "Time to handle a request, by endpoint (streamed bodies not included)",
+    ("endpoint",),
+)
+startup_seconds = metrics.Gauge(
+    "loggingnight_startup_seconds",
+    "Seconds each lazily loaded component took to start",
+    ("component",),
+)
+startup_seconds.add_collector(
+    lambda: [({"component": c}, s) for c, s in startup_report().items()]
+)
+upstream_requests_by_host = metrics.Counter(
+    "loggingnight_http_session_requests_total",
+    "Requests made through the shared HTTP session, cached or not, by host",
+    ("host",),
+)
+upstream_requests_by_host.add_collector(
+    lambda: [
+        ({"host": host}, count)
+        for host, count in http_sessions.stats()["requests_by_host"].items()
+    ]
+)
+connection_pools = metrics.Gauge(
+    "loggingnight_connection_pool",
+    "Upstream connection pool state, by pool",
+    ("pool", "state"),
+)
+connection_pools.add_collector(
+    lambda: [
+        ({"pool": pool, "state": state}, value)
+        for pool, pool_stats in http_sessions.stats()["pools"].items()
+        for state, value in pool_stats.items()
+    ]
+)
+result_cache_entries = metrics.Gauge(
+    "loggingnight_result_cache_entries", "Results held in the in-process result cache"
+)
+result_cache_entries.add_collector(lambda: [({}, len(result_cache))])
+single_flight_calls = metrics.Counter(
+    "loggingnight_single_flight_total",
+    "Calls made and calls that shared one already in flight",
+    ("flight", "result"),
+)
+single_flight_calls.add_collector(
+    lambda: [
+        ({"flight": flight.name, "result": result}, value)
+        for flight in (web_flights, lookup_flights)
+        for result, value in flight.stats().items()
+    ]
+)
+cache_gc = metrics.Gauge(
+    "loggingnight_cache_gc",
+    "What the last cache garbage collection did",
+    ("measure",),
+)
+cache_gc.add_collector(
+    lambda: [
+        ({"measure": measure}, value)
+        for measure, value in gc_report.items()
+        if isinstance(value, (int, float))
+    ]
+)
+prewarm = metrics.Gauge(
+    "loggingnight_prewarm",
+    "What the last pre-warm did",
+    ("measure",),
+)
+prewarm.add_collector(
+    lambda: [
+        ({"measure": measure}, value)
+        for measure, value in prewarm_report.items()
+        if isinstance(value, (int, float))
+    ]
+)
+
+
+@application.before_request
+def start_request_timing() -> None:
+    g.started = time.perf_counter()
+    g.timings_token = metrics.start_request()
+
+
+@application.after_request
+def record_request_timing(response: Response) -> Response:
+    if "started" not in g:
+        return response
+
+    seconds = time.perf_counter() - g.started
+    endpoint = request.endpoint or "unknown"
+    http_requests.inc(endpoint=endpoint, status=response.status_code)
+    request_seconds.observe(seconds, endpoint=endpoint)
+    if server_timing:
+        response.headers["Server-Timing"] = metrics.server_timing(total=seconds)
+    return response
+
+
+@application.teardown_request
+def finish_request_timing(_exc) -> None:
+    token = g.pop("timings_token", None)
+    if token is not None:
+        metrics.finish_request(token)
+
+
 if dev_mode:
     import pprint
 
+    # Hold on to the upstream responses for the debug output in results
+    loggingnight.KEEP_PAYLOADS = True
+
 application.config["DEBUG"] = dev_mode
 
 
+class RenderedResponse(NamedTuple):
+    status: int
+    mimetype: str
+    etag: str
+    expires: datetime.datetime
+    # The body under each content coding it's stored in, identity always
+    variants: dict[str, bytes]
+
+
+rendered_responses = ResultCache(maxsize=rendered_cache_size, ttl=rendered_cache_ttl)
+
+
+@cache_lookups.add_collector
+def rendered_response_lookups():
+    stats = rendered_responses.stats()
+    return [
+        ({"layer": "rendered", "result": "hit"}, stats["hits"]),
+        ({"layer": "rendered", "result": "miss"}, stats["misses"]),
+    ]
+
+
+@functools.cache
+def brotli_module():
+    """Import brotli the first time it's needed, None if it isn't installed"""
+    try:
+        # pylint: disable=import-outside-toplevel
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def encode_variants(body: bytes) -> dict[str, bytes]:
+    variants = {"identity": body}
+    compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    brotli = brotli_module()
+    if brotli is not None:
+        compressed["br"] = brotli.compress(body)
+    variants.update(
+        (coding, data) for coding, data in compressed.items() if len(data) < len(body)
+    )
+    return variants
+
+
+def expires_at(times: NightTimes | None, date, explicit_date: bool):
+    """When a response about date goes stale: midnight at the end of date, in
+    the time zone its times are in, or response_max_age from now for a page
+    about a date that was given explicitly, which never changes"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if times is None:
+        return now + datetime.timedelta(seconds=response_max_age)
+
+    midnight = datetime.datetime.combine(
+        date + datetime.timedelta(days=1),
+        datetime.time(hour=0, minute=0),
+        tzinfo=times.sun_rise.tzinfo or datetime.timezone.utc,
+    )
+    if explicit_date:
+        return max(midnight, now + datetime.timedelta(seconds=response_max_age))
+    return midnight
+
+
+def rendered(key, render) -> Response:
+    """Respond from rendered_responses, calling render() on a miss
+
+    render returns (body, status, mimetype, expires); only 200s are kept.
+    The response carries a strong ETag and a Cache-Control lifetime that ends
+    at expires, is sent compressed when the client accepts it, and becomes a
+    304 when a GET's If-None-Match already has it.  In dev mode pages carry
+    debug payloads, so they're private, never kept here or in any other
+    cache, and have no ETag.
+    """
+    entry = rendered_responses.get(key)
+    if entry is None or entry.expires <= datetime.datetime.now(datetime.timezone.utc):
+        body, status, mimetype, expires = render()
+        body = body.encode("utf-8")
+        entry = RenderedResponse(
+            status=status,
+            mimetype=mimetype,
+            etag=hashlib.blake2b(body, digest_size=16).hexdigest(),
+            expires=expires,
+            variants=encode_variants(body),
+        )
+        if status == 200 and not dev_mode:
+            rendered_responses.set(key, entry)
+
+    coding = request.accept_encodings.best_match(
+        [coding for coding in ("br", "gzip") if coding in entry.variants],
+        default="identity",
+    )
+    etag = entry.etag if coding == "identity" else f"{entry.etag}-{coding}"
+    max_age = int(
+        (entry.expires - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    )
+    if dev_mode:
+        cache_control = "private, no-store"
+    elif entry.status == 200:
+        cache_control = f"public, max-age={max(0, max_age)}"
+    else:
+        cache_control = "no-store"
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    shared = entry.status == 200 and not dev_mode
+
+    if (
+        shared
+        and request.method in ("GET", "HEAD")
+        and request.if_none_match.contains(etag)
+    ):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(
+            entry.variants[coding],
+            status=entry.status,
+            mimetype=entry.mimetype,
+            headers=headers,
+        )
+        if coding != "identity":
+            response.headers["Content-Encoding"] = coding
+    if not dev_mode:
+        response.set_etag(etag)
+    return response
+
+
 @application.route("/")
-def index() -> tuple[str, int] | str:
+def index() -> Response:
     icao_identifier: str | None = request.args.get("airport")
 
+    explicit_date = "date" in request.args
     try:
         date = dateparser.parse(
             request.args.get("date", datetime.date.today().isoformat())
         ).date()
     except ValueError:
         date = datetime.date.today()
-
-    if icao_identifier:
-        try:
-            result = do_lookup(icao_identifier, date)
-        except Exception as e:
-            result = {
-                "airport": icao_identifier,
-                "date": date.isoformat(),
-                "error": str(e),
-            }
-            return render_template("index.html", dev_mode=dev_mode, result=result), 400
-    else:
-        result = None
-
-    return render_template("index.html", dev_mode=dev_mode, result=result)
-
-
-def do_lookup(icao_identifier: str, date) -> dict[str, str]:
-    ln = LoggingNight(icao_identifier, date, try_cache=True)
-
-    if ln.in_zulu:
-        time_format = "%H%M Zulu"
-    else:
-        time_format = "%I:%M %p"
+        explicit_date = False
+
+    def render():
+        times = None
+        status = 200
+        if icao_identifier:
+            try:
+                times = do_lookup(icao_identifier, date)
+                result = format_result(times, icao_identifier, date)
+            except Exception as e:
+                result = {
+                    "airport": icao_identifier,
+                    "date": date.isoformat(),
+                    "error": str(e),
+                }
+                status = 400
+        else:
+            result = None
+
+        with metrics.timed("render"):
+            page = render_template("index.html", dev_mode=dev_mode, result=result)
+        return page, status, "text/html", expires_at(times, date, explicit_date)
+
+    if not icao_identifier:
+        return rendered(("index", None, None, dev_mode), render)
+
+    response = rendered(("index", icao_identifier, date, dev_mode), render)
+    if response.status_code in (200, 304):
+        record_request(icao_identifier)
+    return response
+
+
+def do_lookup(icao_identifier: str, date) -> NightTimes:
+    return LoggingNight.cached(icao_identifier, date, try_cache=True)
+
+
+def format_result(times: NightTimes, icao_identifier: str, date) -> dict[str, str]:
+    result = times.as_dict()
+    result["airport"] = icao_identifier
+    result["date"] = date.isoformat()
 
     if dev_mode:
-        # pylint: disable=use-dict-literal
-        result = dict(
-            airport=icao_identifier,
-            name=ln.name,
-            city=ln.city_st,
-            date=date.isoformat(),
-            sunrise=ln.sun_rise.strftime(time_format),
-            sunset=ln.sun_set.strftime(time_format),
-            start_civil=ln.start_civil_twilight.strftime(time_format),
-            end_civil=ln.end_civil_twilight.strftime(time_format),
-            hour_before=ln.hour_before_sunrise.strftime(time_format),
-            hour_after=ln.hour_after_sunset.strftime(time_format),
-            airport_debug=pprint.pformat(ln.airport, indent=4),
-            usno_debug=pprint.pformat(ln.astro_provider.usno, indent=4),
-        )
-    else:
-        # pylint: disable=use-dict-literal
-        result = dict(
-            airport=icao_identifier,
-            name=ln.name,
-            city=ln.city_st,
-            date=date.isoformat(),
-            sunrise=ln.sun_rise.strftime(time_format),
-            sunset=ln.sun_set.strftime(time_format),
-            start_civil=ln.start_civil_twilight.strftime(time_format),
-            end_civil=ln.end_civil_twilight.strftime(time_format),
-            hour_before=ln.hour_before_sunrise.strftime(time_format),
-            hour_after=ln.hour_after_sunset.strftime(time_format),
-        )
+        result["airport_debug"] = pprint.pformat(times.airport, indent=4)
+        result["usno_debug"] = pprint.pformat(times.usno, indent=4)
 
     return result
 
 
-@application.route("/lookup", methods=["POST"])
-def lookup() -> tuple[str, int] | str:
-    icao_identifier = markupsafe.escape(request.form["airport"])
-    datestring = markupsafe.escape(request.form["date"])
+@application.route("/lookup", methods=["GET", "POST"])
+def lookup() -> Response | tuple[str, int]:
+    icao_identifier = markupsafe.escape(request.values["airport"])
+    datestring = markupsafe.escape(request.values.get("date", ""))
 
     if datestring:
         try:
@@ -176,30 +568,241 @@ def lookup() -> tuple[str, int] | str:
     else:
         date = datetime.date.today()
 
+    def render():
+        try:
+            times = do_lookup(icao_identifier, date)
+            result: dict[str, str] = format_result(times, icao_identifier, date)
+        except Exception as e:
+            return str(e), 400, "text/html", expires_at(None, date, False)
+        except:  # pylint: disable=bare-except # noqa
+            flask.abort(500)
+
+        with metrics.timed("render"):
+            body = json.dumps(result)
+        return body, 200, "text/html", expires_at(times, date, bool(datestring))
+
+    response = rendered(("lookup", str(icao_identifier), date, dev_mode), render)
+    if response.status_code in (200, 304):
+        record_request(icao_identifier)
+    return response
+
+
+@application.route("/lookup/batch", methods=["POST"])
+def lookup_batch() -> Response | tuple[str, int]:
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get("lookups")
+    if not isinstance(body, list):
+        return (
+            'Expected a JSON list of {"airport", "date", "zulu", "offset"} objects',
+            400,
+        )
+    if len(body) > batch_max_lookups:
+        return f"At most {batch_max_lookups} lookups per batch", 400
+
+    items: list[Any] = []
+    for entry in body:
+        if isinstance(entry, str):
+            entry = {"airport": entry}
+        if not isinstance(entry, dict) or not entry.get("airport"):
+            items.append(ValueError("Each lookup needs an airport"))
+            continue
+
+        zulu = entry.get("zulu")
+        if zulu is not None and not isinstance(zulu, bool):
+            items.append(ValueError("zulu must be true or false"))
+            continue
+
+        datestring = entry.get("date")
+        try:
+            date = (
+                dateparser.parse(datestring).date()
+                if datestring
+                else datetime.date.today()
+            )
+            offset = entry.get("offset")
+            offset = float(offset) if offset not in (None, "") else None
+        except (TypeError, ValueError, OverflowError) as e:
+            items.append(ValueError(f"Unable to understand lookup: {e}"))
+            continue
+
+        items.append((str(entry["airport"]), date, zulu or None, offset))
+
+    def generate():
+        results = lookup_many(items, max_workers=batch_workers, try_cache=True)
+        try:
+            for index, result in results:
+                if isinstance(result, Exception):
+                    line: dict[str, Any] = {"index": index, "error": str(result)}
+                else:
+                    line = {
+                        "index": index,
+                        **format_result(result, items[index][0], items[index][1]),
+                    }
+                yield json.dumps(line) + "\n"
+        finally:
+            # Also run when the client goes away mid-stream, so the lookups
+            # nobody is waiting for any more are cancelled
+            results.close()
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@application.route("/calendar")
+def night_calendar() -> Response | tuple[str, int]:
+    """Night times for every day of a month (month=YYYY-MM, the default is
+    this month) or a year (year=YYYY) as JSON, CSV or iCalendar"""
+    icao_identifier = request.args.get("airport")
+    if not icao_identifier:
+        return "Specify an airport", 400
+
+    fmt = request.args.get("format", "json").lower()
+    if fmt not in nightcalendar.FORMATS:
+        return (
+            f"Unknown calendar format {markupsafe.escape(fmt)}, expected one of "
+            + ", ".join(nightcalendar.FORMATS),
+            400,
+        )
+
     try:
-        result: dict[str, str] = do_lookup(icao_identifier, date)
+        if request.args.get("year"):
+            first_day, last_day = nightcalendar.year_days(int(request.args["year"]))
+        else:
+            month = datetime.datetime.strptime(
+                request.args.get("month", datetime.date.today().strftime("%Y-%m")),
+                "%Y-%m",
+            )
+            first_day, last_day = nightcalendar.month_days(month.year, month.month)
+        offset = request.args.get("offset")
+        offset = float(offset) if offset else None
+        zulu = request.args.get("zulu", "").lower() in ("1", "true", "yes") or None
+        artifact = nightcalendar.calendar_artifact(
+            icao_identifier, first_day, last_day, fmt, zulu, offset, try_cache=True
+        )
     except Exception as e:
-        return str(e), 400
-    except:  # pylint: disable=bare-except # noqa
-        flask.abort(500)
+        return markupsafe.escape(str(e)), 400
 
-    return json.dumps(result)
+    record_request(icao_identifier)
+    response = Response(mimetype=nightcalendar.FORMATS[fmt])
+    if "gzip" in request.accept_encodings:
+        response.set_data(artifact)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response.set_data(gzip.decompress(artifact))
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Content-Disposition"] = (
+        "attachment; filename="
+        + nightcalendar.filename(icao_identifier, first_day, last_day, fmt)
+    )
+    return response
 
 
-@application.route("/displayCache")
-def displayCache() -> Response:
-    if LoggingNight.enable_cache():
-        return Response(
-            json.dumps(
-                list(
-                    (str(timestamp), url)
-                    for timestamp, url in LoggingNight.get_cache_entries()
+# Upper bounds of the expiry histogram in /displayCache?summary=1
+EXPIRY_BUCKETS = (
+    ("1h", datetime.timedelta(hours=1)),
+    ("1d", datetime.timedelta(days=1)),
+    ("7d", datetime.timedelta(days=7)),
+    ("30d", datetime.timedelta(days=30)),
+)
+
+
+def parse_expiry(name: str) -> datetime.datetime | None:
+    value = request.args.get(name)
+    if not value:
+        return None
+    when = dateparser.parse(value)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when
+
+
+def summarize_cache(entries) -> dict[str, Any]:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    histogram = Counter({"expired": 0, "never": 0, "later": 0})
+    histogram.update({bucket: 0 for bucket, _ in EXPIRY_BUCKETS})
+    hosts: Counter = Counter()
+    count = size = 0
+    for entry in entries:
+        count += 1
+        size += entry.size
+        hosts[urlsplit(entry.url).netloc] += 1
+        if entry.expires is None:
+            histogram["never"] += 1
+        elif entry.expires <= now:
+            histogram["expired"] += 1
+        else:
+            histogram[
+                next(
+                    (
+                        bucket
+                        for bucket, limit in EXPIRY_BUCKETS
+                        if entry.expires - now <= limit
+                    ),
+                    "later",
                 )
-            ),
-            mimetype="application/json",
-        )
+            ] += 1
 
-    return Response(response="", status=204)
+    return {
+        "entries": count,
+        "size": size,
+        "expires": dict(histogram),
+        "hosts": dict(hosts),
+    }
+
+
+@application.route("/displayCache")
+def displayCache() -> Response | tuple[str, int]:
+    """Stream the cache as NDJSON, a page at a time
+
+    Each line is one entry; the last line holds next_cursor, which is passed
+    back as cursor for the following page (null after the last one).
+    summary=1 returns counts, total size and an expiry histogram instead.
+    """
+    if not LoggingNight.enable_cache():
+        return Response(response="", status=204)
+
+    try:
+        limit = int(request.args.get("limit", cache_page_size))
+        limit = max(1, min(limit, cache_page_max))
+        filters = {
+            "host": request.args.get("host"),
+            "airport": request.args.get("airport"),
+            "expires_from": parse_expiry("expires_from"),
+            "expires_to": parse_expiry("expires_to"),
+        }
+    except (TypeError, ValueError, OverflowError) as e:
+        return f"Unable to understand cache query: {e}", 400
+
+    if request.args.get("summary", "").lower() in ("1", "true", "yes"):
+        return flask.jsonify(summarize_cache(LoggingNight.get_cache_entries(**filters)))
+
+    entries = LoggingNight.get_cache_entries(
+        after=request.args.get("cursor") or None, **filters
+    )
+
+    def generate():
+        last_key = next_cursor = None
+        for count, entry in enumerate(entries):
+            if count == limit:
+                next_cursor = last_key
+                break
+            last_key = entry.key
+            yield json.dumps(
+                {
+                    "key": entry.key,
+                    "url": entry.url,
+                    "expires": entry.expires.isoformat() if entry.expires else None,
+                    "size": entry.size,
+                }
+            ) + "\n"
+        yield json.dumps({"next_cursor": next_cursor}) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@application.route("/metrics")
+def metrics_endpoint() -> Response:
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @application.route("/sitemap.txt")
@@ -207,20 +810,10 @@ def displayCache() -> Response:
 def sitemap() -> tuple[str, int, dict[str, str]]:
     # pylint: disable=consider-using-f-string
     base_url = "https://loggingnight.org/?airport="
-    # fmt: off
-    icao_airports = ["VNY", "DVT", "APA", "PRC", "HIO", "FFZ", "IWA", "GFK", "LGB", "SEE", "MYF", "SFB", "SNA", "CHD", "FPR", "FRG", "TMB", \
-                     "PAO", "RVS", "VRB", "DAB", "PMP", "PVU", "SDL", "RHV", "CNO", "DTO", "BJC", "PDK", "FIN", "SGJ", "ORF", "CRQ", "DCU", \
-                     "SMO", "ISM", "LVK", "VGT", "EUL", "BFI", "BDN", "HPN", "FXE", "CRG", "CMA", "LAL", "AWO", "ORD", "ATL", "LAX", "DFW", \
-                     "DEN", "CLT", "LAS", "IAH", "JFK", "SFO", "SEA", "PHX", "EWR", "MIA", "DTW", "MSP", "LGA", "BOS", "PHL", "FLL", "MCO", \
-                     "DCA", "SLC", "BWI", "IAD", "MDW", "PDX", "MEM", "SAN", "STL", "BNA", "TPA", "HOU", "SJC", "OAK", "SDF", "CVG", "AUS", \
-                     "DAL", "RDU", "IND", "PIT", "DAB", "OGG", "SMF", "MSY", "SJU", "MCI", "DPA", "ARR", "OKK", "OSH"]
-
-    faa_airports = ["S50", "1R8", "52F", "LL10", "8I3", "ANC", "PANC", "HNL", "PHNL"]
-    # fmt: on
-
-    urls = ["%s%s" % (base_url, airport) for airport in icao_airports]
-    urls.extend(["%sK%s" % (base_url, airport) for airport in icao_airports])
-    urls.extend(["%s%s" % (base_url, airport) for airport in faa_airports])
+
+    urls = ["%s%s" % (base_url, airport) for airport in sitemap_icao_airports]
+    urls.extend(["%sK%s" % (base_url, airport) for airport in sitemap_icao_airports])
+    urls.extend(["%s%s" % (base_url, airport) for airport in sitemap_faa_airports])
     urls.append("%sKOKK&date=1983-08-23" % base_url)
 
     return ("\n".join(urls), 200, {"Content-Type": "text/plain"})